@@ -0,0 +1,290 @@
+"""
+Benchmarks for the text ingestion path: whitespace normalisation, chunking, PDF parsing
+and DB batching (against a mocked collection).
+
+Corpora are generated from a fixed seed, so results are comparable across commits.
+Throughput and peak memory are written to a JSON file, e.g.:
+
+    python benchmarks/run_benchmarks.py --sizes 10KB,1MB,10MB,100MB
+    python benchmarks/run_benchmarks.py --only chunk --output before.json
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Any
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import distyll.db
+import distyll.text
+from distyll.text.text import _parse_pdf
+from distyll.utils import (
+    chunk_text,
+    chunk_text_by_num_chars,
+    chunk_text_by_num_words,
+    iter_chunk_text,
+    remove_multiple_whitespaces,
+)
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+TEST_PDF = REPO_DIR / "tests" / "test_data" / "1706.03762.pdf"
+SIZE_UNITS = {"KB": 1_000, "MB": 1_000_000, "GB": 1_000_000_000}
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size such as "10KB" or "100MB" to a number of bytes
+    :param size:
+    :return:
+    """
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def generate_corpus(n_bytes: int, seed: int = 0) -> str:
+    """
+    Generate a reproducible English-like corpus of roughly `n_bytes` characters,
+    with irregular whitespace (double spaces, newlines, tabs) like parsed PDFs have
+    :param n_bytes: Target size
+    :param seed: Random seed
+    :return: Corpus text
+    """
+    rng = random.Random(seed)
+    letters = "etaoinshrdlcumwfgypbvkjxqz"
+    vocabulary = [
+        "".join(rng.choices(letters, k=rng.randint(1, 10))) for _ in range(5000)
+    ]
+    separators = [" "] * 20 + ["  ", "\n", " \n", "\t", "\n\n"]
+
+    # Build a ~1 MB block and tile it, as generating 100 MB word by word is slow
+    block_size = min(n_bytes, 1_000_000)
+    pieces = list()
+    length = 0
+    while length < block_size:
+        word = rng.choice(vocabulary) + rng.choice(separators)
+        pieces.append(word)
+        length += len(word)
+    block = "".join(pieces)
+    return (block * (n_bytes // len(block) + 1))[:n_bytes]
+
+
+def split_pages(text: str, page_size: int = 3000) -> List[str]:
+    return [text[i : i + page_size] for i in range(0, len(text), page_size)]
+
+
+class FakeBatch:
+    def __init__(self):
+        self.n_objects = 0
+
+    def add_object(self, properties=None, uuid=None, vector=None):
+        self.n_objects += 1
+
+
+class FakeCollection:
+    def __init__(self):
+        self.batch = self
+        self.query = self
+        self.data = self
+        self.failed_objects = list()
+
+    @contextmanager
+    def fixed_size(self, batch_size=100, concurrent_requests=2):
+        yield FakeBatch()
+
+    def fetch_objects(self, **kwargs):
+        return SimpleNamespace(objects=[])
+
+    def delete_many(self, where):
+        return SimpleNamespace(successful=0)
+
+
+class FakeClient:
+    """Stand-in for a WeaviateClient that accepts and discards objects"""
+
+    def __init__(self):
+        self.collections = self
+        self._collection = FakeCollection()
+
+    def exists(self, name):
+        return True
+
+    def get(self, name):
+        return self._collection
+
+
+def bench_db_batching(text: str) -> int:
+    """
+    Run add_arxiv_to_db (chunking, UUID generation and batch insertion) against a mocked collection
+    """
+    from_arxiv_paper = distyll.text.from_arxiv_paper
+    distyll.text.from_arxiv_paper = lambda url, **kwargs: {
+        "title": "Benchmark",
+        "url": url,
+        "text": text,
+    }
+    try:
+        return distyll.db.add_arxiv_to_db(FakeClient(), "https://arxiv.org/abs/0000.00000")
+    finally:
+        distyll.text.from_arxiv_paper = from_arxiv_paper
+
+
+def drain(iterator) -> int:
+    return sum(1 for _ in iterator)
+
+
+# name -> function of the corpus; each is run once per corpus size
+TEXT_BENCHMARKS: Dict[str, Callable[[str], Any]] = {
+    "remove_multiple_whitespaces": remove_multiple_whitespaces,
+    "chunk_text_by_num_words": lambda text: chunk_text_by_num_words(
+        remove_multiple_whitespaces(text)
+    ),
+    "chunk_text_by_num_chars": lambda text: chunk_text_by_num_chars(
+        remove_multiple_whitespaces(text)
+    ),
+    "chunk_text[words]": lambda text: chunk_text(text, method="words"),
+    "chunk_text[chars]": lambda text: chunk_text(text, method="chars"),
+    "iter_chunk_text[words,pages]": lambda text: drain(
+        iter_chunk_text(split_pages(text))
+    ),
+    "iter_chunk_text[chars,pages]": lambda text: drain(
+        iter_chunk_text(split_pages(text), method="chars")
+    ),
+    "db_batching[arxiv]": bench_db_batching,
+}
+
+# name -> function of the bundled PDF
+PDF_BENCHMARKS: Dict[str, Callable[[Path], Any]] = {
+    "parse_pdf[1 worker]": lambda path: _parse_pdf(path),
+    "parse_pdf[4 workers]": lambda path: _parse_pdf(path, max_workers=4),
+}
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    Time a function (best of `repeat` runs), then measure the peak of Python allocations in this
+    process (so not in worker processes) in a separate run,
+    as tracing slows the code down
+    :param func:
+    :param repeat:
+    :return: Dictionary with "seconds" and "peak_mem_mb"
+    """
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mem_mb": peak / 1_000_000}
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def run(sizes: List[str], repeat: int, only: str) -> Dict[str, Any]:
+    results = list()
+    for size in sizes:
+        n_bytes = parse_size(size)
+        corpus = generate_corpus(n_bytes)
+        for name, func in TEXT_BENCHMARKS.items():
+            if only and only not in name:
+                continue
+            stats = measure(lambda: func(corpus), repeat)
+            result = {
+                "benchmark": name,
+                "size": size,
+                "size_bytes": n_bytes,
+                **stats,
+                "mb_per_s": n_bytes / 1_000_000 / stats["seconds"],
+            }
+            print(
+                f"{name:32} {size:>8} {stats['seconds']:9.4f}s "
+                f"{result['mb_per_s']:9.2f} MB/s {stats['peak_mem_mb']:9.2f} MB peak"
+            )
+            results.append(result)
+
+    n_bytes = TEST_PDF.stat().st_size
+    for name, func in PDF_BENCHMARKS.items():
+        if only and only not in name:
+            continue
+        stats = measure(lambda: func(TEST_PDF), repeat)
+        result = {
+            "benchmark": name,
+            "size": TEST_PDF.name,
+            "size_bytes": n_bytes,
+            **stats,
+            "mb_per_s": n_bytes / 1_000_000 / stats["seconds"],
+        }
+        print(
+            f"{name:32} {TEST_PDF.name:>8} {stats['seconds']:9.4f}s "
+            f"{result['mb_per_s']:9.2f} MB/s {stats['peak_mem_mb']:9.2f} MB peak"
+        )
+        results.append(result)
+
+    return {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="10KB,100KB,1MB,10MB,100MB",
+        help="Comma-separated corpus sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Timed runs per benchmark (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--only", default="", help="Only run benchmarks whose name contains this string"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Output JSON path (default: benchmarks/results/<commit>.json)",
+    )
+    args = parser.parse_args()
+    # distyll logs every chunking call at INFO level
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = run(args.sizes.split(","), args.repeat, args.only)
+    output = args.output or REPO_DIR / "benchmarks" / "results" / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
-import distyll.loggerconfig
-
-from . import transcripts
-from . import text
-from . import llm
+import importlib
 
 __all__ = ["transcripts", "text", "llm"]
+
+
+def __getattr__(name):
+    # Import submodules on first access (PEP 562), so `import distyll` stays cheap
+    # for code that only needs part of the package, e.g. `distyll.utils.chunk_text`
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,279 @@
+from distyll.utils import init_dl_dir
+from typing import Union, Dict, Any, List, Iterable, Tuple, Hashable
+from pathlib import Path
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache:
+    """
+    Persistent key-value cache backed by SQLite, with size-bounded LRU and TTL eviction.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_entries: Union[int, None] = 100_000,
+        ttl: Union[float, None] = None,
+    ):
+        """
+        :param path: Path to the SQLite database file
+        :param max_entries: Maximum number of entries; the least recently used are evicted beyond it
+        :param ttl: Time to live of entries, in seconds (None for no expiry)
+        """
+        path = Path(path)
+        init_dl_dir(path.parent)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+        # Kept up to date on writes, so that they only need to evict once the cache is full
+        self._n_entries = len(self)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        Hash the parts of a request (JSON-serialisable) into a cache key
+        :param parts:
+        :return: Hex digest
+        """
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _count_missing(self, keys: List[str]) -> int:
+        n_present = 0
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            n_present += self._conn.execute(
+                f"SELECT COUNT(*) FROM cache WHERE key IN ({placeholders})", batch
+            ).fetchone()[0]
+        return len(keys) - n_present
+
+    def _evict_least_recently_used(self) -> None:
+        """
+        Once there are more than `max_entries` entries, evict the least recently used ones,
+        down to 90% of `max_entries`, so that the eviction cost is shared by many writes
+        """
+        if self.max_entries is None or self._n_entries <= self.max_entries:
+            return
+        # Other processes may share the file: count exactly before evicting
+        self._n_entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        n_evicted = self._n_entries - (self.max_entries - self.max_entries // 10)
+        if self._n_entries <= self.max_entries or n_evicted <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+            (n_evicted,),
+        )
+        self._n_entries -= n_evicted
+
+    def get(self, key: str) -> Union[str, bytes, None]:
+        """
+        Get a value, counting a hit or a miss
+        :param key:
+        :return: The cached value, or None if missing or expired
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._n_entries -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: Union[str, bytes]) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond `max_entries`
+        :param key:
+        :param value:
+        :return: None
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._n_entries += self._count_missing([key])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._evict_least_recently_used()
+
+    def get_many(self, keys: List[str]) -> List[Union[str, bytes, None]]:
+        """
+        Get many values in one transaction, counting hits and misses
+        :param keys:
+        :return: The cached values, in order, with None for missing or expired ones
+        """
+        now = time.time()
+        rows = dict()
+        with self._lock, self._conn:
+            # Stay below SQLite's limit on the number of query parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, value, created_at in self._conn.execute(
+                    f"SELECT key, value, created_at FROM cache WHERE key IN ({placeholders})",
+                    batch,
+                ):
+                    if self.ttl is None or now - created_at <= self.ttl:
+                        rows[key] = value
+                self._conn.execute(
+                    f"UPDATE cache SET accessed_at = ? WHERE key IN ({placeholders})",
+                    (now, *batch),
+                )
+            self.hits += sum(key in rows for key in keys)
+            self.misses += sum(key not in rows for key in keys)
+        return [rows.get(key) for key in keys]
+
+    def set_many(self, items: Iterable[Tuple[str, Union[str, bytes]]]) -> None:
+        """
+        Store many values in one transaction, evicting the least recently used entries beyond `max_entries`
+        :param items: (key, value) pairs
+        :return: None
+        """
+        now = time.time()
+        items = dict(items)
+        with self._lock, self._conn:
+            self._n_entries += self._count_missing(list(items))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, value, now, now) for key, value in items.items()],
+            )
+            self._evict_least_recently_used()
+
+    def evict_expired(self) -> int:
+        """
+        Delete all expired entries
+        :return: Number of entries deleted
+        """
+        if self.ttl is None:
+            return 0
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._n_entries -= cursor.rowcount
+        logging.info(f"Evicted {cursor.rowcount} expired entries from {self.path}")
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+            self._n_entries = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        :return: Hits, misses, hit rate and number of entries
+        """
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class LRUCache:
+    """
+    In-process key-value cache with size-bounded LRU and TTL eviction.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Union[float, None] = None):
+        """
+        :param max_entries: Maximum number of entries; the least recently used are evicted beyond it
+        :param ttl: Time to live of entries, in seconds (None for no expiry)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get a value, counting a hit or a miss
+        :param key:
+        :return: The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        :return: Hits, misses, hit rate and number of entries
+        """
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else 0.0,
+            "entries": len(self),
+        }
@@ -1,5 +1,18 @@
 DL_DIR = "dl_data"
 COLLECTION_NAME = "TextChunk"
+TRANSCRIPT_CACHE_DIR = f"{DL_DIR}/transcript_cache"
+LLM_CACHE_PATH = f"{DL_DIR}/llm_cache.sqlite"
+EMBEDDING_CACHE_PATH = f"{DL_DIR}/embedding_cache.sqlite"
+EMBEDDING_BATCH_SIZE = 256
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 300  # seconds, so results catch up with new chunks
+AUDIO_PROFILE = "opus"  # encoding of audio sent to Whisper, see distyll.utils.AUDIO_PROFILES
+AUDIO_SEGMENT_BYTES = 24 * 1000 * 1000  # size budget of each segment, below Whisper's 25 MB upload limit
+YOUTUBE_AUDIO_QUALITY = 64  # kbps of downloaded YouTube audio, which is re-encoded for Whisper anyway
+BATCH_MODE = "fixed_size"  # or "dynamic"
+BATCH_SIZE = 100
+BATCH_CONCURRENT_REQUESTS = 2
 
 
 def load_gen_model() -> str:
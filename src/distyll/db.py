@@ -1,16 +1,66 @@
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    Executor,
+    as_completed,
+)
+from contextlib import contextmanager, ExitStack
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Dict,
+    Any,
+    Union,
+    Tuple,
+    Literal,
+    Set,
+    Callable,
+)
+import hashlib
+import json
+import logging
+import multiprocessing
 from weaviate import WeaviateClient
-from weaviate.classes.config import Property, DataType, Configure
+from weaviate.classes.query import Filter, Sort
+from weaviate.collections import Collection
 from weaviate.util import generate_uuid5
 import distyll
-from distyll.utils import chunk_text
+from distyll.utils import iter_chunk_text, is_youtube_playlist, get_youtube_playlist_urls
+from distyll.embeddings import Embedder, embed_texts
+from distyll.instrumentation import span, count, in_current_context
+from distyll.schema import (
+    CollectionConfig,
+    get_collection_kwargs,
+    read_collection_config,
+    get_config_changes,
+    can_update_in_place,
+    get_update_kwargs,
+)
 import distyll.config
-from distyll.config import COLLECTION_NAME
+from distyll.config import (
+    COLLECTION_NAME,
+    BATCH_MODE,
+    BATCH_SIZE,
+    BATCH_CONCURRENT_REQUESTS,
+    EMBEDDING_BATCH_SIZE,
+)
 
+BatchMode = Literal["fixed_size", "dynamic"]
 
-def prep_db(client: WeaviateClient) -> None:
+
+def prep_db(
+    client: WeaviateClient,
+    embedder: Union[Embedder, None] = None,
+    collection_config: Union[CollectionConfig, None] = None,
+) -> None:
     """
     Prepare the database for use
     :param client: Weaviate client
+    :param embedder: If given, the collection is created without a vectorizer,
+        for vectors computed by distyll (see `distyll.embeddings`)
+    :param collection_config: Index settings for a new collection (see `migrate_collection` to change
+        those of an existing one)
     :return: None
     """
     if client.collections.exists(COLLECTION_NAME):
@@ -18,99 +68,650 @@ def prep_db(client: WeaviateClient) -> None:
     else:
         client.collections.create(
             COLLECTION_NAME,
-            properties=[
-                Property(name="title", data_type=DataType.TEXT),
-                Property(name="url", data_type=DataType.TEXT, skip_vectorization=True),
-                Property(name="chunk", data_type=DataType.TEXT),
-                Property(name="chunk_no", data_type=DataType.INT),
-            ],
-            vectorizer_config=Configure.Vectorizer.text2vec_openai(),
-            generative_config=Configure.Generative.openai(
-                model=distyll.config.load_gen_model()
+            **get_collection_kwargs(
+                collection_config or CollectionConfig(), local_vectors=embedder is not None
             ),
         )
 
 
-def add_yt_to_db(client: WeaviateClient, yt_url) -> int:
+def _copy_objects(
+    source_collection: Collection, target_collection: Collection, batch_size: int
+) -> int:
+    """
+    Copy all objects, with their vectors, from one collection to another
+    :param source_collection:
+    :param target_collection:
+    :param batch_size: Number of objects per batch request
+    :return: Number of objects copied
+    """
+    n_objects = 0
+    with target_collection.batch.fixed_size(batch_size=batch_size) as batch:
+        for o in source_collection.iterator(include_vector=True):
+            batch.add_object(
+                properties=o.properties,
+                uuid=o.uuid,
+                vector=o.vector.get("default") if o.vector else None,
+            )
+            n_objects += 1
+    failed_objects = target_collection.batch.failed_objects
+    if failed_objects:
+        raise RuntimeError(
+            f"Failed to copy {len(failed_objects)} of {n_objects} objects: "
+            f"{failed_objects[0].message}"
+        )
+    return n_objects
+
+
+def migrate_collection(
+    client: WeaviateClient,
+    collection_config: CollectionConfig,
+    batch_size: int = BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Bring the chunks collection to new index settings.
+    Settings Weaviate can change (BM25 and HNSW search parameters, enabling quantization)
+    are updated in place. Otherwise, the collection is rebuilt: objects are copied with their vectors
+    (so nothing is vectorized again) to a temporary collection, then back to a new collection
+    with the new settings. The collection keeps its vectorizer (or lack of one).
+    :param client: Weaviate client
+    :param collection_config: Target index settings
+    :param batch_size: Number of objects per batch request, when copying objects
+    :return: A dictionary with the "action" ("created", "unchanged", "updated" or "rebuilt"),
+        the "changes" ({setting: (old value, new value)}) and the number of "objects" copied
+    """
+    if not client.collections.exists(COLLECTION_NAME):
+        prep_db(client, collection_config=collection_config)
+        return {"action": "created", "changes": dict(), "objects": 0}
+
+    chunks_collection = client.collections.get(COLLECTION_NAME)
+    current_config, local_vectors = read_collection_config(chunks_collection.config.get())
+    changes = get_config_changes(current_config, collection_config)
+    if not changes:
+        return {"action": "unchanged", "changes": changes, "objects": 0}
+
+    if can_update_in_place(current_config, changes):
+        logging.info(f"Updating {COLLECTION_NAME} in place: {changes}")
+        chunks_collection.config.update(**get_update_kwargs(collection_config))
+        return {"action": "updated", "changes": changes, "objects": 0}
+
+    temp_name = f"{COLLECTION_NAME}_migration"
+    if client.collections.exists(temp_name):
+        raise RuntimeError(
+            f"{temp_name} exists: a previous migration did not finish. "
+            f"If {COLLECTION_NAME} has all objects, delete {temp_name} and retry"
+        )
+    collection_kwargs = get_collection_kwargs(collection_config, local_vectors)
+
+    logging.info(f"Rebuilding {COLLECTION_NAME} for {changes}")
+    client.collections.create(temp_name, **collection_kwargs)
+    temp_collection = client.collections.get(temp_name)
+    n_objects = _copy_objects(chunks_collection, temp_collection, batch_size)
+
+    # The objects are safe in the temporary collection from here
+    client.collections.delete(COLLECTION_NAME)
+    client.collections.create(COLLECTION_NAME, **collection_kwargs)
+    _copy_objects(temp_collection, client.collections.get(COLLECTION_NAME), batch_size)
+    client.collections.delete(temp_name)
+
+    print(f"Migrated {n_objects} objects to the new {COLLECTION_NAME} settings")
+    return {"action": "rebuilt", "changes": changes, "objects": n_objects}
+
+
+def get_chunk_uuid(url: str, chunk_no: int, chunk: str) -> str:
+    """
+    Deterministic ID of a chunk, from its source URL, position and content,
+    so that identical text in two sources does not collide and re-ingesting a source gives the same IDs
+    :param url: Source URL
+    :param chunk_no: Position of the chunk in the source
+    :param chunk: Chunk text
+    :return: UUID string
+    """
+    content_hash = hashlib.sha256(chunk.encode()).hexdigest()
+    # An unambiguous encoding: joined as strings, ("…/p1", 12) and ("…/p11", 2) would collide
+    return generate_uuid5(json.dumps([url, chunk_no, content_hash]))
+
+
+def _iter_source_objects(
+    title: str, url: str, texts: Iterable[Union[str, List[str]]]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Chunk the texts of a source, numbering chunks across texts
+    :param title: Source title
+    :param url: Source URL
+    :param texts: Texts to chunk separately, each a string or a list of consecutive pieces (e.g. pages)
+    :return: Iterator of (UUID, properties)
+    """
+    chunk_no = 0
+    for source_text in texts:
+        for chunk in iter_chunk_text(source_text):
+            yield get_chunk_uuid(url, chunk_no, chunk), {
+                "title": title,
+                "url": url,
+                "chunk": chunk,
+                "chunk_no": chunk_no,
+            }
+            chunk_no += 1
+
+
+def get_existing_chunk_uuids(
+    chunks_collection: Collection, url: str, page_size: int = 1000
+) -> Set[str]:
+    """
+    Get the IDs of the chunks of a source that are in the database.
+    Pages by `chunk_no` rather than by offset, as offsets are capped by the server's `QUERY_MAXIMUM_RESULTS`.
+    :param chunks_collection: Chunks collection
+    :param url: Source URL
+    :param page_size: Number of IDs to fetch per request
+    :return: Set of UUID strings
+    """
+    url_filter = Filter.by_property("url").equal(url)
+    uuids = set()
+    last_chunk_no = -1
+    while True:
+        response = chunks_collection.query.fetch_objects(
+            filters=url_filter & Filter.by_property("chunk_no").greater_than(last_chunk_no),
+            sort=Sort.by_property("chunk_no"),
+            limit=page_size,
+            return_properties=["url", "chunk_no"],
+        )
+        # With word tokenization, the filter also matches URLs containing all words of this one
+        uuids.update(str(o.uuid) for o in response.objects if o.properties["url"] == url)
+        if len(response.objects) < page_size:
+            return uuids
+        last_chunk_no = response.objects[-1].properties["chunk_no"]
+        # The page may end partway through the chunks with this number (of other URLs, or left over
+        # from a failed deletion): get all of them before moving past it
+        offset = 0
+        while True:
+            response = chunks_collection.query.fetch_objects(
+                filters=url_filter & Filter.by_property("chunk_no").equal(last_chunk_no),
+                limit=page_size,
+                offset=offset,
+                return_properties=["url"],
+            )
+            uuids.update(str(o.uuid) for o in response.objects if o.properties["url"] == url)
+            if len(response.objects) < page_size:
+                break
+            offset += page_size
+
+
+def delete_chunks(
+    chunks_collection: Collection, uuids: Iterable[str], page_size: int = 1000
+) -> int:
+    """
+    Delete chunks by ID
+    :param chunks_collection: Chunks collection
+    :param uuids: IDs of the chunks to delete
+    :param page_size: Number of IDs to delete per request
+    :return: Number of chunks deleted
+    """
+    uuids = list(uuids)
+    n_deleted = 0
+    for i in range(0, len(uuids), page_size):
+        result = chunks_collection.data.delete_many(
+            where=Filter.by_id().contains_any(uuids[i : i + page_size])
+        )
+        n_deleted += result.successful
+    return n_deleted
+
+
+def _add_new_chunks(
+    batch,
+    objects: Iterable[Tuple[str, Dict[str, Any]]],
+    existing_uuids: Set[str],
+    embedder: Union[Embedder, None] = None,
+) -> Dict[str, Any]:
+    """
+    Add the chunks of a source that are not in the database yet to a batch
+    :param batch: Batch to add objects to
+    :param objects: (UUID, properties) of all chunks of the source
+    :param existing_uuids: IDs of the chunks of the source already in the database
+    :param embedder: If given, chunks are embedded in groups and added with their vectors
+    :return: A dictionary with the numbers of "chunks" and of chunks "added",
+        and the "stale" IDs of chunks no longer in the source
+    """
+    n_chunks = 0
+    n_added = 0
+    uuids = set()
+    pending = list()
+
+    def add_pending():
+        vectors = embed_texts([properties["chunk"] for _, properties in pending], embedder)
+        for (uuid, properties), vector in zip(pending, vectors):
+            batch.add_object(properties=properties, uuid=uuid, vector=vector.tolist())
+        pending.clear()
+
+    for uuid, properties in objects:
+        n_chunks += 1
+        uuids.add(uuid)
+        if uuid in existing_uuids:
+            continue
+        n_added += 1
+        if embedder is None:
+            batch.add_object(properties=properties, uuid=uuid)
+        else:
+            pending.append((uuid, properties))
+            if len(pending) >= EMBEDDING_BATCH_SIZE:
+                add_pending()
+    if pending:
+        add_pending()
+    return {"chunks": n_chunks, "added": n_added, "stale": existing_uuids - uuids}
+
+
+def _open_batch(
+    chunks_collection: Collection,
+    batch_mode: BatchMode,
+    batch_size: int,
+    concurrent_requests: int,
+):
+    """
+    Open a batch on a collection
+    :param chunks_collection: Chunks collection
+    :param batch_mode: "fixed_size" (`batch_size` objects per request, `concurrent_requests` at a time)
+        or "dynamic" (sizes adapted to the server's load)
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :return: Batch context manager
+    """
+    if batch_mode == "fixed_size":
+        return chunks_collection.batch.fixed_size(
+            batch_size=batch_size, concurrent_requests=concurrent_requests
+        )
+    elif batch_mode == "dynamic":
+        return chunks_collection.batch.dynamic()
+    else:
+        raise ValueError(f"Unsupported batch mode: {batch_mode}")
+
+
+@contextmanager
+def chunk_writer(
+    chunks_collection: Collection,
+    batch_mode: BatchMode = BATCH_MODE,
+    batch_size: int = BATCH_SIZE,
+    concurrent_requests: int = BATCH_CONCURRENT_REQUESTS,
+    embedder: Union[Embedder, None] = None,
+) -> Iterator[Callable[[str, str, Iterable[Union[str, List[str]]]], Dict[str, Any]]]:
+    """
+    Write the chunks of sources to the database through one batch.
+    New or changed chunks are added; once the batch is flushed, stale chunks are deleted,
+    except for sources with objects that failed to be written, so they keep their old chunks.
+
+        with chunk_writer(chunks_collection) as write_source:
+            result = write_source(title, url, texts)
+
+    :param chunks_collection: Chunks collection
+    :param batch_mode: "fixed_size" or "dynamic"
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: If given, chunks are written with vectors from this embedder
+    :return: A function of a source's title, URL and texts (each a string or a list of consecutive pieces),
+        returning a dictionary with the numbers of "chunks", "added", "deleted" and "failed" chunks,
+        and the "failed_objects" ({"uuid", "message"}); the numbers are final once the writer closes
+    """
+    results = dict()
+    stale_uuids = dict()
+
+    with ExitStack() as flush, _open_batch(
+        chunks_collection, batch_mode, batch_size, concurrent_requests
+    ) as batch:
+
+        def write_source(
+            title: str, url: str, texts: Iterable[Union[str, List[str]]]
+        ) -> Dict[str, Any]:
+            # Chunking, embedding (if any) and queueing the chunks in the batch
+            with span("write_source", url=url) as attributes:
+                existing_uuids = get_existing_chunk_uuids(chunks_collection, url)
+                added = _add_new_chunks(
+                    batch, _iter_source_objects(title, url, texts), existing_uuids, embedder
+                )
+                attributes["chunks"] = added["chunks"]
+                attributes["added"] = added["added"]
+            stale_uuids[url] = added["stale"]
+            results[url] = {
+                "chunks": added["chunks"],
+                "added": added["added"],
+                "deleted": 0,
+                "failed": 0,
+                "failed_objects": list(),
+            }
+            return results[url]
+
+        yield write_source
+        # Entered last, so it is exited after the batch: it times the batch sending its remaining objects
+        flush.enter_context(
+            span(
+                "batch_flush",
+                sources=len(results),
+                objects=sum(r["added"] for r in results.values()),
+            )
+        )
+
+    if chunks_collection.batch.failed_objects:
+        count("batch.failed_objects", len(chunks_collection.batch.failed_objects))
+
+    for error in chunks_collection.batch.failed_objects:
+        url = (error.object_.properties or dict()).get("url")
+        logging.info(f"Failed to write chunk {error.object_.uuid} of {url}: {error.message}")
+        if url in results:
+            results[url]["added"] -= 1
+            results[url]["failed"] += 1
+            results[url]["failed_objects"].append(
+                {"uuid": str(error.object_.uuid), "message": error.message}
+            )
+
+    # Delete stale chunks once their replacements are in
+    for url, uuids in stale_uuids.items():
+        if results[url]["failed"]:
+            logging.info(f"Keeping the stale chunks of {url}, as some of its chunks failed")
+            continue
+        results[url]["deleted"] = delete_chunks(chunks_collection, uuids)
+
+
+def _sync_source(
+    client: WeaviateClient,
+    title: str,
+    url: str,
+    texts: Iterable[Union[str, List[str]]],
+    batch_mode: BatchMode,
+    batch_size: int,
+    concurrent_requests: int,
+    embedder: Union[Embedder, None],
+) -> int:
+    """
+    Bring the chunks of a source in the database up to date:
+    add new or changed chunks, keep unchanged ones and delete stale ones
+    :param client: Weaviate client
+    :param title: Source title
+    :param url: Source URL
+    :param texts: Texts to chunk separately, each a string or a list of consecutive pieces (e.g. pages)
+    :param batch_mode: "fixed_size" or "dynamic"
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: Embedder for client-side vectors, or None to let the database vectorize chunks
+    :return: Number of chunks added
+    """
+    chunks_collection = client.collections.get(COLLECTION_NAME)
+    with chunk_writer(
+        chunks_collection, batch_mode, batch_size, concurrent_requests, embedder
+    ) as write_source:
+        result = write_source(title, url, texts)
+
+    print(
+        f"Added {result['added']} chunks to the database "
+        f"({result['chunks'] - result['added'] - result['failed']} unchanged, "
+        f"{result['deleted']} stale deleted, {result['failed']} failed)"
+    )
+    return result["added"]
+
+
+def add_yt_to_db(
+    client: WeaviateClient,
+    yt_url,
+    batch_mode: BatchMode = BATCH_MODE,
+    batch_size: int = BATCH_SIZE,
+    concurrent_requests: int = BATCH_CONCURRENT_REQUESTS,
+    embedder: Union[Embedder, None] = None,
+) -> int:
     """
     Add a YouTube video to the database
     :param client: Weaviate client
     :param yt_url: YouTube URL
+    :param batch_mode: "fixed_size" or "dynamic" batching
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: Embedder to compute vectors locally (see `distyll.embeddings`),
+        instead of having the database vectorize chunks
     :return: Number of chunks added
     """
-    prep_db(client)
+    prep_db(client, embedder)
     transcript_data = distyll.transcripts.from_youtube(yt_url)
-    chunks_collection = client.collections.get(COLLECTION_NAME)
-    chunk_no = 0
-    with chunks_collection.batch.fixed_size() as batch:
-        for t in transcript_data["transcripts"]:
-            for _, transcript in enumerate(transcript_data["transcripts"]):
-                for chunk in chunk_text(transcript):
-                    batch.add_object(
-                        properties={
-                            "title": transcript_data["title"],
-                            "url": transcript_data["yt_url"],
-                            "chunk": chunk,
-                            "chunk_no": chunk_no,
-                        },
-                        uuid=generate_uuid5(chunk),
-                    )
-                    chunk_no += 1
-    print(f"Added {chunk_no} chunks to the database")
-    return chunk_no
+    return _sync_source(
+        client,
+        transcript_data["title"],
+        transcript_data["yt_url"],
+        transcript_data["transcripts"],
+        batch_mode,
+        batch_size,
+        concurrent_requests,
+        embedder,
+    )
 
 
-def add_arxiv_to_db(client: WeaviateClient, arxiv_url: str) -> int:
+def add_arxiv_to_db(
+    client: WeaviateClient,
+    arxiv_url: str,
+    batch_mode: BatchMode = BATCH_MODE,
+    batch_size: int = BATCH_SIZE,
+    concurrent_requests: int = BATCH_CONCURRENT_REQUESTS,
+    embedder: Union[Embedder, None] = None,
+) -> int:
     """
     Add an arXiv paper to the database
     :param client: Weaviate client
     :param arxiv_url: arXiv URL
+    :param batch_mode: "fixed_size" or "dynamic" batching
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: Embedder to compute vectors locally (see `distyll.embeddings`),
+        instead of having the database vectorize chunks
     :return: Number of chunks added
     """
-    prep_db(client)
+    prep_db(client, embedder)
     arxiv_data = distyll.text.from_arxiv_paper(arxiv_url)
-    chunks_collection = client.collections.get(COLLECTION_NAME)
-    chunk_no = 0
-    with chunks_collection.batch.fixed_size() as batch:
-        for chunk in chunk_text(arxiv_data["text"]):
-            batch.add_object(
-                properties={
-                    "title": arxiv_data["title"],
-                    "url": arxiv_url,
-                    "chunk": chunk,
-                    "chunk_no": chunk_no,
-                },
-                uuid=generate_uuid5(chunk),
-            )
-            chunk_no += 1
-
-    print(f"Added {chunk_no} chunks to the database")
-    return chunk_no
+    return _sync_source(
+        client,
+        arxiv_data["title"],
+        arxiv_url,
+        [arxiv_data["text"]],
+        batch_mode,
+        batch_size,
+        concurrent_requests,
+        embedder,
+    )
 
 
-def add_pdf_to_db(client: WeaviateClient, pdf_url: str) -> int:
+def add_pdf_to_db(
+    client: WeaviateClient,
+    pdf_url: str,
+    batch_mode: BatchMode = BATCH_MODE,
+    batch_size: int = BATCH_SIZE,
+    concurrent_requests: int = BATCH_CONCURRENT_REQUESTS,
+    embedder: Union[Embedder, None] = None,
+) -> int:
     """
     Add a PDF file to the database
     :param client: Weaviate client
     :param pdf_url: PDF URL
+    :param batch_mode: "fixed_size" or "dynamic" batching
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: Embedder to compute vectors locally (see `distyll.embeddings`),
+        instead of having the database vectorize chunks
     :return: Number of chunks added
     """
-    prep_db(client)
-    pdf_text = distyll.text.from_pdf(pdf_url)
+    prep_db(client, embedder)
+    pdf_pages = distyll.text.from_pdf(pdf_url, by_page=True)
+    return _sync_source(
+        client,
+        pdf_url,
+        pdf_url,
+        [pdf_pages],
+        batch_mode,
+        batch_size,
+        concurrent_requests,
+        embedder,
+    )
+
+
+SourceType = Literal["youtube", "arxiv", "pdf"]
+
+
+def get_source_type(url: str) -> SourceType:
+    """
+    Infer the type of source from its URL
+    :param url: Source URL
+    :return: "youtube", "arxiv" or "pdf"
+    """
+    if "youtube.com" in url or "youtu.be" in url:
+        return "youtube"
+    elif "arxiv.org" in url:
+        return "arxiv"
+    else:
+        return "pdf"
+
+
+def _fetch_source(
+    source_type: SourceType, url: str, parse_executor: Executor
+) -> Dict[str, Any]:
+    """
+    Download (and transcribe or parse) a source
+    :param source_type: "youtube", "arxiv" or "pdf"
+    :param url: Source URL
+    :param parse_executor: Executor to parse PDFs in
+    :return: A dictionary with the title, URL and a list of texts to chunk separately,
+        each a string or a list of consecutive pieces (e.g. pages)
+    """
+    if source_type == "youtube":
+        transcript_data = distyll.transcripts.from_youtube(url)
+        return {
+            "title": transcript_data["title"],
+            "url": transcript_data["yt_url"],
+            "texts": transcript_data["transcripts"],
+        }
+    elif source_type == "arxiv":
+        arxiv_data = distyll.text.from_arxiv_paper(url, executor=parse_executor)
+        if arxiv_data is None:
+            raise ValueError(f"Could not get an arXiv paper from {url}")
+        return {"title": arxiv_data["title"], "url": url, "texts": [arxiv_data["text"]]}
+    elif source_type == "pdf":
+        pdf_pages = distyll.text.from_pdf(url, executor=parse_executor, by_page=True)
+        return {"title": url, "url": url, "texts": [pdf_pages]}
+    else:
+        raise ValueError(f"Unsupported source type: {source_type}")
+
+
+def ingest_many(
+    client: WeaviateClient,
+    sources: Iterable[Union[str, Tuple[SourceType, str]]],
+    max_download_workers: int = 8,
+    max_parse_workers: Union[int, None] = None,
+    batch_mode: BatchMode = BATCH_MODE,
+    batch_size: int = BATCH_SIZE,
+    concurrent_requests: int = BATCH_CONCURRENT_REQUESTS,
+    embedder: Union[Embedder, None] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Add many YouTube videos, arXiv papers and PDF files to the database.
+    YouTube playlist and channel URLs are expanded into one source per video.
+    Downloads and transcriptions run on a thread pool, PDF parsing on a process pool,
+    and all chunks are written through one shared batch as each source completes.
+    Only new or changed chunks are written, and chunks no longer in a source are deleted,
+    so re-ingesting unchanged sources writes nothing.
+    :param client: Weaviate client
+    :param sources: URLs, or (source type, URL) tuples where the type is "youtube", "arxiv" or "pdf"
+    :param max_download_workers: Number of sources downloaded/transcribed concurrently
+    :param max_parse_workers: Number of processes for PDF parsing (defaults to the number of CPUs)
+    :param batch_mode: "fixed_size" or "dynamic" batching
+    :param batch_size: Number of objects per request, for fixed-size batching
+    :param concurrent_requests: Number of requests in flight, for fixed-size batching
+    :param embedder: Embedder to compute vectors locally (see `distyll.embeddings`),
+        instead of having the database vectorize chunks
+    :return: One dictionary per source, in input order, with "source", "type", "status"
+        ("success", "partial" if some chunks failed to be written, or "failed"),
+        "chunks" (number in the source), "added" (new or changed chunks), "deleted" (stale chunks),
+        "failed" (chunks that failed to be written), "failed_objects" and "error"
+    """
+    prep_db(client, embedder)
     chunks_collection = client.collections.get(COLLECTION_NAME)
-    chunk_no = 0
-    with chunks_collection.batch.fixed_size() as batch:
-        for chunk in chunk_text(pdf_text):
-            batch.add_object(
-                properties={
-                    "title": pdf_url,
-                    "url": pdf_url,
-                    "chunk": chunk,
-                    "chunk_no": chunk_no,
-                },
-                uuid=generate_uuid5(chunk),
-            )
-            chunk_no += 1
 
-    print(f"Added {chunk_no} chunks to the database")
-    return chunk_no
+    source_list = list()
+    expansion_errors = dict()
+    for source in sources:
+        if isinstance(source, str):
+            source_type, url = get_source_type(source), source
+        else:
+            source_type, url = source
+        if source_type == "youtube" and is_youtube_playlist(url):
+            try:
+                video_urls = get_youtube_playlist_urls(url)
+            except Exception as e:
+                logging.info(f"Failed to list the videos of {url}: {e}")
+                expansion_errors[len(source_list)] = str(e)
+            else:
+                source_list.extend(("youtube", video_url) for video_url in video_urls)
+                continue
+        source_list.append((source_type, url))
+    reports = [
+        {
+            "source": url,
+            "type": source_type,
+            "status": None,
+            "chunks": 0,
+            "added": 0,
+            "deleted": 0,
+            "failed": 0,
+            "failed_objects": list(),
+            "error": None,
+        }
+        for source_type, url in source_list
+    ]
+    for i, error in expansion_errors.items():
+        reports[i]["status"] = "failed"
+        reports[i]["error"] = error
+
+    # Get the metadata of all arXiv papers in bulk, rather than one abstract page per paper
+    arxiv_urls = [url for source_type, url in source_list if source_type == "arxiv"]
+    if arxiv_urls:
+        try:
+            distyll.text.prefetch_arxiv_metadata(arxiv_urls)
+        except Exception as e:
+            logging.info(f"Failed to prefetch arXiv metadata, fetching it per paper: {e}")
+
+    with (
+        span("ingest", sources=len(source_list)),
+        # Spawn rather than fork, as the parse workers are started from download threads
+        ProcessPoolExecutor(
+            max_workers=max_parse_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as parse_executor,
+        ThreadPoolExecutor(max_workers=max_download_workers) as download_executor,
+    ):
+        futures = {
+            download_executor.submit(
+                in_current_context(_fetch_source), source_type, url, parse_executor
+            ): i
+            for i, (source_type, url) in enumerate(source_list)
+            if i not in expansion_errors
+        }
+        with chunk_writer(
+            chunks_collection, batch_mode, batch_size, concurrent_requests, embedder
+        ) as write_source:
+            for future in as_completed(futures):
+                report = reports[futures[future]]
+                try:
+                    source_data = future.result()
+                    result = write_source(
+                        source_data["title"], source_data["url"], source_data["texts"]
+                    )
+                except Exception as e:
+                    logging.info(f"Failed to ingest {report['source']}: {e}")
+                    report["status"] = "failed"
+                    report["error"] = str(e)
+                    continue
+                report["result"] = result
+
+    # The write results are complete once the writer is closed
+    for report in reports:
+        result = report.pop("result", None)
+        if result is not None:
+            report.update(result)
+            report["status"] = "partial" if result["failed"] else "success"
+
+    n_succeeded = sum(r["status"] == "success" for r in reports)
+    n_added = sum(r["added"] for r in reports)
+    n_deleted = sum(r["deleted"] for r in reports)
+    n_failed = sum(r["failed"] for r in reports)
+    print(
+        f"Added {n_added} chunks from {n_succeeded} of {len(reports)} sources to the database "
+        f"({n_deleted} stale deleted, {n_failed} failed)"
+    )
+    return reports
@@ -0,0 +1,155 @@
+from distyll.cache import SQLiteCache
+from distyll.config import EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE, LOCAL_EMBEDDING_MODEL
+from distyll.instrumentation import span, count_cache
+from dataclasses import dataclass
+from typing import Callable, List, Union
+import hashlib
+import logging
+import re
+import threading
+import numpy as np
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Embedder:
+    """
+    Computes vectors for texts on the client side, for collections without a vectorizer.
+    `embed` takes a list of texts and returns a (number of texts, dimensions) array;
+    `name` identifies the model (and its settings) in the embedding cache.
+    """
+
+    name: str
+    embed: Callable[[List[str]], np.ndarray]
+
+
+def get_embedding_cache() -> SQLiteCache:
+    """
+    Get the default embedding cache (created on first use)
+    :return: Cache stored at `distyll.config.EMBEDDING_CACHE_PATH`
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = SQLiteCache(EMBEDDING_CACHE_PATH, max_entries=1_000_000)
+    return _embedding_cache
+
+
+def get_hashing_embedder(dimensions: int = 512) -> Embedder:
+    """
+    Embedder hashing the words of a text into a fixed number of dimensions (signed feature hashing).
+    Needs no model or network, so suits tests and air-gapped deployments, but only captures word overlap.
+    :param dimensions: Number of dimensions
+    :return: Embedder returning L2-normalised vectors
+    """
+
+    def embed(texts: List[str]) -> np.ndarray:
+        rows, columns, signs = list(), list(), list()
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                # A stable hash, as Python's hash() of strings changes between processes
+                digest = int.from_bytes(
+                    hashlib.blake2b(word.encode(), digest_size=8).digest(), "little"
+                )
+                rows.append(row)
+                columns.append(digest % dimensions)
+                signs.append(1.0 if digest >> 63 else -1.0)
+
+        vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    return Embedder(name=f"hashing-{dimensions}", embed=embed)
+
+
+def get_sentence_transformer_embedder(
+    model_name: str = LOCAL_EMBEDDING_MODEL,
+    device: Union[str, None] = None,
+    batch_size: int = 64,
+) -> Embedder:
+    """
+    Embedder running a sentence-transformers model locally (on the CPU unless `device` says otherwise).
+    Requires the optional `sentence-transformers` package.
+    :param model_name: Model name or path
+    :param device: e.g. "cpu" or "cuda" (default: chosen by sentence-transformers)
+    :param batch_size: Number of texts per forward pass
+    :return: Embedder returning L2-normalised vectors
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(
+            "Local embedding models need sentence-transformers: pip install sentence-transformers"
+        ) from e
+
+    logging.info(f"Loading embedding model {model_name}")
+    model = SentenceTransformer(model_name, device=device)
+
+    def embed(texts: List[str]) -> np.ndarray:
+        return model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+
+    return Embedder(name=f"sentence-transformers/{model_name}", embed=embed)
+
+
+def embed_texts(
+    texts: List[str],
+    embedder: Embedder,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    use_cache: bool = True,
+    cache: Union[SQLiteCache, None] = None,
+) -> np.ndarray:
+    """
+    Embed texts in batches, reusing cached vectors.
+    Vectors are cached keyed by the embedder name and a hash of the text.
+    :param texts: Texts to embed
+    :param embedder: Embedder to use
+    :param batch_size: Number of texts passed to the embedder at a time
+    :param use_cache: Set to False to bypass the embedding cache
+    :param cache: Embedding cache to use instead of the default one
+    :return: float32 array of shape (number of texts, dimensions)
+    """
+    vectors = [None] * len(texts)
+    if use_cache:
+        if cache is None:
+            cache = get_embedding_cache()
+        keys = [
+            cache.make_key(
+                "embedding", embedder.name, hashlib.sha256(text.encode()).hexdigest()
+            )
+            for text in texts
+        ]
+        for i, value in enumerate(cache.get_many(keys)):
+            if value is not None:
+                vectors[i] = np.frombuffer(value, dtype=np.float32)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if use_cache:
+        count_cache("embedding", hits=len(texts) - len(missing), misses=len(missing))
+    if missing:
+        logging.info(
+            f"Embedding {len(missing)} of {len(texts)} texts with {embedder.name}"
+        )
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        with span("embed", embedder=embedder.name, texts=len(batch)):
+            batch_vectors = np.asarray(
+                embedder.embed([texts[i] for i in batch]), dtype=np.float32
+            )
+        for i, vector in zip(batch, batch_vectors):
+            vectors[i] = vector
+        if use_cache:
+            cache.set_many(
+                (keys[i], vector.tobytes()) for i, vector in zip(batch, batch_vectors)
+            )
+
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack(vectors)
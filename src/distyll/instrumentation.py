@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Union
+import json
+import logging
+import threading
+import time
+
+# An exporter receives each record: a dictionary with "type" ("span" or "counter"), "name",
+# "time" (epoch seconds), "attributes", and for spans "seconds", "parent" and "error"
+Exporter = Callable[[Dict[str, Any]], None]
+
+_exporter: Union[Exporter, None] = None
+_current_span: ContextVar[Union[str, None]] = ContextVar("distyll_span", default=None)
+
+
+def set_exporter(exporter: Union[Exporter, None]) -> None:
+    """
+    Send instrumentation records to an exporter, e.g. `get_jsonl_exporter(path)` or `records.append`.
+    By default there is none, and instrumentation does nothing.
+    :param exporter: Function of a record, or None to turn instrumentation off
+    :return: None
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter() -> Union[Exporter, None]:
+    return _exporter
+
+
+def _export(exporter: Exporter, record: Dict[str, Any]) -> None:
+    # Instrumentation must never break the work it measures
+    try:
+        exporter(record)
+    except Exception as e:
+        logging.warning(f"Failed to export {record['type']} {record['name']}: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a unit of work, e.g. a download or an API call
+
+        with span("download", url=url) as attributes:
+            ...
+            attributes["bytes"] = size
+
+    :param name: Kind of work: "download", "parse_pdf", "split_audio", "whisper", "chunk", "embed", "llm"...
+    :param attributes: Attributes of the span; numbers (bytes, tokens, audio seconds...) are summed by `summarize`
+    :return: The attributes, which the block can add to
+    """
+    exporter = _exporter
+    if exporter is None:
+        yield attributes
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start_time = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        _export(
+            exporter,
+            {
+                "type": "span",
+                "name": name,
+                "time": start_time,
+                "seconds": time.perf_counter() - start,
+                "parent": parent,
+                "error": error,
+                "attributes": attributes,
+            },
+        )
+
+
+def in_current_context(function: Callable) -> Callable:
+    """
+    Wrap a function to submit to an executor, so that spans in worker threads
+    have the current span as their parent
+    :param function:
+    :return: Function running each call in a copy of the current context
+    """
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+def count(name: str, value: float = 1, **attributes: Any) -> None:
+    """
+    Add to a counter
+    :param name: Counter name, e.g. "cache.hit"
+    :param value: Amount to add
+    :param attributes: Attributes of this count, e.g. the cache name
+    :return: None
+    """
+    exporter = _exporter
+    if exporter is None:
+        return
+    _export(
+        exporter,
+        {
+            "type": "counter",
+            "name": name,
+            "time": time.time(),
+            "value": value,
+            "attributes": attributes,
+        },
+    )
+
+
+def count_cache(cache: str, hits: int = 0, misses: int = 0) -> None:
+    """
+    Count cache hits and misses, for the hit rates of `summarize`
+    :param cache: Cache name, e.g. "llm" or "transcript"
+    :param hits:
+    :param misses:
+    :return: None
+    """
+    if hits:
+        count("cache.hit", hits, cache=cache)
+    if misses:
+        count("cache.miss", misses, cache=cache)
+
+
+def get_jsonl_exporter(path: Union[str, Path]) -> Exporter:
+    """
+    Exporter appending records to a JSON-lines file, one line per record
+    :param path: Path of the file (created if needed)
+    :return: Exporter, safe to share between threads
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock = threading.Lock()
+
+    def export(record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with lock, path.open("a") as f:
+            f.write(line)
+
+    return export
+
+
+def read_jsonl(path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """
+    :param path: File written by a `get_jsonl_exporter` exporter
+    :return: Records
+    """
+    with Path(path).open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate records, to see where wall-clock time and API usage go
+    :param records: Records, e.g. from `read_jsonl`
+    :return: A dictionary with "spans" (by name: "count", "seconds", "errors", and the sums of
+        numeric attributes), "counters" (by name: total), and "cache_hit_rates" (by cache name)
+    """
+    spans = dict()
+    counters = dict()
+    caches = dict()
+    for record in records:
+        if record["type"] == "span":
+            summary = spans.setdefault(record["name"], {"count": 0, "seconds": 0.0, "errors": 0})
+            summary["count"] += 1
+            summary["seconds"] += record["seconds"]
+            summary["errors"] += record["error"] is not None
+            for key, value in record["attributes"].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    summary[key] = summary.get(key, 0) + value
+        elif record["type"] == "counter":
+            counters[record["name"]] = counters.get(record["name"], 0) + record["value"]
+            if record["name"] in ("cache.hit", "cache.miss"):
+                cache = caches.setdefault(record["attributes"].get("cache"), [0, 0])
+                cache[record["name"] == "cache.miss"] += record["value"]
+    return {
+        "spans": spans,
+        "counters": counters,
+        "cache_hit_rates": {
+            name: hits / (hits + misses) for name, (hits, misses) in caches.items()
+        },
+    }
@@ -1,3 +1,3 @@
-from .utils import ask_openai, summarize_text
+from .utils import ask_openai, summarize_text, get_llm_cache
 
-__all__ = ["ask_openai", "summarize_text"]
+__all__ = ["ask_openai", "summarize_text", "get_llm_cache"]
@@ -1,32 +1,83 @@
 from distyll.utils import get_openai_client, chunk_text
-from typing import Dict, Union
+from distyll.cache import SQLiteCache
+from distyll.config import LLM_CACHE_PATH
+from distyll.instrumentation import span, count_cache, in_current_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Union, Any
+import logging
+import threading
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> SQLiteCache:
+    """
+    Get the default LLM response cache (created on first use)
+    Returns:
+        SQLiteCache: Cache stored at `distyll.config.LLM_CACHE_PATH`
+    """
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = SQLiteCache(LLM_CACHE_PATH)
+    return _llm_cache
 
 
 def ask_openai(
-    prompt: str, system_prompt: Dict[str, str] = None, model: Union[str, None] = None
+    prompt: str,
+    system_prompt: Dict[str, str] = None,
+    model: Union[str, None] = None,
+    oai_client: Any = None,
+    use_cache: bool = True,
+    cache: Union[SQLiteCache, None] = None,
 ) -> str:
     """
-    Ask OpenAI for a response to a prompt
+    Ask OpenAI for a response to a prompt.
+    Responses are cached on disk, keyed by a hash of (model, system prompt, prompt).
     Args:
         prompt:
         system_prompt:
         model:
+        oai_client: OpenAI client to use (or any object exposing `chat.completions.create`)
+        use_cache: Set to False to bypass the response cache
+        cache: Response cache to use instead of the default one
 
     Returns:
         str: Response from OpenAI
     """
     if not system_prompt:
         system_prompt = {"role": "system", "content": "You are a helpful assistant."}
-    oai_client = get_openai_client()
 
     if not model:
         model = "gpt-4o"
 
-    completion = oai_client.chat.completions.create(
-        model=model, messages=[system_prompt, {"role": "user", "content": prompt}]
-    )
+    if use_cache:
+        if cache is None:
+            cache = get_llm_cache()
+        cache_key = cache.make_key(model, system_prompt, prompt)
+        response = cache.get(cache_key)
+        if response is not None:
+            count_cache("llm", hits=1)
+            return response
+        count_cache("llm", misses=1)
+
+    if oai_client is None:
+        oai_client = get_openai_client()
 
-    return completion.choices[0].message.content
+    with span("llm", model=model) as attributes:
+        completion = oai_client.chat.completions.create(
+            model=model, messages=[system_prompt, {"role": "user", "content": prompt}]
+        )
+        usage = getattr(completion, "usage", None)
+        for field in ["prompt_tokens", "completion_tokens", "total_tokens"]:
+            if getattr(usage, field, None) is not None:
+                attributes[field] = getattr(usage, field)
+    response = completion.choices[0].message.content
+
+    if use_cache and response is not None:
+        cache.set(cache_key, response)
+    return response
 
 
 def summarize_text(
@@ -35,20 +86,30 @@ def summarize_text(
     overlap: float = 0.1,
     summary_prompt: Dict[str, str] = None,
     number_of_points: int = 3,
+    max_concurrency: int = 4,
+    max_rounds: int = 5,
+    oai_client: Any = None,
+    use_cache: bool = True,
+    cache: Union[SQLiteCache, None] = None,
 ) -> str:
     """
-    Recursively summarise a text by chunking it into smaller parts and summarising each part
+    Summarise a text with map-reduce: chunk it, summarise the chunks concurrently,
+    then summarise the combined chunk summaries the same way until they fit in one final prompt
     Args:
         text:
         max_chunk_len:
         overlap:
         summary_prompt:
         number_of_points:
+        max_concurrency: Maximum number of chunk summaries requested at once
+        max_rounds: Maximum number of map-reduce rounds; after that, the chunk summaries are joined as they are
+        oai_client: OpenAI client to use (or any object exposing `chat.completions.create`)
+        use_cache: Set to False to bypass the response cache
+        cache: Response cache to use instead of the default one
 
     Returns:
         str: Summarised text
     """
-
     chunks = chunk_text(
         text, method="words", token_length=max_chunk_len, overlap_fraction=overlap
     )
@@ -59,14 +120,49 @@ def summarize_text(
                 "role": "system",
                 "content": f"Summarize the provided text into a maximum of {number_of_points} short key points for the user. ",
             }
-        return ask_openai(chunks[0], summary_prompt)
+        return ask_openai(
+            chunks[0],
+            summary_prompt,
+            oai_client=oai_client,
+            use_cache=use_cache,
+            cache=cache,
+        )
     else:
         chunk_summary_prompt = {
             "role": "system",
             "content": "Summarize the provided text into a succinct set of key points. ",
         }
-        summaries = [
-            summarize_text(chunk, summary_prompt=chunk_summary_prompt)
-            for chunk in chunks
-        ]
-        return " ".join(summaries)
+        logging.info(f"Summarizing {len(chunks)} chunks...")
+        with (
+            span("summarize", chunks=len(chunks)),
+            ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor,
+        ):
+            summaries = list(
+                executor.map(
+                    in_current_context(
+                        lambda chunk: ask_openai(
+                            chunk,
+                            chunk_summary_prompt,
+                            oai_client=oai_client,
+                            use_cache=use_cache,
+                            cache=cache,
+                        )
+                    ),
+                    chunks,
+                )
+            )
+        if max_rounds <= 1:
+            logging.info("Reached the maximum number of summary rounds.")
+            return " ".join(summaries)
+        return summarize_text(
+            "\n".join(summaries),
+            max_chunk_len=max_chunk_len,
+            overlap=overlap,
+            summary_prompt=summary_prompt,
+            number_of_points=number_of_points,
+            max_concurrency=max_concurrency,
+            max_rounds=max_rounds - 1,
+            oai_client=oai_client,
+            use_cache=use_cache,
+            cache=cache,
+        )
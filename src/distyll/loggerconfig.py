@@ -8,4 +8,6 @@ def setup_logger():
     )
 
 
+# Importing this module configures logging, so applications opt in with `import distyll.loggerconfig`;
+# `import distyll` no longer does it for them
 setup_logger()
@@ -0,0 +1,262 @@
+from weaviate import WeaviateClient
+from weaviate.classes.query import Filter, MetadataQuery
+from distyll.cache import LRUCache
+from distyll.config import COLLECTION_NAME, QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+from distyll.embeddings import Embedder
+from collections import deque
+from typing import Dict, List, Any, Union, Literal, Tuple
+import logging
+import threading
+import time
+
+SearchMode = Literal["near_text", "bm25", "hybrid"]
+RETURN_PROPERTIES = ["title", "url", "chunk", "chunk_no"]
+DEFAULT_TASK = (
+    "Answer the question below using only the text chunks above. "
+    "If they do not contain the answer, say so.\nQuestion: {query}"
+)
+
+_result_cache = LRUCache(QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_query_embedding_cache = LRUCache(QUERY_CACHE_SIZE)
+_latencies = dict()
+_latencies_lock = threading.Lock()
+LATENCY_WINDOW = 1000
+
+
+def _record_latency(operation: str, seconds: float) -> None:
+    with _latencies_lock:
+        _latencies.setdefault(operation, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def get_query_stats() -> Dict[str, Any]:
+    """
+    Latencies of recent queries (the last `LATENCY_WINDOW` of each operation), and cache statistics
+    :return: A dictionary from operation ("near_text", "bm25", "hybrid", "generate", "embed_query")
+        to "count", "mean_ms", "p50_ms", "p95_ms" and "max_ms"; plus "result_cache"
+        and "query_embedding_cache" statistics
+    """
+    stats = dict()
+    with _latencies_lock:
+        latencies = {operation: sorted(values) for operation, values in _latencies.items()}
+    for operation, values in latencies.items():
+        stats[operation] = {
+            "count": len(values),
+            "mean_ms": 1000 * sum(values) / len(values),
+            "p50_ms": 1000 * values[len(values) // 2],
+            "p95_ms": 1000 * values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max_ms": 1000 * values[-1],
+        }
+    stats["result_cache"] = _result_cache.stats()
+    stats["query_embedding_cache"] = _query_embedding_cache.stats()
+    return stats
+
+
+def clear_query_cache() -> None:
+    """
+    Clear cached results and query embeddings, and latency statistics
+    e.g. to see new chunks right after an ingest
+    :return: None
+    """
+    _result_cache.clear()
+    _query_embedding_cache.clear()
+    with _latencies_lock:
+        _latencies.clear()
+
+
+def get_filters(url: Union[str, List[str], None] = None, title: Union[str, None] = None):
+    """
+    Build a filter on the source of chunks
+    :param url: Source URL, or list of source URLs
+    :param title: Source title; may contain `*` and `?` wildcards
+    :return: Weaviate filter, or None for no filter
+    """
+    filters = list()
+    if isinstance(url, str):
+        filters.append(Filter.by_property("url").equal(url))
+    elif url is not None:
+        filters.append(Filter.by_property("url").contains_any(list(url)))
+    if title is not None:
+        filters.append(Filter.by_property("title").like(title))
+    if not filters:
+        return None
+    return Filter.all_of(filters) if len(filters) > 1 else filters[0]
+
+
+def embed_query(query: str, embedder: Embedder) -> List[float]:
+    """
+    Embed a query, for collections with vectors computed by distyll (see `distyll.embeddings`).
+    Query embeddings are cached in memory.
+    :param query:
+    :param embedder: The embedder the chunks were embedded with
+    :return: Query vector
+    """
+    key = (embedder.name, query)
+    vector = _query_embedding_cache.get(key)
+    if vector is None:
+        start = time.perf_counter()
+        vector = [float(x) for x in embedder.embed([query])[0]]
+        _record_latency("embed_query", time.perf_counter() - start)
+        _query_embedding_cache.set(key, vector)
+    return vector
+
+
+def _get_search_call(
+    mode: SearchMode,
+    query: str,
+    limit: int,
+    alpha: float,
+    filters,
+    embedder: Union[Embedder, None],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    :return: Name of the query method, and its arguments
+    """
+    kwargs = {"limit": limit, "filters": filters, "return_properties": RETURN_PROPERTIES}
+    if mode == "near_text":
+        kwargs["return_metadata"] = MetadataQuery(distance=True)
+        if embedder is not None:
+            return "near_vector", {"near_vector": embed_query(query, embedder), **kwargs}
+        return "near_text", {"query": query, **kwargs}
+    elif mode == "bm25":
+        return "bm25", {"query": query, "return_metadata": MetadataQuery(score=True), **kwargs}
+    elif mode == "hybrid":
+        vector = embed_query(query, embedder) if embedder is not None else None
+        return "hybrid", {
+            "query": query,
+            "alpha": alpha,
+            "vector": vector,
+            "return_metadata": MetadataQuery(score=True),
+            **kwargs,
+        }
+    else:
+        raise ValueError(f"Unsupported search mode: {mode}")
+
+
+def _to_result(o) -> Dict[str, Any]:
+    return {
+        "uuid": str(o.uuid),
+        **{name: o.properties.get(name) for name in RETURN_PROPERTIES},
+        "score": o.metadata.score,
+        "distance": o.metadata.distance,
+    }
+
+
+def search(
+    client: WeaviateClient,
+    query: str,
+    mode: SearchMode = "hybrid",
+    limit: int = 5,
+    alpha: float = 0.5,
+    url: Union[str, List[str], None] = None,
+    title: Union[str, None] = None,
+    embedder: Union[Embedder, None] = None,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Search the chunks in the database.
+    Results are cached in memory for `distyll.config.QUERY_CACHE_TTL` seconds.
+    :param client: Weaviate client
+    :param query: Search query
+    :param mode: "near_text" (vector search), "bm25" (keyword search) or "hybrid" (both, fused)
+    :param limit: Number of chunks to return
+    :param alpha: Weight of vector search in hybrid search (0: pure BM25, 1: pure vector search)
+    :param url: Only search the chunks of this source URL (or list of URLs)
+    :param title: Only search the chunks of sources with this title (may contain `*` wildcards)
+    :param embedder: For collections with vectors computed by distyll, the embedder they were computed with
+    :param use_cache: Set to False to bypass the result cache
+    :return: List of chunks, best first, with "uuid", "title", "url", "chunk", "chunk_no",
+        and "score" (BM25 and hybrid) or "distance" (vector search)
+    """
+    key = (
+        "search",
+        mode,
+        query,
+        limit,
+        alpha,
+        url if isinstance(url, (str, type(None))) else tuple(url),
+        title,
+        embedder.name if embedder is not None else None,
+    )
+    if use_cache:
+        results = _result_cache.get(key)
+        if results is not None:
+            return [dict(r) for r in results]
+
+    chunks_collection = client.collections.get(COLLECTION_NAME)
+    method, kwargs = _get_search_call(
+        mode, query, limit, alpha, get_filters(url, title), embedder
+    )
+    start = time.perf_counter()
+    response = getattr(chunks_collection.query, method)(**kwargs)
+    seconds = time.perf_counter() - start
+    _record_latency(mode, seconds)
+    logging.info(f"{mode} search for {query!r} took {1000 * seconds:.1f} ms")
+
+    results = [_to_result(o) for o in response.objects]
+    if use_cache:
+        _result_cache.set(key, results)
+    return [dict(r) for r in results]
+
+
+def generate(
+    client: WeaviateClient,
+    query: str,
+    task: Union[str, None] = None,
+    mode: SearchMode = "hybrid",
+    limit: int = 5,
+    alpha: float = 0.5,
+    url: Union[str, List[str], None] = None,
+    title: Union[str, None] = None,
+    embedder: Union[Embedder, None] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Retrieval-augmented generation: search the chunks, then have the collection's generative model
+    answer over the top `limit` chunks, in one request.
+    :param client: Weaviate client
+    :param query: Search query (and question, unless `task` is given)
+    :param task: Instruction for the generative model (default: answer `query` from the chunks)
+    :param mode: "near_text", "bm25" or "hybrid" retrieval
+    :param limit: Number of chunks to generate from
+    :param alpha: Weight of vector search in hybrid search
+    :param url: Only use the chunks of this source URL (or list of URLs)
+    :param title: Only use the chunks of sources with this title (may contain `*` wildcards)
+    :param embedder: For collections with vectors computed by distyll, the embedder they were computed with
+    :param use_cache: Set to False to bypass the result cache
+    :return: A dictionary with the "answer", and the "chunks" it was generated from (as returned by `search`)
+    """
+    if task is None:
+        task = DEFAULT_TASK.format(query=query)
+    key = (
+        "generate",
+        task,
+        mode,
+        query,
+        limit,
+        alpha,
+        url if isinstance(url, (str, type(None))) else tuple(url),
+        title,
+        embedder.name if embedder is not None else None,
+    )
+    if use_cache:
+        result = _result_cache.get(key)
+        if result is not None:
+            return {"answer": result["answer"], "chunks": [dict(c) for c in result["chunks"]]}
+
+    chunks_collection = client.collections.get(COLLECTION_NAME)
+    method, kwargs = _get_search_call(
+        mode, query, limit, alpha, get_filters(url, title), embedder
+    )
+    start = time.perf_counter()
+    response = getattr(chunks_collection.generate, method)(
+        grouped_task=task, grouped_properties=["title", "chunk"], **kwargs
+    )
+    seconds = time.perf_counter() - start
+    _record_latency("generate", seconds)
+    logging.info(f"Generation over {mode} search for {query!r} took {1000 * seconds:.1f} ms")
+
+    answer = response.generative.text if response.generative is not None else None
+    result = {"answer": answer, "chunks": [_to_result(o) for o in response.objects]}
+    if use_cache and answer is not None:
+        _result_cache.set(key, result)
+    return {"answer": answer, "chunks": [dict(c) for c in result["chunks"]]}
@@ -0,0 +1,291 @@
+from weaviate.classes.config import (
+    Configure,
+    Reconfigure,
+    Property,
+    DataType,
+    Tokenization,
+    VectorDistances,
+)
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List, Literal, Tuple, Union
+import re
+import distyll.config
+
+VectorIndexType = Literal["hnsw", "flat", "dynamic"]
+Quantizer = Literal["pq", "bq", "sq"]
+
+# Settings Weaviate can change on an existing collection
+MUTABLE_SETTINGS = {"ef", "bm25_b", "bm25_k1"}
+HNSW_SETTINGS = {"ef", "ef_construction", "max_connections"}
+QUANTIZER_SETTINGS = {"quantizer", "pq_segments", "quantizer_training_limit", "rescore_limit"}
+
+
+@dataclass(frozen=True)
+class CollectionConfig:
+    """
+    Index settings of the chunks collection.
+    Settings left as None are chosen by Weaviate, and ignored when comparing with an existing collection.
+
+    :param vector_index: "hnsw", "flat" (brute force; for small collections or tenants)
+        or "dynamic" (flat, switching to HNSW beyond `dynamic_threshold` objects)
+    :param distance: Vector distance metric
+    :param ef: HNSW search list size (-1: dynamic, depending on the query limit)
+    :param ef_construction: HNSW build list size
+    :param max_connections: HNSW connections per node
+    :param dynamic_threshold: Number of objects beyond which a dynamic index switches to HNSW
+    :param quantizer: None, "pq", "bq" or "sq" to compress vectors in memory (flat indexes only support "bq")
+    :param pq_segments: Number of PQ segments
+    :param quantizer_training_limit: Number of objects used to train PQ or SQ
+    :param rescore_limit: Number of candidates rescored with full vectors, for BQ and SQ
+    :param bm25_b: BM25 length normalisation
+    :param bm25_k1: BM25 term frequency saturation
+    :param index_timestamps: Index creation and update times, to filter on them
+    :param index_property_length: Index property lengths, to filter on them
+    :param index_null_state: Index null values, to filter on them
+    :param url_tokenization: "field" to filter on whole URLs, or "word" to match words of URLs
+    :param chunk_no_range_filters: Index `chunk_no` for fast range filters (e.g. the first chunks of sources)
+    """
+
+    vector_index: VectorIndexType = "hnsw"
+    distance: Literal["cosine", "dot", "l2-squared", "hamming", "manhattan"] = "cosine"
+    ef: int = -1
+    ef_construction: int = 128
+    max_connections: int = 32
+    dynamic_threshold: int = 10_000
+    quantizer: Union[Quantizer, None] = None
+    pq_segments: Union[int, None] = None
+    quantizer_training_limit: Union[int, None] = None
+    rescore_limit: Union[int, None] = None
+    bm25_b: float = 0.75
+    bm25_k1: float = 1.2
+    index_timestamps: bool = False
+    index_property_length: bool = False
+    index_null_state: bool = False
+    url_tokenization: Literal["field", "word"] = "field"
+    chunk_no_range_filters: bool = True
+
+    def __post_init__(self):
+        if self.vector_index not in ("hnsw", "flat", "dynamic"):
+            raise ValueError(f"Unsupported vector index: {self.vector_index}")
+        if self.quantizer not in (None, "pq", "bq", "sq"):
+            raise ValueError(f"Unsupported quantizer: {self.quantizer}")
+        if self.vector_index == "flat" and self.quantizer not in (None, "bq"):
+            raise ValueError("Flat indexes only support BQ quantization")
+
+
+def _get_quantizer_config(config: CollectionConfig):
+    if config.quantizer == "pq":
+        return Configure.VectorIndex.Quantizer.pq(
+            segments=config.pq_segments, training_limit=config.quantizer_training_limit
+        )
+    elif config.quantizer == "bq":
+        return Configure.VectorIndex.Quantizer.bq(rescore_limit=config.rescore_limit)
+    elif config.quantizer == "sq":
+        return Configure.VectorIndex.Quantizer.sq(
+            rescore_limit=config.rescore_limit, training_limit=config.quantizer_training_limit
+        )
+    return None
+
+
+def get_vector_index_config(config: CollectionConfig):
+    """
+    :param config:
+    :return: Weaviate vector index configuration for creating the collection
+    """
+    distance = VectorDistances(config.distance)
+    hnsw = Configure.VectorIndex.hnsw(
+        distance_metric=distance,
+        ef=config.ef,
+        ef_construction=config.ef_construction,
+        max_connections=config.max_connections,
+        quantizer=_get_quantizer_config(config),
+    )
+    if config.vector_index == "hnsw":
+        return hnsw
+    flat = Configure.VectorIndex.flat(
+        distance_metric=distance,
+        quantizer=_get_quantizer_config(config) if config.quantizer == "bq" else None,
+    )
+    if config.vector_index == "flat":
+        return flat
+    return Configure.VectorIndex.dynamic(
+        distance_metric=distance, threshold=config.dynamic_threshold, hnsw=hnsw, flat=flat
+    )
+
+
+def get_properties(config: CollectionConfig) -> List[Property]:
+    return [
+        Property(name="title", data_type=DataType.TEXT),
+        Property(
+            name="url",
+            data_type=DataType.TEXT,
+            skip_vectorization=True,
+            tokenization=Tokenization(config.url_tokenization),
+        ),
+        Property(name="chunk", data_type=DataType.TEXT),
+        Property(
+            name="chunk_no",
+            data_type=DataType.INT,
+            index_range_filters=config.chunk_no_range_filters,
+        ),
+    ]
+
+
+def get_collection_kwargs(config: CollectionConfig, local_vectors: bool) -> Dict[str, Any]:
+    """
+    Arguments to create the chunks collection with `client.collections.create`
+    :param config: Index settings
+    :param local_vectors: Create the collection without a vectorizer, for vectors computed by distyll
+    :return:
+    """
+    return {
+        "properties": get_properties(config),
+        "vectorizer_config": (
+            Configure.Vectorizer.none()
+            if local_vectors
+            else Configure.Vectorizer.text2vec_openai()
+        ),
+        "generative_config": Configure.Generative.openai(
+            model=distyll.config.load_gen_model()
+        ),
+        "vector_index_config": get_vector_index_config(config),
+        "inverted_index_config": Configure.inverted_index(
+            bm25_b=config.bm25_b,
+            bm25_k1=config.bm25_k1,
+            index_timestamps=config.index_timestamps,
+            index_property_length=config.index_property_length,
+            index_null_state=config.index_null_state,
+        ),
+    }
+
+
+def _get_quantizer_name(quantizer_config) -> Union[str, None]:
+    # e.g. _PQConfig (read from Weaviate) or _PQConfigCreate -> "pq"
+    if quantizer_config is None:
+        return None
+    match = re.match(r"_?([A-Za-z]+?)Config", type(quantizer_config).__name__)
+    return match.group(1).lower() if match else type(quantizer_config).__name__
+
+
+def read_collection_config(weaviate_config) -> Tuple[CollectionConfig, bool]:
+    """
+    Read the settings of an existing collection
+    :param weaviate_config: Configuration returned by `collection.config.get()`
+    :return: The settings, and whether the collection has no vectorizer (vectors computed by distyll)
+    """
+    index_type = getattr(weaviate_config.vector_index_type, "value", weaviate_config.vector_index_type)
+    index_config = weaviate_config.vector_index_config
+    hnsw_config = index_config.hnsw if index_type == "dynamic" else index_config
+    quantizer_config = getattr(hnsw_config, "quantizer", None)
+    if index_type == "dynamic" and quantizer_config is None:
+        quantizer_config = getattr(index_config.flat, "quantizer", None)
+    properties = {p.name: p for p in weaviate_config.properties}
+    inverted = weaviate_config.inverted_index_config
+
+    settings = {
+        "vector_index": index_type,
+        "distance": getattr(index_config.distance_metric, "value", index_config.distance_metric),
+        "dynamic_threshold": getattr(index_config, "threshold", CollectionConfig.dynamic_threshold),
+        "quantizer": _get_quantizer_name(quantizer_config),
+        "pq_segments": getattr(quantizer_config, "segments", None),
+        "quantizer_training_limit": getattr(quantizer_config, "training_limit", None),
+        "rescore_limit": getattr(quantizer_config, "rescore_limit", None),
+        "bm25_b": inverted.bm25.b,
+        "bm25_k1": inverted.bm25.k1,
+        "index_timestamps": inverted.index_timestamps,
+        "index_property_length": inverted.index_property_length,
+        "index_null_state": inverted.index_null_state,
+        "url_tokenization": getattr(
+            properties["url"].tokenization, "value", properties["url"].tokenization
+        ),
+        "chunk_no_range_filters": bool(properties["chunk_no"].index_range_filters),
+    }
+    if hnsw_config is not None and hasattr(hnsw_config, "ef_construction"):
+        settings["ef"] = hnsw_config.ef
+        settings["ef_construction"] = hnsw_config.ef_construction
+        settings["max_connections"] = hnsw_config.max_connections
+
+    config = CollectionConfig(**settings)
+    vectorizer = getattr(weaviate_config.vectorizer, "value", weaviate_config.vectorizer)
+    return config, vectorizer in (None, "none")
+
+
+def get_config_changes(
+    current: CollectionConfig, target: CollectionConfig
+) -> Dict[str, Tuple[Any, Any]]:
+    """
+    Compare the settings of a collection with target settings
+    :param current:
+    :param target:
+    :return: Dictionary from setting name to (current value, target value), for the settings that differ
+    """
+    changes = dict()
+    for field in fields(CollectionConfig):
+        current_value = getattr(current, field.name)
+        target_value = getattr(target, field.name)
+        if target_value is None and field.name != "quantizer":
+            continue
+        # Settings of index types the target does not use
+        if field.name in HNSW_SETTINGS and target.vector_index == "flat":
+            continue
+        if field.name == "dynamic_threshold" and target.vector_index != "dynamic":
+            continue
+        if current_value != target_value:
+            changes[field.name] = (current_value, target_value)
+    return changes
+
+
+def can_update_in_place(current: CollectionConfig, changes: Dict[str, Tuple[Any, Any]]) -> bool:
+    """
+    Whether Weaviate can apply changes to an existing collection, or the collection must be rebuilt.
+    BM25 and HNSW search settings can be updated (the latter not on dynamic indexes),
+    and quantization enabled on an uncompressed HNSW (or flat, for BQ) index.
+    :param current: Current settings
+    :param changes: Changes, as returned by `get_config_changes`
+    :return:
+    """
+    for name in changes:
+        if name in MUTABLE_SETTINGS and (current.vector_index != "dynamic" or name not in HNSW_SETTINGS):
+            continue
+        if (
+            name in QUANTIZER_SETTINGS
+            and current.quantizer is None
+            and "quantizer" in changes
+            and current.vector_index in ("hnsw", "flat")
+        ):
+            continue
+        return False
+    return True
+
+
+def get_update_kwargs(config: CollectionConfig) -> Dict[str, Any]:
+    """
+    Arguments to bring an existing collection to the target settings with `collection.config.update`,
+    for changes allowed by `can_update_in_place`
+    :param config: Target settings
+    :return:
+    """
+    quantizer = None
+    if config.quantizer == "pq":
+        quantizer = Reconfigure.VectorIndex.Quantizer.pq(
+            segments=config.pq_segments, training_limit=config.quantizer_training_limit
+        )
+    elif config.quantizer == "bq":
+        quantizer = Reconfigure.VectorIndex.Quantizer.bq(rescore_limit=config.rescore_limit)
+    elif config.quantizer == "sq":
+        quantizer = Reconfigure.VectorIndex.Quantizer.sq(
+            rescore_limit=config.rescore_limit, training_limit=config.quantizer_training_limit
+        )
+
+    kwargs = {
+        "inverted_index_config": Reconfigure.inverted_index(
+            bm25_b=config.bm25_b, bm25_k1=config.bm25_k1
+        ),
+    }
+    if config.vector_index == "flat":
+        kwargs["vector_index_config"] = Reconfigure.VectorIndex.flat(quantizer=quantizer)
+    elif config.vector_index == "hnsw":
+        kwargs["vector_index_config"] = Reconfigure.VectorIndex.hnsw(
+            ef=config.ef, quantizer=quantizer
+        )
+    return kwargs
@@ -1,3 +1,13 @@
-from .text import from_arxiv_paper, from_pdf
+from .text import (
+    from_arxiv_paper,
+    from_pdf,
+    get_arxiv_paper_metadata,
+    prefetch_arxiv_metadata,
+)
 
-__all__ = ["from_arxiv_paper", "from_pdf"]
+__all__ = [
+    "from_arxiv_paper",
+    "from_pdf",
+    "get_arxiv_paper_metadata",
+    "prefetch_arxiv_metadata",
+]
@@ -1,20 +1,29 @@
-from distyll.utils import get_arxiv_title
 from distyll.utils import (
     init_dl_dir,
+    download_file_cached,
+    read_download_meta,
+    get_arxiv_id,
+    get_arxiv_metadata,
+    get_arxiv_metadata_bulk,
 )
 from distyll.config import DL_DIR
+from distyll.instrumentation import span, count_cache
 from pypdf import PdfReader
-from typing import Union, Dict
+from typing import Union, Dict, List, Any, Iterable
 from pathlib import Path
-import requests
+from concurrent.futures import Executor, ProcessPoolExecutor
+import json
 import logging
 
 
-def _download_pdf(pdf_url: str, dl_dir: Union[str, Path] = DL_DIR) -> Path:
+def _download_pdf(
+    pdf_url: str, dl_dir: Union[str, Path] = DL_DIR, revalidate: bool = False
+) -> Path:
     """
     Get the text from a PDF and parse it
     :param pdf_url:
     :param dl_dir
+    :param revalidate: Check a cached PDF with the server (conditional GET) instead of using it as is
     :return:
     """
     logging.info(f"Downloading {pdf_url} text")
@@ -24,60 +33,194 @@ def _download_pdf(pdf_url: str, dl_dir: Union[str, Path] = DL_DIR) -> Path:
     dl_dir = init_dl_dir(dl_dir)
     out_path = Path(dl_dir) / pdf_filename
 
-    # Does file exist already
-    if out_path.exists():
-        return out_path
+    # Use the existing file, or get (or revalidate) the PDF file
+    download_file_cached(pdf_url, out_path, revalidate=revalidate)
+    return out_path
 
-    # Get PDF file
-    else:
-        response = requests.get(pdf_url)
-        with out_path.open("wb") as f:
-            f.write(response.content)
 
-    return out_path
+def _extract_page_range(pdf_path: Path, start: int, end: int) -> List[str]:
+    """
+    Extract the text of a range of pages, with a reader of its own (so it can run in a worker process)
+    :param pdf_path:
+    :param start: First page number
+    :param end: Page number after the last page
+    :return: List of page texts
+    """
+    pdf_reader = PdfReader(pdf_path)
+    return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, end)]
 
 
-def _parse_pdf(pdf_path: Union[Path, str]) -> str:
+def _parse_pdf_pages(pdf_path: Union[Path, str], max_workers: int = 1) -> List[str]:
     """
-    Read contents of a PDF files
+    Read contents of a PDF file, page by page
     :param pdf_path:
-    :return:
+    :param max_workers: Number of processes to split the pages across
+    :return: List of page texts, in page order
     """
     logging.info(f"Parsing text from {pdf_path}")
     if type(pdf_path) == str:
         pdf_path = Path(pdf_path)
-    pdf_reader = PdfReader(pdf_path)
+    n_pages = len(PdfReader(pdf_path).pages)
 
-    # Initialize a string to store the text content
-    pdf_text = ""
-    n_pages = len(pdf_reader.pages)
+    n_workers = min(max_workers, n_pages)
+    if n_workers <= 1:
+        return _extract_page_range(pdf_path, 0, n_pages)
 
-    # Iterate through the pages and extract the text
-    for page_num in range(n_pages):
-        page = pdf_reader.pages[page_num]
-        pdf_text += "\n" + page.extract_text()
-    return pdf_text
+    # Split the pages into contiguous ranges, one per worker
+    bounds = [n_pages * i // n_workers for i in range(n_workers + 1)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(_extract_page_range, pdf_path, bounds[i], bounds[i + 1])
+            for i in range(n_workers)
+        ]
+        return [page for future in futures for page in future.result()]
 
 
-def from_pdf(pdf_url: str) -> str:
+def _join_pages(pages: List[str]) -> str:
+    return "".join("\n" + page for page in pages)
+
+
+def _parse_pdf(pdf_path: Union[Path, str], max_workers: int = 1) -> str:
+    """
+    Read contents of a PDF files
+    :param pdf_path:
+    :param max_workers: Number of processes to split the pages across
+    :return:
+    """
+    return _join_pages(_parse_pdf_pages(pdf_path, max_workers=max_workers))
+
+
+def _get_pages_cache_path(pdf_path: Path) -> Path:
+    return pdf_path.with_name(pdf_path.name + ".pages.json")
+
+
+def from_pdf(
+    pdf_url: str,
+    executor: Union[Executor, None] = None,
+    by_page: bool = False,
+    max_workers: int = 1,
+    revalidate: bool = False,
+    dl_dir: Union[str, Path] = DL_DIR,
+) -> Union[str, List[str]]:
     """
     Downloads a PDF file from the specified URL and parses its text content.
+    Parsed pages are cached by the content hash of the PDF, so a PDF is only re-parsed when its bytes change.
 
     :param pdf_url: The URL of the PDF file to download and parse.
+    :param executor: (Optional) Executor to parse the PDF in, e.g. a ProcessPoolExecutor.
+    :param by_page: (Optional) Return a list with the text of each page instead of a single string.
+    :param max_workers: (Optional) Number of processes to split the pages across.
+    :param revalidate: (Optional) Check a cached PDF with the server instead of using it as is.
+    :param dl_dir: (Optional) The directory to download the PDF to.
     :return: The parsed text content of the PDF file.
     """
     logging.info(f"Downloading and reading text from {pdf_url}")
-    pdf_path = _download_pdf(pdf_url)
-    pdf_text = _parse_pdf(pdf_path)
-    return pdf_text
+    pdf_path = _download_pdf(pdf_url, dl_dir=dl_dir, revalidate=revalidate)
+
+    download_meta = read_download_meta(pdf_path)
+    pages_cache_path = _get_pages_cache_path(pdf_path)
+    pages = None
+    if download_meta is not None and pages_cache_path.exists():
+        pages_cache = json.loads(pages_cache_path.read_text())
+        if pages_cache["sha256"] == download_meta["sha256"]:
+            logging.info(f"Found parsed text of {pdf_path} in {pages_cache_path}")
+            count_cache("pdf_pages", hits=1)
+            pages = pages_cache["pages"]
+
+    if pages is None:
+        count_cache("pdf_pages", misses=1)
+        with span("parse_pdf", url=pdf_url, bytes=pdf_path.stat().st_size) as attributes:
+            if executor is None:
+                pages = _parse_pdf_pages(pdf_path, max_workers=max_workers)
+            else:
+                pages = executor.submit(_parse_pdf_pages, pdf_path, max_workers).result()
+            attributes["pages"] = len(pages)
+        if download_meta is not None:
+            pages_cache_path.write_text(
+                json.dumps({"sha256": download_meta["sha256"], "pages": pages})
+            )
+
+    if by_page:
+        return pages
+    return _join_pages(pages)
+
+
+def _get_arxiv_cache_path(arxiv_id: str, suffix: str, dl_dir: Union[str, Path]) -> Path:
+    # Old-style IDs contain a slash, e.g. hep-th/9901001
+    return Path(dl_dir) / f"{arxiv_id.replace('/', '_')}{suffix}"
+
+
+def get_arxiv_paper_metadata(
+    arxiv_url: str, dl_dir: Union[str, Path] = DL_DIR, refresh: bool = False
+) -> Union[Dict[str, Any], None]:
+    """
+    Get the metadata (title, authors, date, abstract...) of an arXiv paper,
+    from the per-paper metadata cache next to the paper text, or from arXiv.
 
+    :param arxiv_url: The URL (or ID) of the arXiv paper.
+    :param dl_dir: (Optional) The directory of the cache.
+    :param refresh: (Optional) Fetch the metadata from arXiv even if it is cached.
+    :return: The metadata, or None if it could not be fetched.
+    """
+    arxiv_id = get_arxiv_id(arxiv_url)
+    metadata_path = _get_arxiv_cache_path(arxiv_id, ".metadata.json", dl_dir)
+    if metadata_path.exists() and not refresh:
+        logging.info(f"Found arXiv metadata in {metadata_path}")
+        return json.loads(metadata_path.read_text())
+
+    metadata = get_arxiv_metadata(arxiv_id)
+    if metadata is not None:
+        init_dl_dir(dl_dir)
+        metadata_path.write_text(json.dumps(metadata))
+    return metadata
+
+
+def prefetch_arxiv_metadata(
+    arxiv_urls: Iterable[str], dl_dir: Union[str, Path] = DL_DIR
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Fill the metadata cache for many arXiv papers, with bulk requests to the arXiv export API
+    for the papers that are not cached yet.
 
-def from_arxiv_paper(arxiv_url: str) -> Union[Dict[str, str], None]:
+    :param arxiv_urls: The URLs (or IDs) of the arXiv papers.
+    :param dl_dir: (Optional) The directory of the cache.
+    :return: A dictionary from paper ID to metadata, for the papers with metadata.
+    """
+    results = dict()
+    missing_ids = list()
+    for arxiv_url in arxiv_urls:
+        arxiv_id = get_arxiv_id(arxiv_url)
+        metadata_path = _get_arxiv_cache_path(arxiv_id, ".metadata.json", dl_dir)
+        if metadata_path.exists():
+            results[arxiv_id] = json.loads(metadata_path.read_text())
+        else:
+            missing_ids.append(arxiv_id)
+
+    if missing_ids:
+        init_dl_dir(dl_dir)
+        for arxiv_id, metadata in get_arxiv_metadata_bulk(missing_ids).items():
+            _get_arxiv_cache_path(arxiv_id, ".metadata.json", dl_dir).write_text(
+                json.dumps(metadata)
+            )
+            results[arxiv_id] = metadata
+    return results
+
+
+def from_arxiv_paper(
+    arxiv_url: str,
+    executor: Union[Executor, None] = None,
+    revalidate: bool = False,
+    dl_dir: Union[str, Path] = DL_DIR,
+) -> Union[Dict[str, Any], None]:
     """
     Retrieve arXiv paper information.
+    The text and metadata are cached per paper, so a cached paper needs no network requests.
 
     :param arxiv_url: The URL of the arXiv paper.
-    :return: A dictionary containing the title, URL, and text of the arXiv paper.
+    :param executor: (Optional) Executor to parse the PDF in, e.g. a ProcessPoolExecutor.
+    :param revalidate: (Optional) Check the cached PDF with arXiv; the text is only re-parsed if the PDF changed.
+    :param dl_dir: (Optional) The directory to download the paper to.
+    :return: A dictionary containing the title, URL, text and metadata of the arXiv paper.
     """
     logging.info(f"Getting arXiV paper from {arxiv_url}")
     if "arxiv.org" not in arxiv_url:
@@ -85,20 +228,23 @@ def from_arxiv_paper(arxiv_url: str) -> Union[Dict[str, str], None]:
         return None
 
     # Get Arxiv paper ID
-    arxiv_id = arxiv_url.split("/")[-1]
-    if arxiv_id.endswith(".pdf"):
-        arxiv_id = arxiv_id[:-4]
-    txt_path = Path(DL_DIR) / f"{arxiv_id}.txt"
+    arxiv_id = get_arxiv_id(arxiv_url)
+    txt_path = _get_arxiv_cache_path(arxiv_id, ".txt", dl_dir)
 
-    # Get title
-    title = get_arxiv_title(f"https://arxiv.org/abs/{arxiv_id}")
+    # Get title and other metadata
+    metadata = get_arxiv_paper_metadata(arxiv_id, dl_dir=dl_dir)
+    title = metadata.get("title") if metadata is not None else None
 
     # Check if text exists already
-    if txt_path.exists():
+    if txt_path.exists() and not revalidate:
         pdf_text = txt_path.read_text()
-        return {"title": title, "url": arxiv_url, "text": pdf_text}
     else:
-        pdf_text = from_pdf(f"https://arxiv.org/pdf/{arxiv_id}.pdf")
+        pdf_text = from_pdf(
+            f"https://arxiv.org/pdf/{arxiv_id}.pdf",
+            executor=executor,
+            revalidate=revalidate,
+            dl_dir=dl_dir,
+        )
         with txt_path.open("w") as f:
             f.write(pdf_text)
-        return {"title": title, "url": arxiv_url, "text": pdf_text}
+    return {"title": title, "url": arxiv_url, "text": pdf_text, "metadata": metadata}
@@ -1,3 +1,3 @@
-from .transcripts import from_youtube, from_local_video
+from .transcripts import from_youtube, from_youtube_playlist, from_local_video
 
-__all__ = ["from_youtube", "from_local_video"]
+__all__ = ["from_youtube", "from_youtube_playlist", "from_local_video"]
@@ -1,15 +1,15 @@
 import json
 
 from distyll.utils import (
-    get_transcripts_from_audio_file,
-    get_youtube_metadata,
-    download_youtube,
+    get_transcript_segments_from_audio_file,
+    get_transcript_segments_from_video,
+    download_youtube_cached,
+    download_youtube_many,
     init_dl_dir,
     get_yt_video_id,
-    get_audio_from_video,
 )
 from distyll.config import DL_DIR
-from typing import Union, Dict
+from typing import Union, Dict, List
 from pathlib import Path
 import logging
 
@@ -23,7 +23,8 @@ def from_youtube(
     :param yt_url: The URL of the YouTube video.
     :param dl_dir: (Optional) The directory to download the video to.
     :param openai_apikey: (Optional) OpenAI API key.
-    :return: A dictionary containing the video title, the YouTube URL, and the transcript texts.
+    :return: A dictionary containing the video title, the YouTube URL, the transcript texts,
+        and the start/end times (in seconds) of the audio segment behind each transcript.
     """
     logging.info(f"Processing {yt_url}, just getting the video title.")
     # Set up download
@@ -35,22 +36,18 @@ def from_youtube(
     yt_out_path = Path(dl_dir) / yt_filename
 
     if not transcript_json_path.exists():
-        if yt_out_path.exists():
-            logging.info(
-                f"Already downloaded {yt_filename}, just getting the video title."
-            )
-            video_metadata = get_youtube_metadata(youtube_url=yt_url)
-        else:
-            logging.info(f"Downloading {yt_filename}, just getting the video title.")
-            video_metadata = download_youtube(youtube_url=yt_url, path_out=yt_out_path)
+        # No network requests if the audio and its metadata were downloaded before
+        video_metadata = download_youtube_cached(youtube_url=yt_url, path_out=yt_out_path)
 
         video_title = video_metadata["title"]
         video_date = video_metadata["upload_date"]
         video_uploader = video_metadata["uploader"]
         channel = video_metadata["channel"]
 
-        transcript_texts = get_transcripts_from_audio_file(
-            yt_out_path, openai_apikey=openai_apikey
+        transcript_segments = get_transcript_segments_from_audio_file(
+            yt_out_path,
+            openai_apikey=openai_apikey,
+            cache_dir=Path(dl_dir) / "transcript_cache",
         )
         transcript_data = {
             "title": video_title,
@@ -58,7 +55,10 @@ def from_youtube(
             "yt_url": yt_url,
             "uploader": video_uploader,
             "channel": channel,
-            "transcripts": transcript_texts,
+            "transcripts": [s["text"] for s in transcript_segments],
+            "segments": [
+                {"start": s["start"], "end": s["end"]} for s in transcript_segments
+            ],
         }
         transcript_json_path.write_text(json.dumps(transcript_data))
         return transcript_data
@@ -67,9 +67,53 @@ def from_youtube(
         return json.loads(transcript_json_path.read_text())
 
 
-def from_local_video(video_path: Union[str, Path], openai_apikey: str = None):
-    audio_path = get_audio_from_video(video_path)
-    transcript_texts = get_transcripts_from_audio_file(
-        audio_path, openai_apikey=openai_apikey
+def from_youtube_playlist(
+    playlist_url: str,
+    dl_dir: Union[str, Path] = DL_DIR,
+    openai_apikey: str = None,
+    max_download_workers: int = 4,
+) -> List[Dict[str, str]]:
+    """
+    Retrieves the transcripts of the videos of a YouTube playlist or channel.
+    The audio of all videos is downloaded in parallel first, then each video is transcribed.
+
+    :param playlist_url: The URL of the YouTube playlist or channel (or of a single video).
+    :param dl_dir: (Optional) The directory to download the videos to.
+    :param openai_apikey: (Optional) OpenAI API key.
+    :param max_download_workers: (Optional) Maximum number of concurrent downloads.
+    :return: One dictionary per video downloaded, as returned by `from_youtube`.
+    """
+    downloads = download_youtube_many(
+        [playlist_url], dl_dir=dl_dir, max_workers=max_download_workers
+    )
+    transcripts = list()
+    for download in downloads:
+        if download["error"] is not None:
+            logging.warning(f"Skipping {download['url']}: {download['error']}")
+            continue
+        transcripts.append(
+            from_youtube(download["url"], dl_dir=dl_dir, openai_apikey=openai_apikey)
+        )
+    return transcripts
+
+
+def from_local_video(
+    video_path: Union[str, Path],
+    openai_apikey: str = None,
+    max_segment_len: Union[int, None] = None,
+) -> List[str]:
+    """
+    Transcribe a local video.
+    Its audio track is extracted straight to segment files by ffmpeg (see `distyll.utils.extract_audio_segments`),
+    so the work scales with the audio duration rather than the video size.
+
+    :param video_path: Path of the video file.
+    :param openai_apikey: (Optional) OpenAI API key.
+    :param max_segment_len: (Optional) Maximum length of the audio segments sent to Whisper, in seconds.
+        By default, the longest that fits `distyll.config.AUDIO_SEGMENT_BYTES`.
+    :return: The transcript of each audio segment.
+    """
+    transcript_segments = get_transcript_segments_from_video(
+        video_path, max_segment_len=max_segment_len, openai_apikey=openai_apikey
     )
-    return transcript_texts
+    return [s["text"] for s in transcript_segments]
@@ -1,14 +1,63 @@
-from bs4 import BeautifulSoup
-from typing import Union, List, Dict, Any, Literal
-import requests
+from typing import (
+    Union,
+    List,
+    Dict,
+    Any,
+    Literal,
+    Iterable,
+    Iterator,
+    BinaryIO,
+    Tuple,
+    TYPE_CHECKING,
+)
 import logging
 from pathlib import Path
-from openai import OpenAI
-import yt_dlp
+from distyll.config import (
+    DL_DIR,
+    TRANSCRIPT_CACHE_DIR,
+    AUDIO_PROFILE,
+    AUDIO_SEGMENT_BYTES,
+    YOUTUBE_AUDIO_QUALITY,
+)
+from distyll.instrumentation import span, count_cache, in_current_context
 import os
+import io
+import json
+import hashlib
+import threading
+import re
+import math
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import deque
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# openai, requests and yt_dlp are slow to import, so they are imported by the functions that use them
+if TYPE_CHECKING:
+    import numpy as np
+    import tiktoken
+    import requests
+    from openai import OpenAI, AsyncOpenAI
 
 
 OPENAI_APIKEY = None
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_TIMEOUT = 600.0
+
+# Process-wide OpenAI clients, keyed by (client type, API key, pool size, timeout)
+_openai_clients: Dict[Tuple[str, str, int, float], Any] = dict()
+_openai_clients_lock = threading.Lock()
+
+HTTP_POOL_SIZE = 20
+HTTP_TIMEOUT = 60
+HTTP_RETRIES = 3
+_http_session = None
+_http_session_lock = threading.Lock()
 
 
 def init_dl_dir(dir_path: Union[str, Path]) -> Path:
@@ -44,23 +93,375 @@ def set_api_key(openai: str = None) -> bool:
     return False
 
 
-def get_openai_client(apikey: Union[str, None] = None) -> OpenAI:
+def _resolve_openai_apikey(apikey: Union[str, None] = None) -> str:
     """
-    Helper function to get an OpenAI client
+    Get the OpenAI API key from the argument, `set_api_key`, or the OPENAI_APIKEY environment variable
     :param apikey:
-    :return:
+    :return: API key
     """
-    global OPENAI_APIKEY
     if apikey is not None:
-        oai_client = OpenAI(api_key=apikey)
+        return apikey
     elif OPENAI_APIKEY is not None:
-        oai_client = OpenAI(api_key=OPENAI_APIKEY)
+        return OPENAI_APIKEY
+    elif os.getenv("OPENAI_APIKEY") is not None:
+        return os.getenv("OPENAI_APIKEY")
     else:
-        if os.getenv("OPENAI_APIKEY") is not None:
-            oai_client = OpenAI(api_key=os.getenv("OPENAI_APIKEY"))
-        else:
-            raise ValueError("OpenAI API key not provided.")
-    return oai_client
+        raise ValueError("OpenAI API key not provided.")
+
+
+def get_openai_client(
+    apikey: Union[str, None] = None,
+    max_connections: int = OPENAI_MAX_CONNECTIONS,
+    timeout: float = OPENAI_TIMEOUT,
+) -> "OpenAI":
+    """
+    Helper function to get an OpenAI client.
+    Clients are created once per process for each API key and pool configuration,
+    so their HTTP connection pools (and keep-alive connections) are reused across calls.
+    :param apikey:
+    :param max_connections: Size of the HTTP connection pool
+    :param timeout: Request timeout, in seconds
+    :return:
+    """
+    from openai import OpenAI, DefaultHttpxClient
+    import httpx
+
+    apikey = _resolve_openai_apikey(apikey)
+    registry_key = ("sync", apikey, max_connections, timeout)
+    with _openai_clients_lock:
+        if registry_key not in _openai_clients:
+            _openai_clients[registry_key] = OpenAI(
+                api_key=apikey,
+                timeout=timeout,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                    ),
+                    timeout=timeout,
+                ),
+            )
+        return _openai_clients[registry_key]
+
+
+def get_async_openai_client(
+    apikey: Union[str, None] = None,
+    max_connections: int = OPENAI_MAX_CONNECTIONS,
+    timeout: float = OPENAI_TIMEOUT,
+) -> "AsyncOpenAI":
+    """
+    Helper function to get an async OpenAI client, reused like `get_openai_client`.
+    Its connection pool belongs to the event loop it is first used in.
+    :param apikey:
+    :param max_connections: Size of the HTTP connection pool
+    :param timeout: Request timeout, in seconds
+    :return:
+    """
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    import httpx
+
+    apikey = _resolve_openai_apikey(apikey)
+    registry_key = ("async", apikey, max_connections, timeout)
+    with _openai_clients_lock:
+        if registry_key not in _openai_clients:
+            _openai_clients[registry_key] = AsyncOpenAI(
+                api_key=apikey,
+                timeout=timeout,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                    ),
+                    timeout=timeout,
+                ),
+            )
+        return _openai_clients[registry_key]
+
+
+def close_openai_clients() -> None:
+    """
+    Close the connection pools of all sync OpenAI clients and clear the registry
+    :return: None
+    """
+    with _openai_clients_lock:
+        for (client_type, *_), client in _openai_clients.items():
+            if client_type == "sync":
+                client.close()
+        _openai_clients.clear()
+
+
+def get_http_session() -> "requests.Session":
+    """
+    Get the shared HTTP session, with connection pooling and retries with backoff on
+    connection errors, 429 and 5xx responses
+    :return: requests Session
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retries = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["HEAD", "GET"],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
+
+
+def _write_response(
+    response: "requests.Response", out_path: Path, chunk_size: int = 1 << 20
+) -> Dict[str, Any]:
+    """
+    Stream a response body to a temporary file next to `out_path`, and move it into place once complete,
+    so a failed or interrupted download never leaves a partial file at `out_path`
+    :param response: Streamed response
+    :param out_path: Destination path
+    :param chunk_size: Size of the chunks written to disk, in bytes
+    :return: Dictionary with the "size" and "sha256" of the body
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(
+        dir=out_path.parent, prefix=f".{out_path.name}.", suffix=".part"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+def _get_file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_file(url: str, out_path: Union[str, Path], chunk_size: int = 1 << 20) -> Path:
+    """
+    Stream a download to disk; see `_write_response`
+    :param url: URL to download
+    :param out_path: Destination path
+    :param chunk_size: Size of the chunks written to disk, in bytes
+    :return: Destination path
+    """
+    out_path = Path(out_path)
+    with span("download", url=url) as attributes:
+        with get_http_session().get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+            response.raise_for_status()
+            attributes["bytes"] = _write_response(response, out_path, chunk_size)["size"]
+    logging.info(f"Downloaded {url} to {out_path}")
+    return out_path
+
+
+def get_download_meta_path(out_path: Union[str, Path]) -> Path:
+    """
+    Path of the metadata sidecar of a cached download
+    :param out_path: Path of the downloaded file
+    :return:
+    """
+    out_path = Path(out_path)
+    return out_path.with_name(out_path.name + ".meta.json")
+
+
+def read_download_meta(out_path: Union[str, Path]) -> Union[Dict[str, Any], None]:
+    """
+    Read the metadata sidecar of a cached download
+    :param out_path: Path of the downloaded file
+    :return: Dictionary with "url", "etag", "last_modified", "size" and "sha256", or None if there is none
+    """
+    meta_path = get_download_meta_path(out_path)
+    if not meta_path.exists():
+        return None
+    return json.loads(meta_path.read_text())
+
+
+def download_file_cached(
+    url: str, out_path: Union[str, Path], revalidate: bool = False
+) -> Dict[str, Any]:
+    """
+    Download a file unless it is cached, keeping its ETag/Last-Modified, size and content hash in a
+    `<file>.meta.json` sidecar. With `revalidate`, a cached file is checked with a conditional GET,
+    so an unchanged file costs a 304 and no download.
+    :param url: URL to download
+    :param out_path: Destination path
+    :param revalidate: Check a cached file with the server
+    :return: The sidecar metadata, plus "path" and "changed" (whether the file content was (re)written)
+    """
+    out_path = Path(out_path)
+    meta = read_download_meta(out_path) if out_path.exists() else None
+    if out_path.exists() and meta is None:
+        # Downloaded before sidecars existed
+        meta = {
+            "url": url,
+            "etag": None,
+            "last_modified": None,
+            "size": out_path.stat().st_size,
+            "sha256": _get_file_sha256(out_path),
+        }
+        get_download_meta_path(out_path).write_text(json.dumps(meta))
+
+    if meta is not None and not revalidate:
+        count_cache("download", hits=1)
+        return {**meta, "path": out_path, "changed": False}
+
+    headers = dict()
+    if meta is not None:
+        if meta["etag"]:
+            headers["If-None-Match"] = meta["etag"]
+        if meta["last_modified"]:
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with span("download", url=url) as attributes, get_http_session().get(
+        url, headers=headers, stream=True, timeout=HTTP_TIMEOUT
+    ) as response:
+        attributes["status"] = response.status_code
+        if response.status_code == 304 and meta is not None:
+            logging.info(f"{out_path} is up to date with {url}")
+            count_cache("download", hits=1)
+            return {**meta, "path": out_path, "changed": False}
+        response.raise_for_status()
+        count_cache("download", misses=1)
+        content_meta = _write_response(response, out_path)
+        attributes["bytes"] = content_meta["size"]
+        new_meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            **content_meta,
+        }
+
+    get_download_meta_path(out_path).write_text(json.dumps(new_meta))
+    changed = meta is None or meta["sha256"] != new_meta["sha256"]
+    logging.info(f"Downloaded {url} to {out_path} ({'changed' if changed else 'unchanged'})")
+    return {**new_meta, "path": out_path, "changed": changed}
+
+
+ARXIV_ABS_URL = "https://arxiv.org/abs/"
+ARXIV_EXPORT_API_URL = "https://export.arxiv.org/api/query"
+ARXIV_API_BATCH_SIZE = 100
+ATOM_NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "arxiv": "http://arxiv.org/schemas/atom",
+}
+
+
+def get_arxiv_id(arxiv_url: str) -> str:
+    """
+    Get the arXiv paper ID from an abstract or PDF URL (or an ID)
+    :param arxiv_url: e.g. https://arxiv.org/abs/1706.03762 or https://arxiv.org/pdf/hep-th/9901001v1.pdf
+    :return: Paper ID, including the version if the URL has one
+    """
+    match = re.search(r"arxiv\.org/(?:abs|pdf)/(.+?)(?:\.pdf)?/?$", arxiv_url)
+    if match:
+        return match.group(1)
+    arxiv_id = arxiv_url if "://" not in arxiv_url else arxiv_url.split("/")[-1]
+    if arxiv_id.endswith(".pdf"):
+        arxiv_id = arxiv_id[:-4]
+    return arxiv_id
+
+
+class _CitationMetaParser(HTMLParser):
+    """
+    Collects the `citation_*` meta tags of an HTML page, until the end of its <head>
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tags = dict()
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            self.done = True
+        if self.done or tag != "meta":
+            return
+        attrs = dict(attrs)
+        name = attrs.get("name") or ""
+        if name.startswith("citation_") and attrs.get("content") is not None:
+            self.tags.setdefault(name[len("citation_"):], list()).append(attrs["content"])
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+
+def parse_citation_meta(html: str) -> Dict[str, Any]:
+    """
+    Parse the citation meta tags (as on arXiv abstract pages) from the <head> of an HTML page
+    :param html: The page, or just its start
+    :return: Dictionary with "title", "authors", "date", "abstract", "pdf_url", "doi" and "arxiv_id" where present
+    """
+    parser = _CitationMetaParser()
+    parser.feed(html)
+    tags = parser.tags
+
+    metadata = {
+        key: tags[tag][0]
+        for key, tag in [
+            ("title", "title"),
+            ("date", "date"),
+            ("abstract", "abstract"),
+            ("pdf_url", "pdf_url"),
+            ("doi", "doi"),
+            ("arxiv_id", "arxiv_id"),
+        ]
+        if tag in tags
+    }
+    if "author" in tags:
+        metadata["authors"] = tags["author"]
+    return metadata
+
+
+def get_arxiv_metadata(
+    arxiv_url: str, abs_url: str = ARXIV_ABS_URL, chunk_size: int = 16 * 1024
+) -> Union[Dict[str, Any], None]:
+    """
+    Get the metadata of an arXiv paper from the citation meta tags of its abstract page.
+    The page is streamed, and only read up to the end of its <head>.
+    :param arxiv_url: arXiv URL or paper ID
+    :param abs_url: Base URL of the abstract pages
+    :param chunk_size: Bytes to read at a time
+    :return: Dictionary as returned by `parse_citation_meta`, or None if the page could not be fetched
+    """
+    url = abs_url + get_arxiv_id(arxiv_url)
+    logging.info(f"Getting arXiV metadata from {url}")
+    with get_http_session().get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        if response.status_code != 200:
+            logging.info(
+                f"Failed to get the page. HTTP status code: {response.status_code}"
+            )
+            return None
+
+        head = b""
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            head += chunk
+            if b"</head>" in head or b"<body" in head:
+                break
+
+    return parse_citation_meta(head.decode(response.encoding or "utf-8", errors="replace"))
 
 
 def get_arxiv_title(arxiv_url: str) -> Union[str, None]:
@@ -69,21 +470,79 @@ def get_arxiv_title(arxiv_url: str) -> Union[str, None]:
     :param arxiv_url:
     :return:
     """
-    logging.info(f"Getting arXiV title from {arxiv_url}")
-    response = requests.get(arxiv_url)
-    if response.status_code != 200:
-        logging.info(
-            f"Failed to get the page. HTTP status code: {response.status_code}"
-        )
+    metadata = get_arxiv_metadata(arxiv_url)
+    if metadata is None:
         return None
-
-    soup = BeautifulSoup(response.text, "html.parser")
-    title_element = soup.find("meta", {"name": "citation_title"})
-    if title_element:
-        return title_element["content"]
-    else:
+    if "title" not in metadata:
         logging.info("Failed to find the title element")
-        return None
+    return metadata.get("title")
+
+
+def _parse_arxiv_atom_entry(entry: ElementTree.Element) -> Dict[str, Any]:
+    """
+    Convert an entry of the arXiv export API's Atom feed to the same format as `parse_citation_meta`
+    """
+
+    def text(path: str) -> Union[str, None]:
+        element = entry.find(path, ATOM_NS)
+        if element is None or element.text is None:
+            return None
+        return remove_multiple_whitespaces(element.text).strip()
+
+    metadata = {
+        "arxiv_id": get_arxiv_id(text("atom:id") or ""),
+        "title": text("atom:title"),
+        "authors": [
+            remove_multiple_whitespaces(name.text).strip()
+            for name in entry.findall("atom:author/atom:name", ATOM_NS)
+            if name.text
+        ],
+        "date": (text("atom:published") or "")[:10].replace("-", "/") or None,
+        "abstract": text("atom:summary"),
+        "doi": text("arxiv:doi"),
+    }
+    for link in entry.findall("atom:link", ATOM_NS):
+        if link.get("title") == "pdf":
+            metadata["pdf_url"] = link.get("href")
+    return {key: value for key, value in metadata.items() if value}
+
+
+def get_arxiv_metadata_bulk(
+    arxiv_urls: Iterable[str],
+    api_url: str = ARXIV_EXPORT_API_URL,
+    batch_size: int = ARXIV_API_BATCH_SIZE,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the metadata of many arXiv papers from the export API, `batch_size` papers per request
+    :param arxiv_urls: arXiv URLs or paper IDs
+    :param api_url: URL of the export API query endpoint
+    :param batch_size: Number of papers per request
+    :return: Dictionary from paper ID (as in the URLs) to metadata, as returned by `get_arxiv_metadata`;
+        papers the API did not return are left out
+    """
+    arxiv_ids = list(dict.fromkeys(get_arxiv_id(url) for url in arxiv_urls))
+    results = dict()
+    for i in range(0, len(arxiv_ids), batch_size):
+        batch = arxiv_ids[i : i + batch_size]
+        logging.info(f"Getting arXiV metadata for {len(batch)} papers from {api_url}")
+        response = get_http_session().get(
+            api_url,
+            params={"id_list": ",".join(batch), "max_results": len(batch)},
+            timeout=HTTP_TIMEOUT,
+        )
+        response.raise_for_status()
+
+        for entry in ElementTree.fromstring(response.content).findall("atom:entry", ATOM_NS):
+            metadata = _parse_arxiv_atom_entry(entry)
+            if "title" not in metadata:
+                # The API returns an entry titled "Error" without an ID for unknown papers
+                continue
+            returned_id = metadata["arxiv_id"]
+            for arxiv_id in batch:
+                # The API always returns versioned IDs, so also match unversioned requests
+                if returned_id == arxiv_id or re.sub(r"v\d+$", "", returned_id) == arxiv_id:
+                    results[arxiv_id] = metadata
+    return results
 
 
 def chunk_text_by_num_words(
@@ -168,16 +627,277 @@ def remove_multiple_whitespaces(source_text: str) -> str:
     return source_text
 
 
+def _iter_words(texts: Iterable[str]) -> Iterator[str]:
+    """
+    Split pieces of text into words, joining words that straddle two pieces
+    :param texts: Pieces of a text, in order
+    :return: Words (runs of non-whitespace characters)
+    """
+    carry = ""
+    for text in texts:
+        text = carry + text
+        words = re.findall(r"\S+", text)
+        if words and not text[-1].isspace():
+            carry = words.pop()
+        else:
+            carry = ""
+        yield from words
+    if carry:
+        yield carry
+
+
+def _iter_normalized_text(texts: Iterable[str]) -> Iterator[str]:
+    """
+    Normalise whitespace across pieces of text, as `remove_multiple_whitespaces` followed by `strip` would
+    :param texts: Pieces of a text, in order
+    :return: Pieces of the normalised text
+    """
+    started = False
+    needs_space = False
+    for text in texts:
+        text = remove_multiple_whitespaces(text)
+        core = text.strip(" ")
+        if not core:
+            needs_space = needs_space or (started and text == " ")
+            continue
+        if started and (needs_space or text.startswith(" ")):
+            yield " "
+        yield core
+        started = True
+        needs_space = text.endswith(" ")
+
+
+def iter_chunks_by_num_words(
+    words: Iterable[str],
+    max_chunk_words: int = 100,
+    overlap_fraction: float = 0.25,
+    prevent_short_last_chunks: bool = True,
+) -> Iterator[str]:
+    """
+    Chunk a stream of words, as `chunk_text_by_num_words` would, holding only about two chunks of words in memory
+    :param words: Input words
+    :param max_chunk_words: Maximum length of chunk, in words
+    :param overlap_fraction: Overlap as a percentage of chunk_words. The overlap is prepended to each chunk.
+    :param prevent_short_last_chunks: Prevent very short last chunks
+    :return: Chunks, as they become available
+    """
+    sep = " "
+    overlap_words = int(max_chunk_words * overlap_fraction)
+
+    def _chunk_start(i: int) -> int:
+        return max(max_chunk_words * i - overlap_words, 0)
+
+    def _ready(i: int) -> bool:
+        # Chunk i is final once its window is full and, when preventing short last chunks,
+        # enough words have been seen that it cannot be one of the last two chunks
+        n_needed = max_chunk_words * (i + 1)
+        if prevent_short_last_chunks:
+            n_needed = max(n_needed, max_chunk_words * (i + 2) - overlap_words + 1)
+        return n_words >= n_needed
+
+    buffer = list()  # Words from index buffer_start onwards
+    buffer_start = 0
+    n_words = 0
+    i = 0
+    for word in words:
+        buffer.append(word)
+        n_words += 1
+        while _ready(i):
+            yield sep.join(
+                buffer[_chunk_start(i) - buffer_start : max_chunk_words * (i + 1) - buffer_start]
+            )
+            i += 1
+            del buffer[: _chunk_start(i) - buffer_start]
+            buffer_start = _chunk_start(i)
+
+    if n_words == 0:
+        buffer = [""]
+        n_words = 1
+    n_chunks = ((n_words - 1 + overlap_words) // max_chunk_words) + 1
+    for i in range(i, n_chunks):
+        window_words = buffer[
+            _chunk_start(i) - buffer_start : max_chunk_words * (i + 1) - buffer_start
+        ]
+        if prevent_short_last_chunks and i >= n_chunks - 2:
+            # Second to last chunk onwards
+            remaining_words = buffer[_chunk_start(i) - buffer_start :]
+            if len(remaining_words) <= max_chunk_words:
+                yield sep.join(remaining_words)
+                break
+            yield sep.join(remaining_words[: len(remaining_words) // 2 + overlap_words])
+            yield sep.join(remaining_words[len(remaining_words) // 2 :])
+            break
+        yield sep.join(window_words)
+
+
+def iter_chunks_by_num_chars(
+    texts: Iterable[str], max_chunk_chars: int = 300, overlap_fraction: float = 0.25
+) -> Iterator[str]:
+    """
+    Chunk a stream of text, as `chunk_text_by_num_chars` would, holding only about one chunk in memory
+    :param texts: Pieces of the input text, in order
+    :param max_chunk_chars: Maximum length of chunk, in characters
+    :param overlap_fraction: Overlap as a percentage of chunk_chars
+    :return: Chunks, as they become available
+    """
+    overlap_chars = int(max_chunk_chars * overlap_fraction)
+
+    def _chunk_start(i: int) -> int:
+        return max(max_chunk_chars * i - overlap_chars, 0)
+
+    buffer = ""  # Text from offset buffer_start onwards
+    buffer_start = 0
+    n_chars = 0
+    i = 0
+    for text in texts:
+        buffer += text
+        n_chars += len(text)
+        while n_chars >= max_chunk_chars * (i + 1):
+            yield buffer[
+                _chunk_start(i) - buffer_start : max_chunk_chars * (i + 1) - buffer_start
+            ]
+            i += 1
+        # Trim once per piece, so long pieces are not copied once per chunk
+        buffer = buffer[_chunk_start(i) - buffer_start :]
+        buffer_start = _chunk_start(i)
+
+    n_chunks = ((n_chars - 1 + overlap_chars) // max_chunk_chars) + 1
+    for i in range(i, n_chunks):
+        yield buffer[
+            _chunk_start(i) - buffer_start : max_chunk_chars * (i + 1) - buffer_start
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name: str = "cl100k_base") -> "tiktoken.Encoding":
+    """
+    Load a BPE tokenizer, once per process.
+    tiktoken keeps the downloaded BPE files in TIKTOKEN_CACHE_DIR, so they are only fetched once.
+    :param encoding_name: tiktoken encoding name
+    :return: tiktoken Encoding
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        raise ImportError(
+            "Chunking by tokens requires tiktoken. "
+            "Install it with `pip install 'distyll-info[tokens]'` (or `pip install tiktoken`)."
+        )
+    logging.info(f"Loading {encoding_name} tokenizer.")
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _iter_window_bounds(
+    n_items: int,
+    max_chunk_len: int,
+    overlap_fraction: float,
+    prevent_short_last_chunks: bool = True,
+) -> Iterator[Tuple[int, int]]:
+    """
+    Window (start, end) indices over a sequence, as used by `chunk_text_by_num_words`
+    :param n_items: Length of the sequence
+    :param max_chunk_len: Maximum length of chunk
+    :param overlap_fraction: Overlap as a percentage of max_chunk_len
+    :param prevent_short_last_chunks: Prevent very short last chunks
+    :return: (start, end) index pairs
+    """
+    overlap = int(max_chunk_len * overlap_fraction)
+    n_chunks = ((n_items - 1 + overlap) // max_chunk_len) + 1
+    for i in range(n_chunks):
+        start = max(max_chunk_len * i - overlap, 0)
+        if prevent_short_last_chunks and i >= n_chunks - 2:
+            # Second to last chunk onwards
+            n_remaining = n_items - start
+            if n_remaining <= max_chunk_len:
+                yield start, n_items
+            else:
+                yield start, start + n_remaining // 2 + overlap
+                yield start + n_remaining // 2, n_items
+            return
+        yield start, min(max_chunk_len * (i + 1), n_items)
+
+
+def iter_chunks_by_num_tokens(
+    source_text: str,
+    max_chunk_tokens: int = 100,
+    overlap_fraction: float = 0.25,
+    prevent_short_last_chunks: bool = True,
+    encoding: Union[str, "tiktoken.Encoding"] = "cl100k_base",
+) -> Iterator[str]:
+    """
+    Chunk text by number of BPE tokens.
+    The text is tokenised once, and chunks are cut at token boundaries using the token character offsets.
+    :param source_text: Input string to be chunked
+    :param max_chunk_tokens: Maximum length of chunk, in tokens
+    :param overlap_fraction: Overlap as a percentage of max_chunk_tokens. The overlap is prepended to each chunk.
+    :param prevent_short_last_chunks: Prevent very short last chunks
+    :param encoding: tiktoken encoding, or its name
+    :return: Chunks of text
+    """
+    if isinstance(encoding, str):
+        encoding = get_tokenizer(encoding)
+    source_text = source_text.strip()
+    tokens = encoding.encode(source_text, disallowed_special=())
+    _, offsets = encoding.decode_with_offsets(tokens)
+    offsets.append(len(source_text))
+    for start, end in _iter_window_bounds(
+        len(tokens), max_chunk_tokens, overlap_fraction, prevent_short_last_chunks
+    ):
+        yield source_text[offsets[start] : offsets[end]].strip()
+
+
+def iter_chunk_text(
+    source_text: Union[str, Iterable[str]],
+    method: Literal["words", "chars", "tokens"] = "words",
+    token_length: Union[None, int] = 100,
+    overlap_fraction: float = 0.25,
+    prevent_short_last_chunks: bool = True,
+) -> Iterator[str]:
+    """
+    Chunk longer text incrementally, e.g. page by page, without materialising the whole text
+    :param source_text: Input text, or an iterable of consecutive pieces of it (e.g. pages)
+    :param method: "words", "chars" or "tokens" ("tokens" needs the whole text, so it is joined up front)
+    :param token_length: Number of tokens to chunk by
+    :param overlap_fraction: Overlap as a percentage of chunk
+    :param prevent_short_last_chunks: Prevent very short last chunks ("words" and "tokens" only)
+    :return: Chunks, as they become available
+    """
+    if isinstance(source_text, str):
+        source_text = [source_text]
+    if method == "words":
+        return iter_chunks_by_num_words(
+            _iter_words(source_text),
+            max_chunk_words=token_length,
+            overlap_fraction=overlap_fraction,
+            prevent_short_last_chunks=prevent_short_last_chunks,
+        )
+    elif method == "chars":
+        return iter_chunks_by_num_chars(
+            _iter_normalized_text(source_text),
+            max_chunk_chars=token_length,
+            overlap_fraction=overlap_fraction,
+        )
+    elif method == "tokens":
+        return iter_chunks_by_num_tokens(
+            "".join(_iter_normalized_text(source_text)),
+            max_chunk_tokens=token_length,
+            overlap_fraction=overlap_fraction,
+            prevent_short_last_chunks=prevent_short_last_chunks,
+        )
+    else:
+        raise ValueError(f"Unsupported method: {method}")
+
+
 def chunk_text(
     source_text: str,
-    method: Literal["words", "chars"] = "words",
+    method: Literal["words", "chars", "tokens"] = "words",
     token_length: Union[None, int] = 100,
     overlap_fraction: float = 0.25,
 ) -> List[str]:
     """
     Chunk longer text
     :param source_text: Input text
-    :param method: "words" or "chars"
+    :param method: "words", "chars" or "tokens" (BPE tokens, as counted by OpenAI models)
     :param token_length: Number of tokens to chunk by
     :param overlap_fraction: Overlap as a percentage of chunk
     :return:
@@ -185,42 +905,64 @@ def chunk_text(
     logging.info(
         f"Chunking text of {len(source_text)} characters with {method} method."
     )
-    source_text = remove_multiple_whitespaces(source_text)
-    if method == "words":
-        return chunk_text_by_num_words(
-            source_text, max_chunk_words=token_length, overlap_fraction=overlap_fraction
-        )
-    elif method == "chars":
-        return chunk_text_by_num_chars(
-            source_text, max_chunk_chars=token_length, overlap_fraction=overlap_fraction
+    with span("chunk", method=method, chars=len(source_text)) as attributes:
+        chunks = list(
+            iter_chunk_text(
+                source_text,
+                method=method,
+                token_length=token_length,
+                overlap_fraction=overlap_fraction,
+            )
         )
-    else:
-        raise ValueError(f"Unsupported method: {method}")
+        attributes["chunks"] = len(chunks)
+    return chunks
+
+
+YOUTUBE_WATCH_URL = "https://www.youtube.com/watch?v="
 
 
 def extract_metadata(video_info: Dict[str, Any]) -> Dict[str, Any]:
     metadata = dict()
-    for k in ["title", "upload_date", "channel", "uploader"]:
+    for k in ["id", "title", "upload_date", "channel", "uploader", "duration"]:
         if k in video_info:
             metadata[k] = video_info[k]
     return metadata
 
 
-def download_youtube(youtube_url: str, path_out: Path) -> Dict[str, Any]:
+def get_youtube_meta_path(audio_path: Union[str, Path]) -> Path:
     """
-    Download a YouTube video's audio and return its title
+    :param audio_path: Path of a downloaded YouTube audio file, e.g. `<video id>.mp3`
+    :return: Path of the video metadata kept next to it, e.g. `<video id>.meta.json`
+    """
+    return Path(audio_path).with_suffix(".meta.json")
+
+
+def _write_youtube_meta(audio_path: Path, metadata: Dict[str, Any]) -> None:
+    meta_path = get_youtube_meta_path(audio_path)
+    tmp_path = meta_path.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(metadata))
+    os.replace(tmp_path, meta_path)
+
+
+def download_youtube(
+    youtube_url: str, path_out: Path, audio_quality: int = YOUTUBE_AUDIO_QUALITY
+) -> Dict[str, Any]:
+    """
+    Download a YouTube video's audio (as mono MP3) and return its metadata.
+    The video is resolved once, and its metadata saved next to the audio (see `get_youtube_meta_path`).
     :param youtube_url: URL of the YouTube video
     :param path_out: Path where the audio file will be saved
-    :return: Video title
+    :param audio_quality: MP3 bitrate, in kb/s. Segments are re-encoded for Whisper
+        (see `AUDIO_PROFILES`), so speech needs no more than the default.
+    :return: Video metadata: "id", "title", "upload_date", "channel", "uploader" and "duration"
     """
+    path_out = Path(path_out)
     path_template = str(path_out.absolute())
     if path_template.endswith(".mp3"):
         path_template = path_template[:-4]
 
     yt_dlp_params = {
-        "extract_audio": True,
         "format": "bestaudio/best",
-        "audioformat": "mp3",
         "outtmpl": path_template,
         "quiet": True,
         "cachedir": False,
@@ -228,42 +970,161 @@ def download_youtube(youtube_url: str, path_out: Path) -> Dict[str, Any]:
             {
                 "key": "FFmpegExtractAudio",
                 "preferredcodec": "mp3",
-                "preferredquality": "192",
+                "preferredquality": str(audio_quality),
             }
         ],
+        "postprocessor_args": {"extractaudio": ["-ac", "1"]},
     }
 
-    with yt_dlp.YoutubeDL(yt_dlp_params) as video:
-        result = video.extract_info(youtube_url, download=True)
-        metadata = extract_metadata(result)
-        video_title = result["title"]
-        logging.info(f"Found {video_title} - downloading")
-        video.download(youtube_url)
-        logging.info(f"Successfully downloaded to {path_out}")
-
+    import yt_dlp
+
+    logging.info(f"Downloading the audio of {youtube_url}")
+    with span("download", url=youtube_url) as attributes:
+        with yt_dlp.YoutubeDL(yt_dlp_params) as video:
+            # Resolves the video and downloads it in one go
+            result = video.extract_info(youtube_url, download=True)
+        if path_out.exists():
+            attributes["bytes"] = path_out.stat().st_size
+        if result.get("duration"):
+            attributes["audio_seconds"] = result["duration"]
+    metadata = extract_metadata(result)
+    _write_youtube_meta(path_out, metadata)
+    logging.info(f"Successfully downloaded {metadata.get('title')} to {path_out}")
     return metadata
 
 
-def get_youtube_metadata(youtube_url: str) -> Dict[str, str]:
+def download_youtube_cached(
+    youtube_url: str, path_out: Path, audio_quality: int = YOUTUBE_AUDIO_QUALITY
+) -> Dict[str, Any]:
     """
-    Download a YouTube video and return its metadata
+    Like `download_youtube`, but without network requests if the audio and its metadata
+    were downloaded before
+    :param youtube_url: URL of the YouTube video
+    :param path_out: Path where the audio file will be saved
+    :param audio_quality: MP3 bitrate, in kb/s
+    :return: Video metadata
+    """
+    path_out = Path(path_out)
+    meta_path = get_youtube_meta_path(path_out)
+    if path_out.exists():
+        if meta_path.exists():
+            logging.info(f"Already downloaded {path_out}")
+            count_cache("youtube", hits=1)
+            return json.loads(meta_path.read_text())
+        # Audio downloaded before metadata was kept next to it
+        metadata = get_youtube_metadata(youtube_url)
+        _write_youtube_meta(path_out, metadata)
+        return metadata
+    count_cache("youtube", misses=1)
+    return download_youtube(youtube_url, path_out, audio_quality=audio_quality)
+
+
+def get_youtube_metadata(youtube_url: str) -> Dict[str, Any]:
+    """
+    Get the metadata of a YouTube video, without downloading it
     :param youtube_url:
-    :param path_out:
-    :param audio_only:
-    :return: Video title
+    :return: Video metadata (see `download_youtube`)
     """
     ydl_opts = {
         "quiet": True,
-        "extract_flat": True,
-        "force_generic_extractor": True,
+        "cachedir": False,
     }
 
+    import yt_dlp
+
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        result = ydl.extract_info(youtube_url, download=False)
+        result = ydl.extract_info(youtube_url, download=False, process=False)
         metadata = extract_metadata(result)
     return metadata
 
 
+def is_youtube_playlist(url: str) -> bool:
+    """
+    :param url:
+    :return: Whether a YouTube URL is a playlist or a channel, rather than a video
+    """
+    return re.search(r"youtube\.com/(?:playlist\?|channel/|c/|user/|@)", url) is not None
+
+
+def _iter_playlist_video_ids(ydl, info: Dict[str, Any], depth: int = 0) -> Iterator[str]:
+    for entry in info.get("entries") or []:
+        if entry is None:
+            continue
+        if entry.get("ie_key") == "Youtube" or entry.get("_type") == "video":
+            yield entry["id"]
+        elif depth < 2:
+            # Tabs of a channel (videos, shorts, live), or nested playlists
+            if "entries" not in entry:
+                entry = ydl.extract_info(entry["url"], download=False)
+            yield from _iter_playlist_video_ids(ydl, entry, depth + 1)
+
+
+def get_youtube_playlist_urls(playlist_url: str) -> List[str]:
+    """
+    List the videos of a YouTube playlist or channel, without resolving each video
+    :param playlist_url:
+    :return: Video URLs, in playlist order, without duplicates
+    """
+    ydl_opts = {
+        "quiet": True,
+        "cachedir": False,
+        "extract_flat": "in_playlist",
+    }
+
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+        video_ids = list(dict.fromkeys(_iter_playlist_video_ids(ydl, info)))
+    logging.info(f"Found {len(video_ids)} videos in {playlist_url}")
+    return [YOUTUBE_WATCH_URL + video_id for video_id in video_ids]
+
+
+def download_youtube_many(
+    youtube_urls: Iterable[str],
+    dl_dir: Union[str, Path] = DL_DIR,
+    max_workers: int = 4,
+    audio_quality: int = YOUTUBE_AUDIO_QUALITY,
+) -> List[Dict[str, Any]]:
+    """
+    Download the audio of many YouTube videos in parallel, with at most `max_workers` downloads in flight.
+    Playlist and channel URLs are expanded into their videos, and videos downloaded before are skipped.
+    :param youtube_urls: Video, playlist or channel URLs
+    :param dl_dir: Directory to download to, as `<video id>.mp3` and `<video id>.meta.json`
+    :param max_workers: Maximum number of concurrent downloads
+    :param audio_quality: MP3 bitrate, in kb/s
+    :return: One dictionary per video, in order, with "url", "path", "metadata" and "error"
+        (None, or the error message if the download failed)
+    """
+    dl_dir = init_dl_dir(dl_dir)
+    max_workers = max(1, max_workers)
+    video_urls = dict()
+    for url in youtube_urls:
+        for video_url in get_youtube_playlist_urls(url) if is_youtube_playlist(url) else [url]:
+            # One download per video, however it was listed
+            video_urls.setdefault(get_yt_video_id(video_url), video_url)
+
+    def _download(url: str) -> Dict[str, Any]:
+        path_out = dl_dir / f"{get_yt_video_id(url)}.mp3"
+        try:
+            metadata = download_youtube_cached(url, path_out, audio_quality=audio_quality)
+        except Exception as e:
+            logging.info(f"Failed to download {url}: {e}")
+            return {"url": url, "path": None, "metadata": None, "error": str(e)}
+        return {"url": url, "path": path_out, "metadata": metadata, "error": None}
+
+    results = list()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for url in video_urls.values():
+            if len(pending) >= max_workers:
+                results.append(pending.popleft().result())
+            pending.append(executor.submit(in_current_context(_download), url))
+        while pending:
+            results.append(pending.popleft().result())
+    return results
+
+
 def download_youtube_video(youtube_url: str, path_out: Path) -> str:
     """
     Download a YouTube video's video
@@ -285,6 +1146,8 @@ def download_youtube_video(youtube_url: str, path_out: Path) -> str:
         "cachedir": False,
     }
 
+    import yt_dlp
+
     with yt_dlp.YoutubeDL(yt_dlp_params) as video:
         result = video.extract_info(youtube_url, download=True)
         video_title = result.get(
@@ -305,79 +1168,800 @@ def get_audio_from_video(video_path: Union[str, Path]) -> Path:
         video_pathobj = Path(video_path)
 
     audio_path = video_pathobj.with_suffix(".mp3")
+    # Reuse audio extracted by a previous run, unless the video has changed since
+    if (
+        audio_path.exists()
+        and audio_path.stat().st_mtime >= video_pathobj.stat().st_mtime
+    ):
+        logging.info(f"Already extracted audio to {audio_path}")
+        return audio_path
+
     video = VideoFileClip(str(video_pathobj))
 
+    # Write to a temporary file first, so an interrupted run leaves no partial audio behind
+    tmp_audio_path = video_pathobj.with_suffix(".part.mp3")
     audio = video.audio
-    audio.write_audiofile(audio_path)
+    audio.write_audiofile(str(tmp_audio_path))
 
     # Close the video file
     video.close()
+    os.replace(tmp_audio_path, audio_path)
 
     return audio_path
 
 
+def _is_retryable_error(error: Exception) -> bool:
+    """
+    Check whether a failed API call is worth retrying (rate limits and server errors)
+    :param error: Exception raised by the API client
+    :return: True if the call should be retried
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is None:
+        return False
+    return status_code == 429 or status_code >= 500
+
+
+def transcribe_audio_segment(
+    oai_client: "OpenAI",
+    audio: Union[Path, BinaryIO],
+    model: str = "whisper-1",
+    max_retries: int = 3,
+    backoff_factor: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Transcribe a single audio segment, retrying with exponential backoff on 429/5xx errors
+    :param oai_client: OpenAI client (or any object exposing `audio.transcriptions.create`)
+    :param audio: Path to the audio segment, or an in-memory buffer with a `name` attribute
+    :param model: Transcription model
+    :param max_retries: Maximum number of retries after the first attempt
+    :param backoff_factor: Base delay in seconds; doubled after each failed attempt
+    :return: Dictionary with the transcript text, number of attempts and elapsed seconds
+    """
+    start_time = time.perf_counter()
+    # Retries are done here, with backoff: turn off the SDK's own, so they don't multiply
+    if hasattr(oai_client, "with_options"):
+        oai_client = oai_client.with_options(max_retries=0)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if isinstance(audio, Path):
+                with audio.open("rb") as audio_file:
+                    transcript = oai_client.audio.transcriptions.create(
+                        model=model, file=audio_file
+                    )
+            else:
+                audio.seek(0)
+                transcript = oai_client.audio.transcriptions.create(
+                    model=model, file=audio
+                )
+            break
+        except Exception as e:
+            if attempt > max_retries or not _is_retryable_error(e):
+                raise
+            delay = backoff_factor * (2 ** (attempt - 1))
+            logging.info(f"Transcription failed ({e}), retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+    return {
+        "text": transcript.text,
+        "attempts": attempt,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+def get_segment_cache_key(
+    audio_bytes: bytes, model: str, params: Union[Dict[str, Any], None] = None
+) -> str:
+    """
+    Content-addressed cache key for a segment transcript
+    :param audio_bytes: Encoded audio of the segment
+    :param model: Transcription model
+    :param params: Other parameters the transcript depends on (e.g. segment length)
+    :return: Hex digest
+    """
+    digest = hashlib.sha256(audio_bytes)
+    digest.update(json.dumps({"model": model, **(params or {})}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _read_audio_bytes(audio: Union[Path, BinaryIO]) -> bytes:
+    if isinstance(audio, Path):
+        return audio.read_bytes()
+    audio.seek(0)
+    return audio.read()
+
+
+def _get_audio_size(audio: Union[Path, BinaryIO]) -> int:
+    if isinstance(audio, Path):
+        return audio.stat().st_size
+    return audio.seek(0, io.SEEK_END)
+
+
+def transcribe_audio_segments(
+    oai_client: "OpenAI",
+    segments: Iterable[Union[Path, Dict[str, Any]]],
+    max_concurrency: int = 4,
+    model: str = "whisper-1",
+    max_retries: int = 3,
+    backoff_factor: float = 1.0,
+    cache_dir: Union[str, Path, None] = None,
+    cache_params: Union[Dict[str, Any], None] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Transcribe audio segments concurrently, with at most `max_concurrency` requests in flight.
+    Segments are consumed lazily, so at most `max_concurrency` of them are held in memory at once.
+    :param oai_client: OpenAI client (or any object exposing `audio.transcriptions.create`)
+    :param segments: Paths to audio segments, or segment dictionaries from `iter_audio_segments`
+    :param max_concurrency: Maximum number of transcription requests in flight
+    :param model: Transcription model
+    :param max_retries: Maximum number of retries per segment
+    :param backoff_factor: Base delay in seconds between retries
+    :param cache_dir: (Optional) Directory for per-segment transcripts, keyed by a hash of the
+        segment audio, the model and `cache_params`. Cached segments are not sent to the API.
+    :param cache_params: (Optional) Parameters that the segment audio depends on, e.g. segment length
+    :return: One dictionary per segment, in segment order, with "segment", "text", "attempts",
+        "seconds" and "cached" (plus "start" and "end" for segment dictionaries)
+    """
+    max_concurrency = max(1, max_concurrency)
+    if cache_dir is not None:
+        cache_dir = init_dl_dir(cache_dir)
+
+    def _transcribe(i: int, segment: Union[Path, Dict[str, Any]]) -> Dict[str, Any]:
+        if isinstance(segment, dict):
+            audio = segment["audio"]
+            segment_info = {k: v for k, v in segment.items() if k != "audio"}
+        else:
+            audio = segment
+            segment_info = {"segment": i}
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_key = get_segment_cache_key(
+                _read_audio_bytes(audio), model, cache_params
+            )
+            cache_path = cache_dir / f"{cache_key}.json"
+            if cache_path.exists():
+                logging.info(f"Found cached transcript {i+1} in {cache_path}")
+                count_cache("transcript", hits=1)
+                cached = json.loads(cache_path.read_text())
+                return {
+                    **segment_info,
+                    "text": cached["text"],
+                    "attempts": 0,
+                    "seconds": 0.0,
+                    "cached": True,
+                }
+
+            count_cache("transcript", misses=1)
+
+        logging.info(f"Processing transcript {i+1}...")
+        with span("whisper", model=model, bytes=_get_audio_size(audio)) as attributes:
+            if "start" in segment_info and "end" in segment_info:
+                attributes["audio_seconds"] = segment_info["end"] - segment_info["start"]
+            result = transcribe_audio_segment(
+                oai_client,
+                audio,
+                model=model,
+                max_retries=max_retries,
+                backoff_factor=backoff_factor,
+            )
+            attributes["attempts"] = result["attempts"]
+        logging.info(
+            f"Transcript {i+1} took {result['seconds']:.2f}s "
+            f"({result['attempts']} attempt(s))."
+        )
+        if cache_path is not None:
+            tmp_path = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps({"text": result["text"], "model": model}))
+            os.replace(tmp_path, cache_path)
+        return {**segment_info, **result, "cached": False}
+
+    results = list()
+    pending = deque()
+    with (
+        span("transcribe", model=model) as attributes,
+        ThreadPoolExecutor(max_workers=max_concurrency) as executor,
+    ):
+        for i, segment in enumerate(segments):
+            if len(pending) >= max_concurrency:
+                results.append(pending.popleft().result())
+            pending.append(executor.submit(in_current_context(_transcribe), i, segment))
+        while pending:
+            results.append(pending.popleft().result())
+        attributes["segments"] = len(results)
+    return results
+
+
+def get_transcript_segments_from_audio_file(
+    audio_file_path: Path,
+    max_segment_len: Union[int, None] = None,
+    openai_apikey: Union[str, None] = None,
+    max_concurrency: int = 4,
+    cache_dir: Union[str, Path, None] = TRANSCRIPT_CACHE_DIR,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+) -> List[Dict[str, Any]]:
+    """
+    Get transcripts of an audio file, segment by segment, with the segment boundaries
+    :param audio_file_path:
+    :param max_segment_len: Maximum segment length, in seconds (default: from the size budget)
+    :param openai_apikey:
+    :param max_concurrency: Maximum number of segments transcribed at once
+    :param cache_dir: Directory for cached segment transcripts; None to disable caching
+    :param profile: Audio profile the segments are encoded with (see `get_audio_profile`)
+    :return: One dictionary per segment with "segment", "start", "end" (seconds) and "text"
+    """
+    oai_client = get_openai_client(openai_apikey)
+    logging.info(f"Getting transcripts from {audio_file_path}...")
+    return transcribe_audio_segments(
+        oai_client,
+        iter_audio_segments(Path(audio_file_path), max_segment_len, profile=profile),
+        max_concurrency=max_concurrency,
+        cache_dir=cache_dir,
+        cache_params={
+            "max_segment_len": max_segment_len,
+            "profile": get_audio_profile(profile),
+        },
+    )
+
+
 def get_transcripts_from_audio_file(
     audio_file_path: Path,
-    max_segment_len: int = 900,
+    max_segment_len: Union[int, None] = None,
     openai_apikey: Union[str, None] = None,
+    max_concurrency: int = 4,
+    cache_dir: Union[str, Path, None] = TRANSCRIPT_CACHE_DIR,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
 ) -> List[str]:
     """
     Get transcripts of audio files using
     :param audio_file_path:
-    :param max_segment_len:
+    :param max_segment_len: Maximum segment length, in seconds (default: from the size budget)
     :param openai_apikey:
+    :param max_concurrency: Maximum number of segments transcribed at once
+    :param cache_dir: Directory for cached segment transcripts; None to disable caching
+    :param profile: Audio profile the segments are encoded with (see `get_audio_profile`)
     :return:
     """
-    oai_client = get_openai_client(openai_apikey)
-    clip_outpaths = split_audio_files(audio_file_path, max_segment_len)
-    transcript_texts = list()
-    logging.info(f"Getting transcripts from {len(clip_outpaths)} audio files...")
-    for i, clip_outpath in enumerate(clip_outpaths):
-        logging.info(f"Processing transcript {i+1} of {len(clip_outpaths)}...")
-        with clip_outpath.open("rb") as audio_file:
-            transcript = oai_client.audio.transcriptions.create(
-                model="whisper-1", file=audio_file
+    segments = get_transcript_segments_from_audio_file(
+        audio_file_path,
+        max_segment_len=max_segment_len,
+        openai_apikey=openai_apikey,
+        max_concurrency=max_concurrency,
+        cache_dir=cache_dir,
+        profile=profile,
+    )
+    return [s["text"] for s in segments]
+
+
+def _get_ffmpeg_path() -> str:
+    """
+    Get the ffmpeg executable: the one on the PATH, or else the one bundled with moviepy (imageio-ffmpeg)
+    :return: Path of the ffmpeg executable (or its name, to fail with a clear error later)
+    """
+    ffmpeg_path = shutil.which("ffmpeg")
+    if ffmpeg_path is None:
+        try:
+            import imageio_ffmpeg
+
+            ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError):
+            pass
+    return ffmpeg_path or "ffmpeg"
+
+
+def get_audio_duration(audio_file_path: Union[str, Path]) -> float:
+    """
+    Get the duration of an audio (or video) file from its container header, without decoding it
+    :param audio_file_path:
+    :return: Duration in seconds
+    """
+    result = subprocess.run(
+        [_get_ffmpeg_path(), "-hide_banner", "-i", str(audio_file_path)],
+        capture_output=True,
+        text=True,
+    )
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        raise ValueError(f"Could not read the duration of {audio_file_path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+# Encodings for audio sent to Whisper. Speech needs neither stereo nor a high sample rate,
+# so these are several times smaller than music-quality MP3 (bitrates in kb/s)
+AUDIO_PROFILES = {
+    "opus": {
+        "codec": "libopus",
+        "format": "ogg",
+        "extension": "ogg",
+        "bitrate": 24,
+        "channels": 1,
+        "sample_rate": 16000,
+        # Unconstrained VBR can overshoot the bitrate by half, and segments their size budget
+        "options": ["-vbr", "constrained"],
+    },
+    "mp3": {
+        "codec": "libmp3lame",
+        "format": "mp3",
+        "extension": "mp3",
+        "bitrate": 32,
+        "channels": 1,
+        "sample_rate": 16000,
+    },
+}
+
+
+def get_audio_profile(profile: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    :param profile: Name of a profile in `AUDIO_PROFILES`, or a profile dictionary
+        with "codec", "format", "extension", "bitrate" (kb/s), "channels", "sample_rate"
+        and (optional) other ffmpeg "options"
+    :return: Profile dictionary
+    """
+    if isinstance(profile, dict):
+        return profile
+    if profile not in AUDIO_PROFILES:
+        raise ValueError(
+            f"Unknown audio profile: {profile} (choose from {', '.join(AUDIO_PROFILES)})"
+        )
+    return AUDIO_PROFILES[profile]
+
+
+def get_encoding_args(profile: Union[str, Dict[str, Any]]) -> List[str]:
+    """
+    :param profile: Audio profile (see `get_audio_profile`)
+    :return: ffmpeg output arguments encoding audio with the profile
+    """
+    profile = get_audio_profile(profile)
+    return [
+        # Same input, same bytes: e.g. Ogg streams get a random serial number otherwise,
+        # and segment transcripts (cached by content) would never be reused
+        "-fflags",
+        "+bitexact",
+        "-flags:a",
+        "+bitexact",
+        "-c:a",
+        profile["codec"],
+        "-b:a",
+        f"{profile['bitrate']}k",
+        "-ac",
+        str(profile["channels"]),
+        "-ar",
+        str(profile["sample_rate"]),
+        *profile.get("options", []),
+    ]
+
+
+def get_max_segment_len(
+    bitrate: float, max_segment_bytes: int = AUDIO_SEGMENT_BYTES, margin: float = 0.1
+) -> int:
+    """
+    Longest segment that fits a size budget at a given bitrate
+    :param bitrate: Audio bitrate, in kb/s
+    :param max_segment_bytes: Size budget of a segment, in bytes
+    :param margin: Share of the budget kept for container overhead and bitrate variations
+    :return: Maximum segment length, in seconds
+    """
+    return int(max_segment_bytes * (1 - margin) * 8 / (bitrate * 1000))
+
+
+def encode_audio_segment(
+    audio_file_path: Union[str, Path],
+    start: float,
+    duration: float,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+) -> bytes:
+    """
+    Encode one window of an audio file in memory.
+    ffmpeg seeks in the input, so only this window is decoded.
+    :param audio_file_path:
+    :param start: Start of the window, in seconds
+    :param duration: Length of the window, in seconds
+    :param profile: Audio profile (see `get_audio_profile`)
+    :return: Encoded bytes
+    """
+    result = subprocess.run(
+        [
+            _get_ffmpeg_path(),
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-ss",
+            f"{start:.3f}",
+            "-t",
+            f"{duration:.3f}",
+            "-i",
+            str(audio_file_path),
+            "-vn",
+            *get_encoding_args(profile),
+            "-f",
+            get_audio_profile(profile)["format"],
+            "pipe:1",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def decode_audio_window(
+    audio_file_path: Union[str, Path],
+    start: float,
+    duration: float,
+    sample_rate: int = 8000,
+) -> "np.ndarray":
+    """
+    Decode one window of an audio file to mono PCM samples
+    :param audio_file_path:
+    :param start: Start of the window, in seconds
+    :param duration: Length of the window, in seconds
+    :param sample_rate: Sample rate to resample to; low rates are plenty for finding silences
+    :return: 1-D int16 array of samples
+    """
+    import numpy as np
+
+    result = subprocess.run(
+        [
+            _get_ffmpeg_path(),
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-ss",
+            f"{start:.3f}",
+            "-t",
+            f"{duration:.3f}",
+            "-i",
+            str(audio_file_path),
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            str(sample_rate),
+            "-f",
+            "s16le",
+            "pipe:1",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def find_quiet_point(
+    samples: "np.ndarray",
+    sample_rate: int,
+    frame_len: float = 0.1,
+    tolerance: float = 0.1,
+) -> float:
+    """
+    Find the quietest point in a window of samples.
+    Frame energies are computed in one vectorised pass; among frames within `tolerance`
+    of the minimum energy, the one closest to the end of the window is chosen.
+    :param samples: 1-D array of PCM samples
+    :param sample_rate: Sample rate of `samples`
+    :param frame_len: Frame length, in seconds
+    :param tolerance: Relative energy tolerance for frames to count as equally quiet
+    :return: Offset of the centre of the chosen frame from the start of the window, in seconds
+    """
+    import numpy as np
+
+    frame_size = max(1, int(sample_rate * frame_len))
+    n_frames = len(samples) // frame_size
+    if n_frames == 0:
+        return len(samples) / sample_rate
+
+    frames = samples[: n_frames * frame_size].astype(np.float32)
+    frames = frames.reshape(n_frames, frame_size)
+    energy = np.sqrt(np.mean(frames**2, axis=1))
+    quiet_frames = np.flatnonzero(energy <= energy.min() * (1 + tolerance) + 1e-6)
+    return (quiet_frames[-1] + 0.5) * frame_size / sample_rate
+
+
+def plan_segment_boundaries(
+    audio_file_path: Union[str, Path],
+    max_segment_len: int = 900,
+    search_window: float = 30,
+    sample_rate: int = 8000,
+) -> List[Tuple[float, float]]:
+    """
+    Plan segment boundaries at quiet points, so that segments can be cut without overlap.
+    Each cut is placed at the quietest point in the `search_window` seconds before the
+    target cut, so no segment is longer than `max_segment_len`. Only those windows are decoded.
+    :param audio_file_path:
+    :param max_segment_len: Maximum segment length, in seconds
+    :param search_window: How far before each target cut to look for a quiet point, in seconds
+    :param sample_rate: Sample rate used for the energy analysis
+    :return: List of (start, end) times in seconds
+    """
+    with span("plan_segments", path=str(audio_file_path)) as attributes:
+        duration = get_audio_duration(audio_file_path)
+        search_window = min(search_window, max_segment_len / 2)
+        cuts = [0.0]
+        while duration - cuts[-1] > max_segment_len:
+            target = cuts[-1] + max_segment_len
+            window_start = target - search_window
+            samples = decode_audio_window(
+                audio_file_path, window_start, search_window, sample_rate=sample_rate
             )
-            transcript_texts.append(transcript.text)
+            cuts.append(window_start + find_quiet_point(samples, sample_rate))
+        cuts.append(duration)
+        attributes["audio_seconds"] = duration
+        attributes["segments"] = len(cuts) - 1
+    return list(zip(cuts[:-1], cuts[1:]))
 
-    # Clean up
-    for clip_outpath in clip_outpaths:
-        os.remove(clip_outpath)
 
-    return transcript_texts
+def iter_audio_segments(
+    audio_file_path: Path,
+    max_segment_len: Union[int, None] = None,
+    overlap: float = 0,
+    split_on_silence: bool = True,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+    max_segment_bytes: int = AUDIO_SEGMENT_BYTES,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Split long audio files into in-memory segments
+    (e.g. so that they fit within the allowed size for Whisper).
+    Segments are encoded one at a time, so peak memory does not grow with the audio length.
+    :param audio_file_path:
+    :param max_segment_len: Maximum segment length, in seconds
+        (default: the longest that fits `max_segment_bytes` at the profile's bitrate)
+    :param overlap: Seconds of audio prepended to each segment from the previous one
+    :param split_on_silence: Cut at quiet points (see `plan_segment_boundaries`) rather than fixed offsets
+    :param profile: Audio profile the segments are encoded with (see `get_audio_profile`)
+    :param max_segment_bytes: Size budget of a segment, in bytes
+    :return: Dictionaries with "segment" (index), "start", "end" (seconds) and "audio" (named BytesIO)
+    """
+    profile = get_audio_profile(profile)
+    if max_segment_len is None:
+        max_segment_len = get_max_segment_len(profile["bitrate"], max_segment_bytes) - overlap
+    if split_on_silence:
+        boundaries = plan_segment_boundaries(audio_file_path, max_segment_len)
+    else:
+        duration = get_audio_duration(audio_file_path)
+        n_segments = max(1, math.ceil(duration / max_segment_len))
+        boundaries = [
+            (i * max_segment_len, min((i + 1) * max_segment_len, duration))
+            for i in range(n_segments)
+        ]
+    logging.info(
+        f"Splitting {audio_file_path} to {len(boundaries)} chunks of up to {max_segment_len} seconds."
+    )
+    for i, (start, end) in enumerate(boundaries):
+        start = max(0, start - overlap)
+        with span("split_audio", audio_seconds=end - start) as attributes:
+            audio = io.BytesIO(
+                encode_audio_segment(audio_file_path, start, end - start, profile=profile)
+            )
+            attributes["bytes"] = len(audio.getbuffer())
+        audio.name = f"{audio_file_path.stem}.{i}.{profile['extension']}"
+        yield {"segment": i, "start": start, "end": end, "audio": audio}
 
 
-def split_audio_files(audio_file_path: Path, max_segment_len: int = 900) -> List[Path]:
+def split_audio_files(
+    audio_file_path: Path,
+    max_segment_len: Union[int, None] = None,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+) -> List[Path]:
     """
-    Split long audio files
-    (e.g. so that they fit within the allowed size for Whisper)
+    Split long audio files to segment files on disk
+    (e.g. so that they fit within the allowed size for Whisper).
+    Prefer `iter_audio_segments`, which keeps segments in memory.
     :param audio_file_path:
     :param max_segment_len:
+    :param profile: Audio profile the segments are encoded with
     :return: A list of file paths
     """
-    from pydub import AudioSegment
-
-    audio = AudioSegment.from_file(str(audio_file_path))
-    logging.info(f"Splitting {audio_file_path} to chunks of {max_segment_len} seconds.")
-    # Split long audio into segments
     clip_outpaths = list()
-    if audio.duration_seconds > max_segment_len:
-        n_segments = 1 + int(audio.duration_seconds) // max_segment_len
-    else:
-        n_segments = 1
-    logging.info(f"Splitting audio to {n_segments}")
-    for i in range(n_segments):
-        start = max(0, (i * max_segment_len) - 5) * 1000
-        end = ((i + 1) * max_segment_len) * 1000
-        clip = audio[start:end]
-
-        clip_outpath = audio_file_path.with_suffix(f".{i}.mp3")
-        outfile = clip.export(str(clip_outpath))
-        outfile.close()
+    for segment in iter_audio_segments(audio_file_path, max_segment_len, profile=profile):
+        clip_outpath = audio_file_path.with_name(segment["audio"].name)
+        clip_outpath.write_bytes(segment["audio"].getvalue())
         clip_outpaths.append(clip_outpath)
     return clip_outpaths
 
 
+# Audio codecs Whisper accepts as they are, and the extension of segment files to copy them into
+STREAM_COPY_EXTENSIONS = {"mp3": "mp3", "aac": "m4a"}
+
+
+def get_audio_stream_info(media_path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Get the codec and bitrate of the first audio stream of a media file, from its header
+    :param media_path:
+    :return: Dictionary with "codec" (e.g. "aac"), and "bitrate" in kb/s (None if not reported)
+    """
+    result = subprocess.run(
+        [_get_ffmpeg_path(), "-hide_banner", "-i", str(media_path)],
+        capture_output=True,
+        text=True,
+    )
+    for line in result.stderr.splitlines():
+        match = re.search(r"Stream #.*?Audio: (\w+)", line)
+        if match:
+            bitrate = re.search(r"(\d+) kb/s", line)
+            return {
+                "codec": match.group(1),
+                "bitrate": int(bitrate.group(1)) if bitrate else None,
+            }
+    raise ValueError(f"No audio stream found in {media_path}")
+
+
+def extract_audio_segments(
+    video_path: Union[str, Path],
+    max_segment_len: Union[int, None] = None,
+    out_dir: Union[str, Path, None] = None,
+    stream_copy: bool = False,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+    max_segment_bytes: int = AUDIO_SEGMENT_BYTES,
+) -> List[Dict[str, Any]]:
+    """
+    Extract the audio track of a video straight to segment files, in a single ffmpeg pass.
+    Only the audio stream is read: cuts are planned at quiet points (see `plan_segment_boundaries`),
+    then ffmpeg's segment muxer writes all segments at once, encoded with `profile`.
+    Segments are reused by later calls, unless the video has changed.
+    :param video_path:
+    :param max_segment_len: Maximum segment length, in seconds
+        (default: the longest that fits `max_segment_bytes` at the output bitrate)
+    :param out_dir: Directory for the segment files (default: `<video stem>.segments` next to the video)
+    :param stream_copy: Copy MP3 and AAC audio without re-encoding, if segments fit `max_segment_bytes`.
+        Faster, but uploads are larger than with a speech profile.
+    :param profile: Audio profile the segments are encoded with (see `get_audio_profile`)
+    :param max_segment_bytes: Size budget of a segment, in bytes
+    :return: Dictionaries with "segment" (index), "start", "end" (seconds) and "audio" (path of the segment)
+    """
+    video_path = Path(video_path)
+    out_dir = init_dl_dir(
+        out_dir if out_dir is not None else video_path.with_suffix(".segments")
+    )
+    manifest_path = out_dir / "segments.json"
+    profile = get_audio_profile(profile)
+    params = {
+        "video_mtime": video_path.stat().st_mtime,
+        "max_segment_len": max_segment_len,
+        "stream_copy": stream_copy,
+        "profile": profile,
+        "max_segment_bytes": max_segment_bytes,
+    }
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["params"] == params:
+            logging.info(f"Already extracted audio segments to {out_dir}")
+            count_cache("audio_segments", hits=1)
+            return [
+                {**segment, "audio": out_dir / segment["audio"]}
+                for segment in manifest["segments"]
+            ]
+        manifest_path.unlink()
+
+    count_cache("audio_segments", misses=1)
+    stream_info = get_audio_stream_info(video_path)
+    extension = STREAM_COPY_EXTENSIONS.get(stream_info["codec"])
+    copy = stream_copy and extension is not None and stream_info["bitrate"] is not None
+    if copy:
+        copy_segment_len = get_max_segment_len(stream_info["bitrate"], max_segment_bytes)
+        if max_segment_len is None:
+            max_segment_len = copy_segment_len
+        copy = max_segment_len <= copy_segment_len
+    if not copy:
+        extension = profile["extension"]
+        if max_segment_len is None:
+            max_segment_len = get_max_segment_len(profile["bitrate"], max_segment_bytes)
+
+    boundaries = plan_segment_boundaries(video_path, max_segment_len)
+    cuts = ",".join(f"{end:.3f}" for _, end in boundaries[:-1])
+    for old_segment in out_dir.glob(f"{video_path.stem}.*.*"):
+        old_segment.unlink()
+    logging.info(
+        f"Extracting {len(boundaries)} audio segments from {video_path} "
+        f"({'copying' if copy else 'encoding'} {stream_info['codec']} audio)."
+    )
+    with span(
+        "split_audio",
+        path=str(video_path),
+        segments=len(boundaries),
+        audio_seconds=boundaries[-1][1],
+        copy=copy,
+    ) as attributes:
+        subprocess.run(
+            [
+                _get_ffmpeg_path(),
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-i",
+                str(video_path),
+                "-map",
+                "0:a:0",
+                "-vn",
+                *(["-fflags", "+bitexact", "-c:a", "copy"] if copy else get_encoding_args(profile)),
+                "-f",
+                "segment",
+                *(["-segment_times", cuts] if cuts else []),
+                "-reset_timestamps",
+                "1",
+                str(out_dir / f"{video_path.stem}.%04d.{extension}"),
+            ],
+            capture_output=True,
+            check=True,
+        )
+
+        segments = [
+            {
+                "segment": i,
+                "start": start,
+                "end": end,
+                "audio": f"{video_path.stem}.{i:04d}.{extension}",
+            }
+            for i, (start, end) in enumerate(boundaries)
+        ]
+        missing = [s["audio"] for s in segments if not (out_dir / s["audio"]).exists()]
+        if missing:
+            raise RuntimeError(f"ffmpeg did not write the audio segments {missing}")
+        attributes["bytes"] = sum((out_dir / s["audio"]).stat().st_size for s in segments)
+    # Written last, so an interrupted extraction is redone
+    manifest_path.write_text(json.dumps({"params": params, "segments": segments}))
+    return [{**segment, "audio": out_dir / segment["audio"]} for segment in segments]
+
+
+def get_audio_segments_from_video(
+    video_path: Union[str, Path],
+    max_segment_len: Union[int, None] = None,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Get the audio of a video as Whisper-sized segments, with `extract_audio_segments`,
+    falling back to extracting the whole audio track with moviepy if ffmpeg fails
+    :param video_path:
+    :param max_segment_len: Maximum segment length, in seconds (default: from the size budget)
+    :param profile: Audio profile the segments are encoded with
+    :return: Segment dictionaries, as from `iter_audio_segments`
+    """
+    try:
+        return extract_audio_segments(video_path, max_segment_len, profile=profile)
+    except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+        logging.warning(
+            f"Could not extract audio segments from {video_path} with ffmpeg ({e}), using moviepy."
+        )
+        return iter_audio_segments(
+            get_audio_from_video(video_path), max_segment_len, profile=profile
+        )
+
+
+def get_transcript_segments_from_video(
+    video_path: Union[str, Path],
+    max_segment_len: Union[int, None] = None,
+    openai_apikey: Union[str, None] = None,
+    max_concurrency: int = 4,
+    cache_dir: Union[str, Path, None] = TRANSCRIPT_CACHE_DIR,
+    profile: Union[str, Dict[str, Any]] = AUDIO_PROFILE,
+) -> List[Dict[str, Any]]:
+    """
+    Get transcripts of a video's audio, segment by segment, with the segment boundaries
+    :param video_path:
+    :param max_segment_len: Maximum segment length, in seconds (default: from the size budget)
+    :param openai_apikey:
+    :param max_concurrency: Maximum number of segments transcribed at once
+    :param cache_dir: Directory for cached segment transcripts; None to disable caching
+    :param profile: Audio profile the segments are encoded with (see `get_audio_profile`)
+    :return: One dictionary per segment with "segment", "start", "end" (seconds) and "text"
+    """
+    oai_client = get_openai_client(openai_apikey)
+    logging.info(f"Getting transcripts from {video_path}...")
+    return transcribe_audio_segments(
+        oai_client,
+        get_audio_segments_from_video(video_path, max_segment_len, profile=profile),
+        max_concurrency=max_concurrency,
+        cache_dir=cache_dir,
+        cache_params={
+            "max_segment_len": max_segment_len,
+            "profile": get_audio_profile(profile),
+        },
+    )
+
+
 def get_yt_video_id(input_str: str) -> str:
     """
     Get the YouTube video ID (name) from a URL
@@ -399,6 +1983,8 @@ def get_yt_video_id(input_str: str) -> str:
     # Remove the suffix
     if "?" in output_str:
         output_str = output_str.split("?")[0]
+    if "&" in output_str:
+        output_str = output_str.split("&")[0]
 
     # Return the string
     if len(output_str) == 11:
@@ -0,0 +1,63 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import pytest
+
+
+class LocalServer:
+    """
+    Local HTTP server for download tests.
+    `routes` maps paths (with or without the query string) to dictionaries with the response "body" (bytes) and optional
+    "status", "headers" and "truncate" (number of body bytes to send before closing).
+    Conditional requests matching the route's ETag or Last-Modified header get a 304.
+    Requests are recorded in `requests` as (method, path, headers).
+    """
+
+    def __init__(self):
+        self.routes = dict()
+        self.requests = list()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(("GET", self.path, dict(self.headers)))
+                route = server.routes.get(self.path, server.routes.get(self.path.split("?")[0]))
+                if route is None:
+                    self.send_error(404)
+                    return
+                headers = route.get("headers", {})
+                if ("ETag" in headers and self.headers.get("If-None-Match") == headers["ETag"]) or (
+                    "Last-Modified" in headers
+                    and self.headers.get("If-Modified-Since") == headers["Last-Modified"]
+                ):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = route.get("body", b"")
+                self.send_response(route.get("status", 200))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[: route.get("truncate", len(body))])
+                self.wfile.flush()
+                if "truncate" in route:
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    server = LocalServer()
+    yield server
+    server.close()
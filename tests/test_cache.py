@@ -0,0 +1,118 @@
+from distyll.cache import SQLiteCache, LRUCache
+import distyll.cache
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable replacement for time.time in distyll.cache"""
+
+    class Clock:
+        now = 1000.0
+
+        def time(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(distyll.cache.time, "time", clock.time)
+    return clock
+
+
+def test_get_set(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite")
+    key = cache.make_key("gpt-4o", {"role": "system"}, "prompt")
+    assert key == cache.make_key("gpt-4o", {"role": "system"}, "prompt")
+    assert key != cache.make_key("gpt-4o", {"role": "system"}, "other prompt")
+
+    assert cache.get(key) is None
+    cache.set(key, "response")
+    assert cache.get(key) == "response"
+    cache.set("bytes", b"\x00\x01")
+    assert cache.get("bytes") == b"\x00\x01"
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "entries": 2}
+
+    # Entries persist across instances
+    cache.close()
+    assert SQLiteCache(tmp_path / "cache.sqlite").get(key) == "response"
+
+
+def test_lru_eviction(tmp_path, clock):
+    cache = SQLiteCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.set("a", "1")
+    clock.now += 1
+    cache.set("b", "2")
+    clock.now += 1
+    assert cache.get("a") == "1"  # "b" is now the least recently used
+    clock.now += 1
+    cache.set("c", "3")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_lru_eviction_in_batches(tmp_path, clock):
+    cache = SQLiteCache(tmp_path / "cache.sqlite", max_entries=20)
+    for i in range(20):
+        clock.now += 1
+        cache.set(str(i), "value")
+    clock.now += 1
+    assert cache.get("0") == "value"
+    cache.set("0", "new value")  # Replacing an entry does not make the cache overflow
+    assert len(cache) == 20
+
+    # Overflowing evicts the least recently used entries, down to 90% of `max_entries`
+    clock.now += 1
+    cache.set("20", "value")
+    assert len(cache) == 18
+    assert [cache.get(str(i)) for i in range(4)] == ["new value", None, None, None]
+
+    # Until the cache is full again, writes do not evict
+    cache.set_many([("21", "value"), ("22", "value")])
+    assert len(cache) == 20
+    cache.close()
+    cache = SQLiteCache(tmp_path / "cache.sqlite", max_entries=20)
+    cache.set("23", "value")
+    assert len(cache) == 18
+
+
+def test_ttl_eviction(tmp_path, clock):
+    cache = SQLiteCache(tmp_path / "cache.sqlite", ttl=60)
+    cache.set("a", "1")
+    clock.now += 30
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    clock.now += 31
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+    clock.now += 30
+    assert cache.evict_expired() == 1
+    assert len(cache) == 0
+
+
+def test_get_many_set_many(tmp_path, clock):
+    cache = SQLiteCache(tmp_path / "cache.sqlite", max_entries=3, ttl=60)
+    cache.set_many([("a", b"1"), ("b", b"2"), ("c", b"3"), ("d", b"4")])
+    assert len(cache) == 3
+
+    clock.now += 30
+    cache.set("e", b"5")
+    assert cache.get_many(["c", "d", "x", "e"]) == [b"3", b"4", None, b"5"]
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    clock.now += 31
+    assert cache.get_many(["c", "e"]) == [None, b"5"]
+
+
+def test_lru_cache(clock):
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set(("query", 1), ["result"])
+    cache.set("b", 2)
+    assert cache.get(("query", 1)) == ["result"]
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    clock.now += 61
+    assert cache.get("c") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "entries": 1}
@@ -0,0 +1,502 @@
+from distyll.db import (
+    ingest_many,
+    get_source_type,
+    get_chunk_uuid,
+    get_existing_chunk_uuids,
+    add_arxiv_to_db,
+    add_yt_to_db,
+    migrate_collection,
+    prep_db,
+)
+from distyll.schema import CollectionConfig, get_collection_kwargs
+from distyll.config import COLLECTION_NAME
+from distyll.utils import chunk_text
+from distyll.embeddings import Embedder, get_hashing_embedder
+from distyll.cache import SQLiteCache
+import distyll.embeddings
+import distyll.text.text
+import distyll.transcripts
+from contextlib import contextmanager
+from dataclasses import replace
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+import re
+
+
+class FakeBatch:
+    def __init__(self):
+        self.objects = list()
+
+    def add_object(self, properties=None, uuid=None, vector=None):
+        self.objects.append({"properties": properties, "uuid": uuid, "vector": vector})
+
+
+def describe_collection(create_kwargs):
+    """Mimic collection.config.get() for a collection created with `create_kwargs`"""
+
+    def describe_index(index):
+        settings = index.model_dump()
+        return SimpleNamespace(
+            distance_metric=settings["distance"],
+            ef=settings.get("ef"),
+            ef_construction=settings.get("efConstruction"),
+            max_connections=settings.get("maxConnections"),
+            quantizer=index.quantizer,
+        )
+
+    index = create_kwargs["vector_index_config"]
+    index_type = index.vector_index_type()
+    if index_type.value == "dynamic":
+        index_config = SimpleNamespace(
+            distance_metric=index.distance,
+            threshold=index.threshold,
+            hnsw=describe_index(index.hnsw),
+            flat=describe_index(index.flat),
+        )
+    else:
+        index_config = describe_index(index)
+    inverted = create_kwargs["inverted_index_config"].model_dump()
+    return SimpleNamespace(
+        vector_index_type=index_type,
+        vector_index_config=index_config,
+        inverted_index_config=SimpleNamespace(
+            bm25=SimpleNamespace(**inverted["bm25"]),
+            index_timestamps=inverted["indexTimestamps"],
+            index_property_length=inverted["indexPropertyLength"],
+            index_null_state=inverted["indexNullState"],
+        ),
+        properties=[
+            SimpleNamespace(
+                name=p.name, tokenization=p.tokenization, index_range_filters=p.indexRangeFilters
+            )
+            for p in create_kwargs["properties"]
+        ],
+        vectorizer=create_kwargs["vectorizer_config"].vectorizer,
+    )
+
+
+# Settings of collections created before index settings were configurable
+LEGACY_CONFIG = CollectionConfig(url_tokenization="word", chunk_no_range_filters=False)
+
+
+def matches(filters, properties):
+    """Evaluate the filters fetch_objects is called with"""
+    if hasattr(filters, "filters"):
+        return all(matches(f, properties) for f in filters.filters)
+    value = properties[filters.target]
+    operator = filters.operator.value
+    if filters.target == "url" and operator == "Equal":
+        # Like a filter on a word-tokenized property: all words of the value must be present
+        return set(re.findall(r"\w+", filters.value)) <= set(re.findall(r"\w+", value))
+    elif operator == "Equal":
+        return value == filters.value
+    elif operator == "GreaterThan":
+        return value > filters.value
+    raise NotImplementedError(operator)
+
+
+class FakeCollection:
+    """
+    Stand-in for a collection, storing objects by UUID once their batch is done.
+    Objects for which `reject(properties)` is true fail, and are reported in `failed_objects`.
+    """
+
+    def __init__(self, create_kwargs=None):
+        self.batch = self
+        self.query = self
+        self.data = self
+        self.config = self
+        self.create_kwargs = create_kwargs or get_collection_kwargs(LEGACY_CONFIG, False)
+        self.updates = list()
+        self.batches = list()
+        self.batch_options = list()
+        self.stored = dict()
+        self.vectors = dict()
+        self.failed_objects = list()
+        self.reject = lambda properties: False
+        self.query_maximum_results = 10_000
+        self.fetched_filters = list()
+
+    def get(self):
+        return describe_collection(self.create_kwargs)
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+    def iterator(self, include_vector=False):
+        for u, p in self.stored.items():
+            vector = self.vectors.get(u)
+            yield SimpleNamespace(
+                uuid=u, properties=p, vector={"default": vector} if vector is not None else {}
+            )
+
+    @contextmanager
+    def _batch(self):
+        batch = FakeBatch()
+        self.batches.append(batch)
+        self.failed_objects = list()
+        yield batch
+        for o in batch.objects:
+            if self.reject(o["properties"]):
+                self.failed_objects.append(
+                    SimpleNamespace(
+                        message="Rejected",
+                        object_=SimpleNamespace(uuid=o["uuid"], properties=o["properties"]),
+                    )
+                )
+            else:
+                self.stored[o["uuid"]] = o["properties"]
+                if o["vector"] is not None:
+                    self.vectors[o["uuid"]] = o["vector"]
+
+    def fixed_size(self, batch_size=100, concurrent_requests=2):
+        self.batch_options.append(("fixed_size", batch_size, concurrent_requests))
+        return self._batch()
+
+    def dynamic(self):
+        self.batch_options.append(("dynamic",))
+        return self._batch()
+
+    def fetch_objects(
+        self, limit=None, offset=None, filters=None, sort=None, return_properties=None
+    ):
+        # Like Weaviate: offset + limit is capped
+        assert (offset or 0) + limit <= self.query_maximum_results
+        self.fetched_filters.append(filters)
+        objects = list(self.stored.items())
+        if filters is not None:
+            objects = [(u, p) for u, p in objects if matches(filters, p)]
+        if sort is not None:
+            for s in reversed(sort.sorts):
+                objects.sort(key=lambda o: o[1][s.prop], reverse=not s.ascending)
+        offset = offset or 0
+        return SimpleNamespace(
+            objects=[
+                SimpleNamespace(uuid=u, properties={k: p[k] for k in return_properties})
+                for u, p in objects[offset : offset + limit]
+            ]
+        )
+
+    def delete_many(self, where):
+        uuids = [u for u in where.value if u in self.stored]
+        for u in uuids:
+            del self.stored[u]
+        return SimpleNamespace(successful=len(uuids))
+
+
+class FakeClient:
+    """Stand-in for a WeaviateClient, with an existing chunks collection"""
+
+    def __init__(self):
+        self.collections = self
+        self.by_name = {COLLECTION_NAME: FakeCollection()}
+        self.created = list()
+        self.deleted = list()
+
+    @property
+    def collection(self):
+        return self.by_name[COLLECTION_NAME]
+
+    def exists(self, name):
+        return name in self.by_name
+
+    def get(self, name):
+        return self.by_name[name]
+
+    def create(self, name, **kwargs):
+        self.created.append(name)
+        self.by_name[name] = FakeCollection(kwargs)
+        return self.by_name[name]
+
+    def delete(self, name):
+        self.deleted.append(name)
+        del self.by_name[name]
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient()
+
+
+def test_get_source_type():
+    assert get_source_type("https://youtu.be/6GEMkvT0DEk") == "youtube"
+    assert get_source_type("https://www.youtube.com/watch?v=EYXQmbZNhy8") == "youtube"
+    assert get_source_type("https://arxiv.org/abs/1706.03762") == "arxiv"
+    assert get_source_type("https://example.com/paper.pdf") == "pdf"
+
+
+def test_ingest_many(fake_client, monkeypatch):
+    pdf_path = Path("tests/test_data/1706.03762.pdf")
+
+    def fake_download_pdf(pdf_url, dl_dir=None, revalidate=False):
+        if "missing" in pdf_url:
+            raise FileNotFoundError(pdf_url)
+        return pdf_path
+
+    def fake_from_youtube(yt_url):
+        return {
+            "title": "A video",
+            "yt_url": yt_url,
+            "transcripts": ["word " * 150, "other " * 150],
+        }
+
+    monkeypatch.setattr(distyll.text.text, "_download_pdf", fake_download_pdf)
+    monkeypatch.setattr(distyll.transcripts, "from_youtube", fake_from_youtube)
+
+    reports = ingest_many(
+        fake_client,
+        [
+            "https://example.com/1706.03762.pdf",
+            "https://youtu.be/6GEMkvT0DEk",
+            ("pdf", "https://example.com/missing.pdf"),
+        ],
+        max_parse_workers=2,
+    )
+    assert [r["status"] for r in reports] == ["success", "success", "failed"]
+    assert reports[0]["chunks"] > 10
+    assert reports[1]["chunks"] == 4
+    assert "missing.pdf" in reports[2]["error"]
+
+    # All sources share one batch
+    assert len(fake_client.collection.batches) == 1
+    objects = fake_client.collection.batches[0].objects
+    assert len(objects) == reports[0]["chunks"] + reports[1]["chunks"]
+    yt_objects = [o for o in objects if o["properties"]["title"] == "A video"]
+    assert [o["properties"]["chunk_no"] for o in yt_objects] == [0, 1, 2, 3]
+
+    # Re-ingesting unchanged sources writes nothing
+    reports = ingest_many(fake_client, ["https://youtu.be/6GEMkvT0DEk"], max_parse_workers=1)
+    assert reports[0]["chunks"] == 4
+    assert reports[0]["added"] == 0
+    assert fake_client.collection.batches[-1].objects == []
+
+
+def test_ingest_many_expands_playlists(fake_client, monkeypatch):
+    playlist_url = "https://www.youtube.com/playlist?list=PL123"
+    video_urls = [
+        "https://www.youtube.com/watch?v=6GEMkvT0DEk",
+        "https://www.youtube.com/watch?v=EYXQmbZNhy8",
+    ]
+
+    def fake_get_youtube_playlist_urls(url):
+        if url != playlist_url:
+            raise ValueError(f"No playlist at {url}")
+        return video_urls
+
+    def fake_from_youtube(yt_url):
+        return {"title": "A video", "yt_url": yt_url, "transcripts": ["word " * 150]}
+
+    monkeypatch.setattr(distyll.db, "get_youtube_playlist_urls", fake_get_youtube_playlist_urls)
+    monkeypatch.setattr(distyll.transcripts, "from_youtube", fake_from_youtube)
+
+    reports = ingest_many(
+        fake_client,
+        [playlist_url, "https://www.youtube.com/@missing"],
+        max_parse_workers=1,
+    )
+    assert [r["source"] for r in reports] == video_urls + ["https://www.youtube.com/@missing"]
+    assert [r["status"] for r in reports] == ["success", "success", "failed"]
+    assert "No playlist" in reports[2]["error"]
+
+
+def test_get_chunk_uuid():
+    uuid = get_chunk_uuid("https://example.com/a.pdf", 0, "Same text")
+    assert uuid == get_chunk_uuid("https://example.com/a.pdf", 0, "Same text")
+    assert uuid != get_chunk_uuid("https://example.com/b.pdf", 0, "Same text")
+    assert uuid != get_chunk_uuid("https://example.com/a.pdf", 1, "Same text")
+    assert uuid != get_chunk_uuid("https://example.com/a.pdf", 0, "Other text")
+    # Fields do not run together
+    assert get_chunk_uuid("https://x.org/p1", 12, "Same text") != get_chunk_uuid(
+        "https://x.org/p11", 2, "Same text"
+    )
+
+
+def test_add_to_db_is_incremental(fake_client, monkeypatch):
+    url = "https://arxiv.org/abs/0000.00000"
+    paper = {"title": "A paper", "url": url, "text": "first " * 150 + "second " * 150}
+    monkeypatch.setattr(distyll.text, "from_arxiv_paper", lambda arxiv_url: dict(paper))
+    collection = fake_client.collection
+
+    assert add_arxiv_to_db(fake_client, url) == 4
+    first_uuids = get_existing_chunk_uuids(collection, url, page_size=3)
+    assert len(first_uuids) == 4
+
+    # Nothing changed: nothing is written
+    assert add_arxiv_to_db(fake_client, url) == 0
+    assert get_existing_chunk_uuids(collection, url) == first_uuids
+
+    # Changed ending: only the changed chunks are written and the old ones deleted
+    old_chunks = chunk_text(paper["text"])
+    paper["text"] = "first " * 150 + "third " * 150
+    new_chunks = chunk_text(paper["text"])
+    n_changed = sum(old != new for old, new in zip(old_chunks, new_chunks))
+    assert 0 < n_changed < 4
+    assert add_arxiv_to_db(fake_client, url) == n_changed
+    new_uuids = get_existing_chunk_uuids(collection, url)
+    assert len(new_uuids) == 4
+    assert len(new_uuids & first_uuids) == 4 - n_changed
+    assert len(collection.stored) == 4
+
+    # Chunks of a URL containing all words of this one are not mistaken for stale chunks of this one
+    monkeypatch.setattr(
+        distyll.text, "from_arxiv_paper", lambda arxiv_url: dict(paper, text="other " * 100)
+    )
+    add_arxiv_to_db(fake_client, url + "?version=2")
+    paper["text"] = "first " * 150 + "fourth " * 150
+    monkeypatch.setattr(distyll.text, "from_arxiv_paper", lambda arxiv_url: dict(paper))
+    add_arxiv_to_db(fake_client, url)
+    assert len(get_existing_chunk_uuids(collection, url + "?version=2")) == 1
+    assert len(collection.stored) == 5
+
+
+def test_existing_chunk_uuids_past_query_maximum_results():
+    collection = FakeCollection()
+    collection.query_maximum_results = 10
+    url = "https://example.com/a.pdf"
+    for i in range(25):
+        collection.stored[f"a-{i}"] = {"url": url, "chunk_no": i}
+        # Chunks of other URLs matched by the filter, with the same numbers
+        collection.stored[f"b-{i}"] = {"url": url + "?version=2", "chunk_no": i}
+        collection.stored[f"c-{i}"] = {"url": url + "?version=3", "chunk_no": i}
+    collection.stored["other"] = {"url": "https://example.com/b.pdf", "chunk_no": 0}
+    # A stale chunk whose deletion failed
+    collection.stored["a-stale"] = {"url": url, "chunk_no": 4}
+
+    uuids = get_existing_chunk_uuids(collection, url, page_size=4)
+    assert uuids == {f"a-{i}" for i in range(25)} | {"a-stale"}
+    # Only the chunks of the URL are fetched, not the whole collection
+    assert all(f is not None for f in collection.fetched_filters)
+
+
+def test_add_yt_to_db_batching(fake_client, monkeypatch):
+    def fake_from_youtube(yt_url):
+        return {
+            "title": "A video",
+            "yt_url": yt_url,
+            "transcripts": ["word " * 150, "other " * 150, "more " * 150],
+        }
+
+    monkeypatch.setattr(distyll.transcripts, "from_youtube", fake_from_youtube)
+    url = "https://youtu.be/6GEMkvT0DEk"
+
+    # Each transcript is chunked and written once
+    assert add_yt_to_db(fake_client, url, batch_size=10, concurrent_requests=4) == 6
+    assert fake_client.collection.batch_options == [("fixed_size", 10, 4)]
+    assert [o["properties"]["chunk_no"] for o in fake_client.collection.batches[0].objects] == list(
+        range(6)
+    )
+
+    fake_client.collection.stored.clear()
+    assert add_yt_to_db(fake_client, url, batch_mode="dynamic") == 6
+    assert fake_client.collection.batch_options[-1] == ("dynamic",)
+
+    with pytest.raises(ValueError):
+        add_yt_to_db(fake_client, url, batch_mode="streaming")
+
+
+def test_ingest_many_reports_failed_objects(fake_client, monkeypatch):
+    paper = {"title": "A paper", "text": "first " * 300}
+    monkeypatch.setattr(
+        distyll.text,
+        "from_arxiv_paper",
+        lambda arxiv_url, executor=None: dict(paper, url=arxiv_url),
+    )
+    monkeypatch.setattr(distyll.text, "prefetch_arxiv_metadata", lambda urls: {})
+    url = "https://arxiv.org/abs/0000.00000"
+    collection = fake_client.collection
+
+    [report] = ingest_many(fake_client, [url], max_parse_workers=1)
+    assert report["status"] == "success"
+    old_uuids = set(collection.stored)
+
+    # Chunks of the new version fail: the report lists them, and the old chunks are kept
+    paper["text"] = "second " * 300
+    collection.reject = lambda properties: "second" in properties["chunk"]
+    [report] = ingest_many(fake_client, [url], max_parse_workers=1)
+    assert report["status"] == "partial"
+    assert report["added"] == 0
+    assert report["failed"] == report["chunks"] == len(report["failed_objects"])
+    assert report["failed_objects"][0]["message"] == "Rejected"
+    assert report["deleted"] == 0
+    assert set(collection.stored) == old_uuids
+
+    # Once they can be written, the stale chunks go
+    collection.reject = lambda properties: False
+    [report] = ingest_many(fake_client, [url], max_parse_workers=1)
+    assert report["status"] == "success"
+    assert report["deleted"] == len(old_uuids)
+    assert not set(collection.stored) & old_uuids
+
+
+def test_ingest_with_local_embedder(fake_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        distyll.embeddings, "get_embedding_cache", lambda: SQLiteCache(tmp_path / "e.sqlite")
+    )
+    hashing = get_hashing_embedder(dimensions=16)
+    calls = list()
+
+    def embed(texts):
+        calls.append(len(texts))
+        return hashing.embed(texts)
+
+    def fake_from_youtube(yt_url):
+        return {"title": "A video", "yt_url": yt_url, "transcripts": ["word " * 150, "other " * 150]}
+
+    monkeypatch.setattr(distyll.transcripts, "from_youtube", fake_from_youtube)
+    embedder = Embedder(name="counting", embed=embed)
+
+    assert add_yt_to_db(fake_client, "https://youtu.be/6GEMkvT0DEk", embedder=embedder) == 4
+    objects = fake_client.collection.batches[0].objects
+    assert calls == [4]
+    for o in objects:
+        assert len(o["vector"]) == 16
+        assert o["vector"] == pytest.approx(hashing.embed([o["properties"]["chunk"]])[0].tolist())
+
+    # Same chunks under another URL: vectors come from the cache
+    calls.clear()
+    add_yt_to_db(fake_client, "https://youtu.be/other", embedder=embedder)
+    assert calls == []
+
+
+def test_prep_db_collection_config(fake_client):
+    fake_client.delete(COLLECTION_NAME)
+    prep_db(fake_client, collection_config=CollectionConfig(vector_index="flat", quantizer="bq"))
+    description = fake_client.collection.get()
+    assert description.vector_index_type.value == "flat"
+    assert [p.tokenization.value for p in description.properties if p.name == "url"] == ["field"]
+
+    # An existing collection is left as is
+    prep_db(fake_client, collection_config=CollectionConfig())
+    assert fake_client.created == [COLLECTION_NAME]
+
+
+def test_migrate_collection(fake_client):
+    # Same settings: nothing to do
+    assert migrate_collection(fake_client, LEGACY_CONFIG)["action"] == "unchanged"
+
+    # Search settings and quantization can be changed in place
+    result = migrate_collection(fake_client, replace(LEGACY_CONFIG, ef=256, quantizer="pq"))
+    assert result["action"] == "updated"
+    assert result["changes"] == {"ef": (-1, 256), "quantizer": (None, "pq")}
+    assert len(fake_client.collection.updates) == 1
+
+    # Other settings need a rebuild, keeping objects and vectors
+    batch_collection = fake_client.collection
+    with batch_collection.fixed_size() as batch:
+        for i in range(5):
+            batch.add_object(
+                properties={"title": "t", "url": "u", "chunk": f"c{i}", "chunk_no": i},
+                uuid=f"uuid-{i}",
+                vector=[float(i)] * 3,
+            )
+    target = CollectionConfig(max_connections=16)
+    result = migrate_collection(fake_client, target, batch_size=2)
+    assert result["action"] == "rebuilt"
+    assert set(result["changes"]) == {"max_connections", "url_tokenization", "chunk_no_range_filters"}
+    assert result["objects"] == 5
+    assert fake_client.collection is not batch_collection
+    assert fake_client.collection.stored == batch_collection.stored
+    assert fake_client.collection.vectors == batch_collection.vectors
+    assert fake_client.deleted == [COLLECTION_NAME, f"{COLLECTION_NAME}_migration"]
+    assert migrate_collection(fake_client, target)["action"] == "unchanged"
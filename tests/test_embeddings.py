@@ -0,0 +1,56 @@
+from distyll.cache import SQLiteCache
+from distyll.embeddings import Embedder, embed_texts, get_hashing_embedder
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLiteCache(tmp_path / "embeddings.sqlite")
+
+
+def test_hashing_embedder():
+    embedder = get_hashing_embedder(dimensions=64)
+    vectors = embedder.embed(
+        ["the cat sat on the mat", "The cat sat on the mat!", "quantum chromodynamics", ""]
+    )
+    assert vectors.shape == (4, 64)
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1)
+    assert np.allclose(vectors[0], vectors[1])
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert not vectors[3].any()
+
+    # Stable across calls (and processes, as the hash is not Python's)
+    assert np.array_equal(embedder.embed(["the cat"]), get_hashing_embedder(64).embed(["the cat"]))
+
+
+def test_embed_texts_batches_and_caches(cache):
+    hashing = get_hashing_embedder(dimensions=32)
+    calls = list()
+
+    def embed(texts):
+        calls.append(len(texts))
+        return hashing.embed(texts)
+
+    embedder = Embedder(name="counting", embed=embed)
+    texts = [f"chunk number {i}" for i in range(10)]
+
+    vectors = embed_texts(texts, embedder, batch_size=4, cache=cache)
+    assert calls == [4, 4, 2]
+    assert np.array_equal(vectors, hashing.embed(texts))
+
+    # Cached texts are not embedded again
+    calls.clear()
+    vectors = embed_texts(texts[5:] + ["a new chunk"], embedder, batch_size=4, cache=cache)
+    assert calls == [1]
+    assert np.array_equal(vectors[:5], hashing.embed(texts[5:]))
+
+    # Another embedder does not share the cached vectors
+    calls.clear()
+    embed_texts(texts[:2], Embedder(name="other", embed=embed), cache=cache)
+    assert calls == [2]
+
+    calls.clear()
+    embed_texts(texts[:2], embedder, use_cache=False)
+    assert calls == [2]
+    assert embed_texts([], embedder, cache=cache).shape == (0, 0)
@@ -0,0 +1,148 @@
+from distyll.instrumentation import (
+    span,
+    count,
+    in_current_context,
+    count_cache,
+    set_exporter,
+    get_exporter,
+    get_jsonl_exporter,
+    read_jsonl,
+    summarize,
+)
+from distyll.cache import SQLiteCache
+from distyll.llm import ask_openai
+from distyll.utils import chunk_text, transcribe_audio_segments
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+import threading
+
+
+@pytest.fixture
+def records():
+    records = list()
+    set_exporter(records.append)
+    yield records
+    set_exporter(None)
+
+
+def test_noop_by_default():
+    assert get_exporter() is None
+    with span("download", url="https://example.com") as attributes:
+        attributes["bytes"] = 10
+    count("cache.hit")
+
+
+def test_spans_and_counters(records):
+    with span("ingest") as ingest:
+        with span("download", url="https://example.com/a.pdf") as attributes:
+            attributes["bytes"] = 100
+        ingest["sources"] = 1
+    with pytest.raises(ValueError):
+        with span("download", url="https://example.com/b.pdf"):
+            raise ValueError("Not found")
+    count_cache("llm", hits=3, misses=1)
+    count("batch.failed_objects", 2)
+
+    download, ingest, failed_download = records[:3]
+    assert download["type"] == "span" and download["name"] == "download"
+    assert download["parent"] == "ingest"
+    assert download["attributes"] == {"url": "https://example.com/a.pdf", "bytes": 100}
+    assert ingest["parent"] is None and ingest["seconds"] >= download["seconds"]
+    assert failed_download["error"] == "ValueError: Not found"
+
+    summary = summarize(records)
+    assert summary["spans"]["download"]["count"] == 2
+    assert summary["spans"]["download"]["errors"] == 1
+    assert summary["spans"]["download"]["bytes"] == 100
+    assert summary["counters"] == {"cache.hit": 3, "cache.miss": 1, "batch.failed_objects": 2}
+    assert summary["cache_hit_rates"] == {"llm": 0.75}
+
+
+def test_worker_spans_have_parents(records):
+    def work(i):
+        with span("work", item=i):
+            pass
+
+    with span("batch"), ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(in_current_context(work), range(4)))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        executor.submit(in_current_context(work), 4).result()
+
+    assert [r["parent"] for r in records if r["name"] == "work"] == ["batch"] * 4 + [None]
+
+
+def test_exporter_errors_are_contained():
+    def broken_exporter(record):
+        raise OSError("Disk full")
+
+    set_exporter(broken_exporter)
+    try:
+        with span("download"):
+            pass
+        count("cache.hit")
+    finally:
+        set_exporter(None)
+
+
+def test_jsonl_exporter(tmp_path):
+    path = tmp_path / "traces" / "trace.jsonl"
+    set_exporter(get_jsonl_exporter(path))
+    try:
+        threads = [
+            threading.Thread(target=lambda: [count("chunks", 2) for _ in range(50)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        chunk_text("word " * 300, token_length=100, overlap_fraction=0)
+    finally:
+        set_exporter(None)
+
+    summary = summarize(read_jsonl(path))
+    assert summary["counters"]["chunks"] == 400
+    assert summary["spans"]["chunk"]["chunks"] == 3
+    assert summary["spans"]["chunk"]["chars"] == 1500
+
+
+def test_llm_and_whisper_instrumentation(records, tmp_path):
+    class ChatClient:
+        def __init__(self):
+            self.chat = self
+            self.completions = self
+
+        def create(self, model, messages):
+            message = SimpleNamespace(content="A response")
+            usage = SimpleNamespace(prompt_tokens=12, completion_tokens=3, total_tokens=15)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    cache = SQLiteCache(tmp_path / "llm_cache.sqlite")
+    for _ in range(2):
+        ask_openai("A prompt", oai_client=ChatClient(), cache=cache)
+
+    class TranscriptionClient:
+        def __init__(self):
+            self.audio = self
+            self.transcriptions = self
+
+        def create(self, model, file):
+            return SimpleNamespace(text="A transcript")
+
+    segments = list()
+    for i in range(2):
+        path = tmp_path / f"clip.{i}.mp3"
+        path.write_bytes(str(i).encode() * 1000)
+        segments.append({"segment": i, "start": 60 * i, "end": 60 * (i + 1), "audio": path})
+    transcribe_audio_segments(TranscriptionClient(), segments, cache_dir=tmp_path / "cache")
+
+    summary = summarize(records)
+    assert summary["spans"]["llm"]["count"] == 1
+    assert summary["spans"]["llm"]["total_tokens"] == 15
+    assert summary["spans"]["whisper"]["count"] == 2
+    assert [r["parent"] for r in records if r["name"] == "whisper"] == ["transcribe"] * 2
+    assert summary["spans"]["transcribe"]["segments"] == 2
+    assert summary["spans"]["whisper"]["bytes"] == 2000
+    assert summary["spans"]["whisper"]["audio_seconds"] == 120
+    assert summary["cache_hit_rates"] == {"llm": 0.5, "transcript": 0.0}
@@ -0,0 +1,126 @@
+from distyll.llm import ask_openai, summarize_text
+from distyll.cache import SQLiteCache
+import distyll.llm.utils
+import pytest
+import threading
+import time
+
+
+@pytest.fixture(autouse=True)
+def llm_cache(tmp_path, monkeypatch):
+    cache = SQLiteCache(tmp_path / "llm_cache.sqlite")
+    monkeypatch.setattr(distyll.llm.utils, "get_llm_cache", lambda: cache)
+    return cache
+
+
+class StubChatClient:
+    """Stand-in for the OpenAI client exposing `chat.completions.create`"""
+
+    def __init__(self, summary_words=10, delay=0.0):
+        self.summary_words = summary_words
+        self.delay = delay
+        self.requests = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages):
+        with self._lock:
+            self.requests.append(messages)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+
+        # "Summarise" by keeping the first few words of the prompt
+        content = " ".join(messages[-1]["content"].split()[: self.summary_words])
+
+        class Message:
+            pass
+
+        class Choice:
+            message = Message()
+
+        class Completion:
+            choices = [Choice()]
+
+        Choice.message.content = content
+        return Completion()
+
+
+def test_ask_openai_with_client():
+    client = StubChatClient()
+    assert ask_openai("one two three", oai_client=client) == "one two three"
+    assert client.requests[0][0]["role"] == "system"
+
+
+def test_summarize_short_text():
+    client = StubChatClient()
+    summary = summarize_text("a short text", oai_client=client)
+    assert summary == "a short text"
+    assert len(client.requests) == 1
+    assert "3 short key points" in client.requests[0][0]["content"]
+
+
+def test_summarize_text_map_reduce():
+    client = StubChatClient(summary_words=20, delay=0.02)
+    text = " ".join(f"w{i}" for i in range(2000))
+    summary = summarize_text(
+        text, max_chunk_len=100, overlap=0, max_concurrency=4, oai_client=client
+    )
+
+    # 20 chunk summaries of 20 words -> 4 summaries of 20 words -> 1 final summary
+    assert len(client.requests) == 20 + 4 + 1
+    assert 1 < client.max_in_flight <= 4
+    final_prompt = client.requests[-1]
+    assert "3 short key points" in final_prompt[0]["content"]
+    # Chunk summaries are reduced in order
+    assert summary.split()[:2] == ["w0", "w1"]
+
+
+def test_summarize_text_max_rounds():
+    client = StubChatClient(summary_words=100)
+    text = " ".join(f"w{i}" for i in range(300))
+    summary = summarize_text(text, max_chunk_len=100, overlap=0, max_rounds=1, oai_client=client)
+    assert len(client.requests) == 3
+    assert summary == text
+
+
+def test_ask_openai_cache(llm_cache):
+    client = StubChatClient()
+    assert ask_openai("one two three", oai_client=client) == "one two three"
+    assert ask_openai("one two three", oai_client=client) == "one two three"
+    assert len(client.requests) == 1
+    assert llm_cache.stats()["hits"] == 1
+
+    # A different model or system prompt is a different request
+    ask_openai("one two three", model="gpt-4o-mini", oai_client=client)
+    ask_openai("one two three", {"role": "system", "content": "Be brief."}, oai_client=client)
+    assert len(client.requests) == 3
+
+    # Bypass the cache
+    ask_openai("one two three", oai_client=client, use_cache=False)
+    assert len(client.requests) == 4
+
+
+def test_ask_openai_uses_given_empty_cache(llm_cache, tmp_path):
+    # An empty cache has a length of 0, but must still be used rather than the default one
+    cache = SQLiteCache(tmp_path / "other.sqlite")
+    ask_openai("one two three", oai_client=StubChatClient(), cache=cache)
+    assert len(cache) == 1
+    assert len(llm_cache) == 0
+
+
+def test_summarize_text_reuses_unchanged_chunks(llm_cache):
+    client = StubChatClient(summary_words=20)
+    text = " ".join(f"w{i}" for i in range(500))
+    summarize_text(text, max_chunk_len=100, overlap=0, oai_client=client)
+    n_requests = len(client.requests)
+
+    # Changing the last chunk only re-requests that chunk and the reduce steps
+    summarize_text(text + " extra", max_chunk_len=100, overlap=0, oai_client=client)
+    assert len(client.requests) - n_requests < n_requests
+    assert llm_cache.stats()["hits"] >= 4
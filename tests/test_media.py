@@ -3,10 +3,24 @@ from distyll.transcripts import from_local_video, from_youtube
 from distyll.text.text import (
     _download_pdf,
     _parse_pdf,
+    _parse_pdf_pages,
     from_pdf,
     from_arxiv_paper,
+    prefetch_arxiv_metadata,
 )
-from distyll.utils import download_youtube_video, get_yt_video_id
+from distyll.utils import (
+    download_file_cached,
+    download_youtube_video,
+    get_yt_video_id,
+    read_download_meta,
+    get_arxiv_id,
+    get_arxiv_metadata,
+    get_arxiv_metadata_bulk,
+)
+import distyll.utils
+import hashlib
+import json
+import distyll.text.text
 from pathlib import Path
 import pytest
 import logging
@@ -27,6 +41,89 @@ def test_download_pdf(pdf_url, dl_dir):
     assert outpath == new_outpath
 
 
+def test_download_pdf_local(local_server, tmp_path):
+    pdf_bytes = Path("tests/test_data/1706.03762.pdf").read_bytes()
+    local_server.routes["/paper.pdf"] = {"body": pdf_bytes}
+    outpath = _download_pdf(f"{local_server.url}/paper.pdf", dl_dir=tmp_path)
+    assert outpath == tmp_path / "paper.pdf"
+    assert outpath.read_bytes() == pdf_bytes
+
+    # Cached files are not downloaded again
+    _download_pdf(f"{local_server.url}/paper.pdf", dl_dir=tmp_path)
+    assert len(local_server.requests) == 1
+
+
+def test_download_pdf_failures_are_not_cached(local_server, tmp_path):
+    local_server.routes["/truncated.pdf"] = {"body": b"%PDF" + b"0" * 10000, "truncate": 100}
+    for path in ["/missing.pdf", "/truncated.pdf"]:
+        with pytest.raises(Exception):
+            _download_pdf(f"{local_server.url}{path}", dl_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "validator",
+    [
+        {"ETag": '"v1"'},
+        {"Last-Modified": "Mon, 12 Jun 2017 17:57:34 GMT"},
+    ],
+)
+def test_from_pdf_revalidation(local_server, tmp_path, monkeypatch, validator):
+    pdf_bytes = Path("tests/test_data/1706.03762.pdf").read_bytes()
+    local_server.routes["/paper.pdf"] = {"body": pdf_bytes, "headers": validator}
+    pdf_url = f"{local_server.url}/paper.pdf"
+
+    parsed = list()
+    parse_pdf_pages = distyll.text.text._parse_pdf_pages
+
+    def counting_parse_pdf_pages(*args, **kwargs):
+        parsed.append(args[0])
+        return parse_pdf_pages(*args, **kwargs)
+
+    monkeypatch.setattr(distyll.text.text, "_parse_pdf_pages", counting_parse_pdf_pages)
+
+    pdf_text = from_pdf(pdf_url, dl_dir=tmp_path)
+    meta = read_download_meta(tmp_path / "paper.pdf")
+    assert meta["size"] == len(pdf_bytes)
+    assert list(validator.values())[0] in (meta["etag"], meta["last_modified"])
+
+    # Cached: no request and no parse
+    assert from_pdf(pdf_url, dl_dir=tmp_path) == pdf_text
+    assert len(local_server.requests) == 1
+    assert len(parsed) == 1
+
+    # Revalidated and unchanged: a conditional request answered with a 304, and no parse
+    assert from_pdf(pdf_url, dl_dir=tmp_path, revalidate=True) == pdf_text
+    assert len(local_server.requests) == 2
+    request_headers = local_server.requests[-1][2]
+    assert "If-None-Match" in request_headers or "If-Modified-Since" in request_headers
+    assert len(parsed) == 1
+
+    # Changed on the server: downloaded and parsed again
+    pdf_bytes_v2 = pdf_bytes + b"\n"
+    local_server.routes["/paper.pdf"] = {"body": pdf_bytes_v2, "headers": {"ETag": '"v2"'}}
+    from_pdf(pdf_url, dl_dir=tmp_path, revalidate=True)
+    assert len(parsed) == 2
+    assert read_download_meta(tmp_path / "paper.pdf")["size"] == len(pdf_bytes_v2)
+
+
+def test_cached_file_without_sidecar(tmp_path, monkeypatch):
+    # Downloaded before sidecars existed: hashed without loading the whole file into memory
+    pdf_bytes = Path("tests/test_data/1706.03762.pdf").read_bytes()
+    out_path = tmp_path / "paper.pdf"
+    out_path.write_bytes(pdf_bytes)
+
+    def fail(self):
+        raise AssertionError(f"Read {self} into memory")
+
+    monkeypatch.setattr(Path, "read_bytes", fail)
+    meta = download_file_cached("https://example.com/paper.pdf", out_path)
+    assert not meta["changed"]
+    assert meta["size"] == len(pdf_bytes)
+    assert meta["sha256"] == hashlib.sha256(pdf_bytes).hexdigest()
+    assert read_download_meta(out_path)["sha256"] == meta["sha256"]
+
+
 pdf_data = [
     (
         "tests/test_data/1706.03762.pdf",
@@ -46,6 +143,15 @@ def test_read_pdf(pdf_path, val_strings):
             assert val_str in pdf_str
 
 
+@pytest.mark.parametrize("pdf_path, val_strings", pdf_data)
+def test_read_pdf_parallel(pdf_path, val_strings):
+    pages = _parse_pdf_pages(pdf_path)
+    assert len(pages) == 15
+    for max_workers in [2, 4]:
+        assert _parse_pdf_pages(pdf_path, max_workers=max_workers) == pages
+        assert _parse_pdf(pdf_path, max_workers=max_workers) == _parse_pdf(pdf_path)
+
+
 pdf_data = [
     (
         "https://arxiv.org/pdf/1706.03762.pdf",
@@ -85,6 +191,117 @@ def test_text_from_arxiv_paper(pdf_url, val_strings, title):
     assert arxiv_data["url"] == pdf_url
 
 
+def test_get_arxiv_id():
+    assert get_arxiv_id("https://arxiv.org/abs/1706.03762") == "1706.03762"
+    assert get_arxiv_id("https://arxiv.org/pdf/1706.03762v7.pdf") == "1706.03762v7"
+    assert get_arxiv_id("https://arxiv.org/abs/hep-th/9901001") == "hep-th/9901001"
+    assert get_arxiv_id("1706.03762") == "1706.03762"
+    assert get_arxiv_id("hep-th/9901001") == "hep-th/9901001"
+
+
+ABS_PAGE_HEAD = b"""<!DOCTYPE html><html><head>
+<title>[1706.03762] Attention Is All You Need</title>
+<meta name="citation_title" content="Attention Is All You Need" />
+<meta name="citation_author" content="Vaswani, Ashish" />
+<meta name="citation_author" content="Shazeer, Noam" />
+<meta name="citation_date" content="2017/06/12" />
+<meta name="citation_pdf_url" content="https://arxiv.org/pdf/1706.03762" />
+<meta name="citation_arxiv_id" content="1706.03762" />
+</head>"""
+
+
+def test_get_arxiv_metadata_reads_head_only(local_server):
+    body = ABS_PAGE_HEAD + b"<body>" + b'<meta name="citation_title" content="Not this" />' * 50_000
+    local_server.routes["/abs/1706.03762"] = {"body": body}
+
+    metadata = get_arxiv_metadata(
+        "https://arxiv.org/abs/1706.03762", abs_url=local_server.url + "/abs/", chunk_size=1024
+    )
+    assert metadata == {
+        "title": "Attention Is All You Need",
+        "authors": ["Vaswani, Ashish", "Shazeer, Noam"],
+        "date": "2017/06/12",
+        "pdf_url": "https://arxiv.org/pdf/1706.03762",
+        "arxiv_id": "1706.03762",
+    }
+
+    local_server.routes["/abs/0000.00000"] = {"body": b"Not found", "status": 404}
+    assert get_arxiv_metadata("0000.00000", abs_url=local_server.url + "/abs/") is None
+
+
+ATOM_FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <entry>
+    <id>http://arxiv.org/abs/1706.03762v7</id>
+    <published>2017-06-12T17:57:34Z</published>
+    <title>Attention Is All
+      You Need</title>
+    <summary>  The dominant sequence transduction models...</summary>
+    <author><name>Ashish Vaswani</name></author>
+    <author><name>Noam Shazeer</name></author>
+    <link title="pdf" href="http://arxiv.org/pdf/1706.03762v7" rel="related" type="application/pdf"/>
+  </entry>
+  <entry>
+    <id>http://arxiv.org/abs/hep-th/9901001v1</id>
+    <published>1999-01-01T00:00:00Z</published>
+    <title>An old-style paper</title>
+    <arxiv:doi>10.1000/example</arxiv:doi>
+  </entry>
+</feed>"""
+
+
+def test_get_arxiv_metadata_bulk(local_server):
+    local_server.routes["/api/query"] = {"body": ATOM_FEED}
+
+    results = get_arxiv_metadata_bulk(
+        ["https://arxiv.org/abs/1706.03762", "hep-th/9901001v1", "0000.00000"],
+        api_url=local_server.url + "/api/query",
+    )
+    assert len(local_server.requests) == 1
+    assert "id_list=1706.03762%2Chep-th%2F9901001v1%2C0000.00000" in local_server.requests[0][1]
+    assert results["1706.03762"] == {
+        "arxiv_id": "1706.03762v7",
+        "title": "Attention Is All You Need",
+        "authors": ["Ashish Vaswani", "Noam Shazeer"],
+        "date": "2017/06/12",
+        "abstract": "The dominant sequence transduction models...",
+        "pdf_url": "http://arxiv.org/pdf/1706.03762v7",
+    }
+    assert results["hep-th/9901001v1"]["doi"] == "10.1000/example"
+    assert "0000.00000" not in results
+
+
+def test_from_arxiv_paper_warm_cache(tmp_path, monkeypatch):
+    def fake_bulk(arxiv_ids):
+        bulk_calls.append(list(arxiv_ids))
+        return {arxiv_id: {"title": f"Paper {arxiv_id}"} for arxiv_id in arxiv_ids}
+
+    bulk_calls = list()
+    monkeypatch.setattr(distyll.text.text, "get_arxiv_metadata_bulk", fake_bulk)
+    urls = ["https://arxiv.org/abs/1706.03762", "https://arxiv.org/abs/hep-th/9901001"]
+    prefetch_arxiv_metadata(urls, dl_dir=tmp_path)
+    prefetch_arxiv_metadata(urls, dl_dir=tmp_path)
+    assert bulk_calls == [["1706.03762", "hep-th/9901001"]]
+    assert json.loads((tmp_path / "hep-th_9901001.metadata.json").read_text()) == {
+        "title": "Paper hep-th/9901001"
+    }
+
+    # With the text and metadata cached, no requests are made
+    (tmp_path / "1706.03762.txt").write_text("Cached text")
+
+    def no_network():
+        raise AssertionError("Unexpected network request")
+
+    monkeypatch.setattr(distyll.utils, "get_http_session", no_network)
+    arxiv_data = from_arxiv_paper(urls[0], dl_dir=tmp_path)
+    assert arxiv_data == {
+        "title": "Paper 1706.03762",
+        "url": urls[0],
+        "text": "Cached text",
+        "metadata": {"title": "Paper 1706.03762"},
+    }
+
+
 youtube_testdata = [
     (
         "https://youtu.be/6GEMkvT0DEk",
@@ -0,0 +1,131 @@
+from distyll.query import search, generate, get_filters, get_query_stats, clear_query_cache
+from distyll.embeddings import Embedder, get_hashing_embedder
+from types import SimpleNamespace
+import pytest
+
+CHUNKS = [
+    {
+        "title": "Attention Is All You Need",
+        "url": "https://arxiv.org/abs/1706.03762",
+        "chunk": f"chunk {i}",
+        "chunk_no": i,
+    }
+    for i in range(3)
+]
+
+
+class FakeSearch:
+    """Stand-in for the query and generate namespaces of a collection, recording calls"""
+
+    def __init__(self, generative):
+        self.calls = list()
+        self.generative = generative
+
+    def __getattr__(self, method):
+        def call(**kwargs):
+            self.calls.append((method, kwargs))
+            objects = [
+                SimpleNamespace(
+                    uuid=f"uuid-{i}",
+                    properties=properties,
+                    metadata=SimpleNamespace(score=1.0 - i / 10, distance=None),
+                )
+                for i, properties in enumerate(CHUNKS[: kwargs["limit"]])
+            ]
+            if self.generative:
+                return SimpleNamespace(objects=objects, generative=SimpleNamespace(text="An answer"))
+            return SimpleNamespace(objects=objects)
+
+        return call
+
+
+class FakeClient:
+    def __init__(self):
+        self.collections = self
+        self.query = FakeSearch(generative=False)
+        self.generate = FakeSearch(generative=True)
+
+    def get(self, name):
+        return self
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    clear_query_cache()
+    yield
+    clear_query_cache()
+
+
+def test_search_modes():
+    client = FakeClient()
+    results = search(client, "attention", mode="bm25", limit=2)
+    assert [r["chunk"] for r in results] == ["chunk 0", "chunk 1"]
+    assert results[0]["uuid"] == "uuid-0" and results[0]["score"] == 1.0
+
+    search(client, "attention", mode="near_text", limit=2)
+    search(client, "attention", mode="hybrid", alpha=0.25, limit=2)
+    assert [method for method, _ in client.query.calls] == ["bm25", "near_text", "hybrid"]
+    assert client.query.calls[2][1]["alpha"] == 0.25
+    assert client.query.calls[2][1]["vector"] is None
+
+    with pytest.raises(ValueError):
+        search(client, "attention", mode="semantic")
+
+
+def test_search_cache_and_stats():
+    client = FakeClient()
+    results = search(client, "attention", url="https://arxiv.org/abs/1706.03762")
+    results[0]["chunk"] = "modified by the caller"
+    assert search(client, "attention", url="https://arxiv.org/abs/1706.03762")[0]["chunk"] == "chunk 0"
+    assert len(client.query.calls) == 1
+
+    search(client, "attention", url="https://arxiv.org/abs/1706.03762", use_cache=False)
+    search(client, "attention", url="https://arxiv.org/abs/1706.03762", limit=1)
+    assert len(client.query.calls) == 3
+
+    stats = get_query_stats()
+    assert stats["hybrid"]["count"] == 3
+    assert 0 <= stats["hybrid"]["p50_ms"] <= stats["hybrid"]["max_ms"]
+    assert stats["result_cache"]["hits"] == 1
+
+
+def test_search_with_local_embedder():
+    client = FakeClient()
+    hashing = get_hashing_embedder(dimensions=8)
+    calls = list()
+
+    def embed(texts):
+        calls.append(texts)
+        return hashing.embed(texts)
+
+    embedder = Embedder(name="counting", embed=embed)
+    search(client, "attention", mode="near_text", embedder=embedder)
+    search(client, "attention", mode="hybrid", embedder=embedder)
+    assert [method for method, _ in client.query.calls] == ["near_vector", "hybrid"]
+    assert client.query.calls[0][1]["near_vector"] == client.query.calls[1][1]["vector"]
+    # The query embedding is computed once
+    assert calls == [["attention"]]
+
+
+def test_get_filters():
+    assert get_filters() is None
+    url_filter = get_filters(url="https://example.com/a.pdf")
+    assert url_filter.value == "https://example.com/a.pdf"
+    assert get_filters(url=["a", "b"]).value == ["a", "b"]
+    assert len(get_filters(url="a", title="Attention*").filters) == 2
+
+
+def test_generate():
+    client = FakeClient()
+    result = generate(client, "What is attention?", limit=2, title="Attention*")
+    assert result["answer"] == "An answer"
+    assert [c["chunk"] for c in result["chunks"]] == ["chunk 0", "chunk 1"]
+    method, kwargs = client.generate.calls[0]
+    assert method == "hybrid"
+    assert "What is attention?" in kwargs["grouped_task"]
+    assert kwargs["filters"] is not None
+
+    generate(client, "What is attention?", limit=2, title="Attention*")
+    generate(client, "What is attention?", task="Summarise", limit=2, title="Attention*")
+    assert len(client.generate.calls) == 2
+    assert get_query_stats()["generate"]["count"] == 2
@@ -0,0 +1,69 @@
+from distyll.schema import (
+    CollectionConfig,
+    get_collection_kwargs,
+    get_config_changes,
+    can_update_in_place,
+    get_update_kwargs,
+)
+from dataclasses import replace
+import pytest
+
+
+def test_collection_config_validation():
+    with pytest.raises(ValueError):
+        CollectionConfig(vector_index="ivf")
+    with pytest.raises(ValueError):
+        CollectionConfig(quantizer="rq")
+    with pytest.raises(ValueError):
+        CollectionConfig(vector_index="flat", quantizer="pq")
+
+
+def test_get_collection_kwargs():
+    kwargs = get_collection_kwargs(
+        CollectionConfig(ef=100, max_connections=16, quantizer="pq", pq_segments=96), False
+    )
+    index = kwargs["vector_index_config"]
+    assert index.vector_index_type().value == "hnsw"
+    assert (index.ef, index.maxConnections, index.quantizer.segments) == (100, 16, 96)
+    properties = {p.name: p for p in kwargs["properties"]}
+    assert properties["url"].tokenization.value == "field"
+    assert properties["chunk_no"].indexRangeFilters
+    assert kwargs["vectorizer_config"].vectorizer.value == "text2vec-openai"
+
+    kwargs = get_collection_kwargs(CollectionConfig(vector_index="dynamic", quantizer="bq"), True)
+    index = kwargs["vector_index_config"]
+    assert index.vector_index_type().value == "dynamic"
+    assert index.flat.quantizer is not None and index.hnsw.quantizer is not None
+    assert kwargs["vectorizer_config"].vectorizer.value == "none"
+
+
+def test_config_changes():
+    current = CollectionConfig()
+    assert get_config_changes(current, CollectionConfig()) == {}
+    # Settings left to Weaviate are not compared
+    assert get_config_changes(replace(current, pq_segments=96), current) == {}
+
+    changes = get_config_changes(current, replace(current, ef=64, bm25_k1=1.5))
+    assert changes == {"ef": (-1, 64), "bm25_k1": (1.2, 1.5)}
+    assert can_update_in_place(current, changes)
+
+    # Quantization can be enabled, but not changed or disabled
+    pq = replace(current, quantizer="pq", pq_segments=96)
+    assert can_update_in_place(current, get_config_changes(current, pq))
+    assert not can_update_in_place(pq, get_config_changes(pq, replace(pq, quantizer="sq")))
+    assert not can_update_in_place(pq, get_config_changes(pq, current))
+
+    for target in [
+        replace(current, vector_index="flat"),
+        replace(current, max_connections=64),
+        replace(current, distance="dot"),
+        replace(current, url_tokenization="word"),
+    ]:
+        assert not can_update_in_place(current, get_config_changes(current, target))
+
+    # HNSW settings do not apply to flat indexes, and cannot be updated on dynamic ones
+    flat = CollectionConfig(vector_index="flat")
+    assert get_config_changes(flat, replace(flat, ef=64)) == {}
+    dynamic = CollectionConfig(vector_index="dynamic")
+    assert not can_update_in_place(dynamic, get_config_changes(dynamic, replace(dynamic, ef=64)))
+    assert "vector_index_config" not in get_update_kwargs(dynamic)
@@ -3,12 +3,42 @@ from distyll.utils import (
     download_youtube_video,
     get_yt_video_id,
     get_openai_client,
+    get_async_openai_client,
     set_api_key,
+    transcribe_audio_segment,
+    transcribe_audio_segments,
+    iter_audio_segments,
+    get_audio_duration,
+    find_quiet_point,
+    plan_segment_boundaries,
+    extract_audio_segments,
+    get_audio_segments_from_video,
+    encode_audio_segment,
+    get_audio_stream_info,
+    get_audio_profile,
+    get_max_segment_len,
+    download_youtube_cached,
+    download_youtube_many,
+    get_youtube_meta_path,
+    get_youtube_playlist_urls,
+    is_youtube_playlist,
+    iter_chunk_text,
+    chunk_text_by_num_words,
+    chunk_text_by_num_chars,
+    remove_multiple_whitespaces,
+    iter_chunks_by_num_tokens,
 )
 import logging
 import distyll.loggerconfig
 from pathlib import Path
+import json
 import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
 
 
 youtube_testdata = [
@@ -29,6 +59,102 @@ def test_yt_video_download(yt_url, title):
     download_youtube_video(yt_url, video_path)
 
 
+class FakeYoutubeDL:
+    """Stand-in for `yt_dlp.YoutubeDL`, recording the `extract_info` calls"""
+
+    calls = list()
+    playlists = dict()
+    lock = threading.Lock()
+
+    def __init__(self, params):
+        self.params = params
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download=True, process=True):
+        with self.lock:
+            self.calls.append((url, download))
+        if url in self.playlists:
+            return self.playlists[url]
+        video_id = get_yt_video_id(url)
+        if download:
+            time.sleep(0.02)
+            Path(self.params["outtmpl"] + ".mp3").write_bytes(b"audio")
+        return {"id": video_id, "title": f"Video {video_id}", "upload_date": "20240101", "formats": []}
+
+
+@pytest.fixture
+def fake_yt_dlp(monkeypatch):
+    import types
+
+    FakeYoutubeDL.calls = list()
+    FakeYoutubeDL.playlists = dict()
+    monkeypatch.setitem(sys.modules, "yt_dlp", types.SimpleNamespace(YoutubeDL=FakeYoutubeDL))
+    return FakeYoutubeDL
+
+
+def test_yt_audio_is_cached_with_metadata(fake_yt_dlp, tmp_path):
+    url = "https://www.youtube.com/watch?v=6GEMkvT0DEk"
+    path = tmp_path / "6GEMkvT0DEk.mp3"
+    metadata = download_youtube_cached(url, path)
+    assert metadata["title"] == "Video 6GEMkvT0DEk"
+    assert "formats" not in metadata
+    # Resolved and downloaded in a single pass, with the metadata kept next to the audio
+    assert fake_yt_dlp.calls == [(url, True)]
+    assert path.exists()
+    assert json.loads(get_youtube_meta_path(path).read_text()) == metadata
+
+    # No network requests once cached
+    assert download_youtube_cached(url, path) == metadata
+    assert len(fake_yt_dlp.calls) == 1
+
+    # Audio downloaded without metadata: only the metadata is fetched
+    get_youtube_meta_path(path).unlink()
+    assert download_youtube_cached(url, path) == metadata
+    assert fake_yt_dlp.calls[1:] == [(url, False)]
+
+
+def test_yt_playlist_fan_out(fake_yt_dlp, tmp_path):
+    playlist_url = "https://www.youtube.com/playlist?list=PL123"
+    channel_url = "https://www.youtube.com/@channel"
+    assert is_youtube_playlist(playlist_url) and is_youtube_playlist(channel_url)
+    assert not is_youtube_playlist("https://www.youtube.com/watch?v=6GEMkvT0DEk")
+
+    video_ids = [f"video{i:06d}" for i in range(6)]
+    fake_yt_dlp.playlists = {
+        playlist_url: {"entries": [{"id": v, "ie_key": "Youtube"} for v in video_ids[:4]]},
+        # Channels list their tabs, which list their videos
+        channel_url: {"entries": [{"url": channel_url + "/videos", "ie_key": "YoutubeTab"}]},
+        channel_url + "/videos": {
+            "entries": [{"id": v, "ie_key": "Youtube"} for v in video_ids[2:]]
+        },
+    }
+    assert get_youtube_playlist_urls(channel_url) == [
+        f"https://www.youtube.com/watch?v={v}" for v in video_ids[2:]
+    ]
+
+    fake_yt_dlp.calls = list()
+    results = download_youtube_many(
+        [playlist_url, channel_url, "https://youtu.be/video000000"],
+        dl_dir=tmp_path,
+        max_workers=3,
+    )
+    # Each video is downloaded once, in order
+    assert [get_yt_video_id(r["url"]) for r in results] == video_ids
+    assert all(r["error"] is None and r["path"].exists() for r in results)
+    assert sum(download for _, download in fake_yt_dlp.calls) == 6
+
+    # Nothing is downloaded again
+    fake_yt_dlp.calls = list()
+    results = download_youtube_many([playlist_url], dl_dir=tmp_path)
+    assert [r["metadata"]["id"] for r in results] == video_ids[:4]
+    assert fake_yt_dlp.calls == [(playlist_url, False)]
+
+
 openai_apikeys = [(os.getenv("OPENAI_APIKEY"), "a" * len(os.getenv("OPENAI_APIKEY")))]
 
 
@@ -40,3 +166,406 @@ def test_get_openai_client(valid_key, invalid_key):
     set_api_key(openai="b" * len(valid_key))
     client = get_openai_client()
     assert client.api_key == "b" * len(valid_key)
+
+
+def test_openai_client_registry():
+    client = get_openai_client(apikey="key-1")
+    assert get_openai_client(apikey="key-1") is client
+    assert get_openai_client(apikey="key-2") is not client
+    assert get_openai_client(apikey="key-1", max_connections=5) is not client
+
+    async_client = get_async_openai_client(apikey="key-1")
+    assert async_client.api_key == "key-1"
+    assert get_async_openai_client(apikey="key-1") is async_client
+    assert async_client is not client
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeTranscriptionClient:
+    """Stand-in for the OpenAI client exposing `audio.transcriptions.create`"""
+
+    def __init__(self, failures=None, delay=0.0):
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.audio = self
+        self.transcriptions = self
+
+    def create(self, model, file):
+        content = file.read().decode()
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            status_code = None
+            if self.failures.get(content):
+                status_code = self.failures[content].pop(0)
+        try:
+            time.sleep(self.delay)
+            if status_code is not None:
+                raise FakeStatusError(status_code)
+
+            class Transcript:
+                text = f"transcript of {content}"
+
+            return Transcript()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def clip_paths(tmp_path):
+    paths = list()
+    for i in range(6):
+        path = tmp_path / f"clip.{i}.mp3"
+        path.write_text(f"clip {i}")
+        paths.append(path)
+    return paths
+
+
+def test_transcribe_audio_segments_in_order(clip_paths):
+    client = FakeTranscriptionClient(delay=0.05)
+    results = transcribe_audio_segments(client, clip_paths, max_concurrency=3)
+    assert [r["text"] for r in results] == [f"transcript of clip {i}" for i in range(6)]
+    assert [r["segment"] for r in results] == list(range(6))
+    assert all(r["seconds"] >= 0.05 for r in results)
+    assert 1 < client.max_in_flight <= 3
+
+
+def test_transcribe_audio_segments_retries(clip_paths):
+    client = FakeTranscriptionClient(failures={"clip 2": [429, 503]})
+    results = transcribe_audio_segments(client, clip_paths, backoff_factor=0)
+    assert results[2]["text"] == "transcript of clip 2"
+    assert results[2]["attempts"] == 3
+    assert client.calls == 8
+
+
+def test_transcribe_audio_segments_no_retry_on_client_error(clip_paths):
+    client = FakeTranscriptionClient(failures={"clip 1": [400]})
+    with pytest.raises(FakeStatusError):
+        transcribe_audio_segments(client, clip_paths, backoff_factor=0)
+
+
+def test_transcribe_audio_segment_retries_do_not_multiply(clip_paths):
+    from openai import OpenAI, DefaultHttpxClient, InternalServerError
+    import httpx
+
+    requests = list()
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503, json={"error": {"message": "Unavailable"}})
+
+    client = OpenAI(
+        api_key="sk-test",
+        max_retries=2,
+        http_client=DefaultHttpxClient(transport=httpx.MockTransport(handler)),
+    )
+    with pytest.raises(InternalServerError):
+        transcribe_audio_segment(client, clip_paths[0], max_retries=1, backoff_factor=0)
+    assert len(requests) == 2
+
+
+requires_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="ffmpeg is not installed"
+)
+
+
+@pytest.fixture
+def sine_mp3(tmp_path):
+    path = tmp_path / "sine.mp3"
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=25", str(path)],
+        check=True,
+    )
+    return path
+
+
+@requires_ffmpeg
+def test_iter_audio_segments(sine_mp3):
+    assert get_audio_duration(sine_mp3) == pytest.approx(25, abs=0.2)
+    segments = list(
+        iter_audio_segments(
+            sine_mp3, max_segment_len=10, overlap=5, split_on_silence=False, profile="mp3"
+        )
+    )
+    assert [s["segment"] for s in segments] == [0, 1, 2]
+    assert [s["start"] for s in segments] == [0, 5, 15]
+    assert segments[-1]["end"] == pytest.approx(25, abs=0.2)
+    for segment in segments:
+        assert segment["audio"].name.endswith(".mp3")
+        assert len(segment["audio"].getvalue()) > 0
+    # Nothing is written next to the source file
+    assert list(sine_mp3.parent.iterdir()) == [sine_mp3]
+
+
+@requires_ffmpeg
+def test_transcribe_in_memory_segments(sine_mp3):
+    client = FakeTranscriptionClient()
+    client.create = lambda model, file: type("T", (), {"text": file.name})()
+    segments = iter_audio_segments(
+        sine_mp3, max_segment_len=10, overlap=5, split_on_silence=False, profile="mp3"
+    )
+    results = transcribe_audio_segments(client, segments, max_concurrency=2)
+    assert [r["text"] for r in results] == [f"sine.{i}.mp3" for i in range(3)]
+    assert [r["start"] for r in results] == [0, 5, 15]
+
+
+@requires_ffmpeg
+def test_encode_audio_segment_profiles(sine_mp3, tmp_path):
+    sizes = dict()
+    for profile, codec in [("opus", "opus"), ("mp3", "mp3")]:
+        path = tmp_path / f"segment.{get_audio_profile(profile)['extension']}"
+        path.write_bytes(encode_audio_segment(sine_mp3, 0, 20, profile=profile))
+        assert get_audio_stream_info(path)["codec"] == codec
+        assert get_audio_duration(path) == pytest.approx(20, abs=0.2)
+        sizes[profile] = path.stat().st_size
+    # Sizes follow the profile bitrates: 20 seconds at 24 kb/s is 60 kB
+    assert sizes["opus"] < 60_000 * 1.1
+    assert sizes["opus"] < sizes["mp3"] < sine_mp3.stat().st_size * 20 / 25
+
+    with pytest.raises(ValueError):
+        get_audio_profile("flac")
+
+
+@requires_ffmpeg
+def test_iter_audio_segments_size_budget(sine_mp3):
+    assert get_max_segment_len(24, max_segment_bytes=24_000_000) == 7200
+    # The whole file fits the default budget
+    assert len(list(iter_audio_segments(sine_mp3, split_on_silence=False))) == 1
+
+    # 30 kB at 24 kb/s, less the margin: 9 seconds
+    segments = list(
+        iter_audio_segments(sine_mp3, split_on_silence=False, max_segment_bytes=30_000)
+    )
+    assert [s["end"] for s in segments[:-1]] == [9, 18]
+    assert segments[0]["audio"].name == "sine.0.ogg"
+    assert all(len(s["audio"].getvalue()) < 30_000 for s in segments)
+
+
+def test_find_quiet_point():
+    import numpy as np
+
+    sample_rate = 1000
+    samples = (np.sin(np.arange(10 * sample_rate)) * 10000).astype(np.int16)
+    samples[3000:3500] = 0
+    samples[6000:6500] = 0
+    # Ties go to the quiet frame closest to the end of the window
+    assert 6.0 < find_quiet_point(samples, sample_rate) < 6.5
+    assert find_quiet_point(samples[:10], sample_rate) == pytest.approx(0.01)
+
+
+@requires_ffmpeg
+def test_plan_segment_boundaries(tmp_path):
+    path = tmp_path / "gaps.mp3"
+    expr = "if(between(t,7.5,8.5)+between(t,16,17),0,0.5*sin(2*PI*440*t))"
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", f"aevalsrc='{expr}':d=25", str(path)],
+        check=True,
+    )
+    boundaries = plan_segment_boundaries(path, max_segment_len=10, search_window=4)
+    assert len(boundaries) == 3
+    (s0, e0), (s1, e1), (s2, e2) = boundaries
+    assert s0 == 0 and e0 == s1 and e1 == s2
+    assert 7.5 <= e0 <= 8.5
+    assert 16 <= e1 <= 17
+    assert e2 == pytest.approx(25, abs=0.2)
+    assert all(end - start <= 10 for start, end in boundaries)
+
+
+@pytest.fixture
+def sine_video(tmp_path):
+    path = tmp_path / "sine.mp4"
+    inputs = ["-f", "lavfi", "-i", "testsrc=duration=25:size=160x120:rate=5"]
+    inputs += ["-f", "lavfi", "-i", "sine=duration=25"]
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", *inputs, "-c:v", "mpeg4", "-c:a", "aac", "-shortest", str(path)],
+        check=True,
+    )
+    return path
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize("stream_copy, extension", [(True, ".m4a"), (False, ".ogg")])
+def test_extract_audio_segments(sine_video, stream_copy, extension):
+    segments = extract_audio_segments(sine_video, max_segment_len=10, stream_copy=stream_copy)
+    assert [s["segment"] for s in segments] == [0, 1, 2]
+    assert segments[0]["start"] == 0
+    assert segments[-1]["end"] == pytest.approx(25, abs=0.2)
+    for segment in segments:
+        assert segment["audio"].suffix == extension
+        assert get_audio_duration(segment["audio"]) == pytest.approx(
+            segment["end"] - segment["start"], abs=0.2
+        )
+
+    # Extracted segments are reused
+    mtimes = [s["audio"].stat().st_mtime for s in segments]
+    again = extract_audio_segments(sine_video, max_segment_len=10, stream_copy=stream_copy)
+    assert again == segments
+    assert [s["audio"].stat().st_mtime for s in segments] == mtimes
+
+
+def test_get_audio_segments_from_video_fallback(tmp_path, monkeypatch):
+    import distyll.utils
+
+    def fail(*args, **kwargs):
+        raise subprocess.CalledProcessError(1, "ffmpeg")
+
+    audio_path = tmp_path / "video.mp3"
+    monkeypatch.setattr(distyll.utils, "extract_audio_segments", fail)
+    monkeypatch.setattr(distyll.utils, "get_audio_from_video", lambda path: audio_path)
+    monkeypatch.setattr(
+        distyll.utils,
+        "iter_audio_segments",
+        lambda path, max_segment_len, profile: [{"segment": 0, "audio": path}],
+    )
+    segments = get_audio_segments_from_video(tmp_path / "video.mp4", max_segment_len=10)
+    assert list(segments) == [{"segment": 0, "audio": audio_path}]
+
+
+def test_transcribe_audio_segments_cache(clip_paths, tmp_path):
+    cache_dir = tmp_path / "cache"
+    client = FakeTranscriptionClient(failures={"clip 4": [400]})
+    with pytest.raises(FakeStatusError):
+        transcribe_audio_segments(
+            client, clip_paths, max_concurrency=1, cache_dir=cache_dir
+        )
+    assert len(list(cache_dir.iterdir())) == 4
+
+    # Only the failed and never-attempted segments are sent again
+    client = FakeTranscriptionClient()
+    results = transcribe_audio_segments(client, clip_paths, cache_dir=cache_dir)
+    assert client.calls == 2
+    assert [r["cached"] for r in results] == [True] * 4 + [False, False]
+    assert [r["text"] for r in results] == [f"transcript of clip {i}" for i in range(6)]
+
+    # Identical audio is deduplicated, regardless of where it came from
+    copy_path = tmp_path / "copy.mp3"
+    copy_path.write_bytes(clip_paths[0].read_bytes())
+    results = transcribe_audio_segments(client, [copy_path], cache_dir=cache_dir)
+    assert results[0]["cached"]
+
+    # Different parameters do not share cache entries
+    results = transcribe_audio_segments(
+        client, [copy_path], cache_dir=cache_dir, cache_params={"max_segment_len": 60}
+    )
+    assert not results[0]["cached"]
+
+
+@requires_ffmpeg
+def test_encoded_segment_transcripts_are_cached(sine_mp3, tmp_path):
+    class NamingClient(FakeTranscriptionClient):
+        def create(self, model, file):
+            self.calls += 1
+            return type("T", (), {"text": file.name})()
+
+    cache_dir = tmp_path / "cache"
+    for n_calls in [3, 0]:
+        client = NamingClient()
+        segments = iter_audio_segments(sine_mp3, max_segment_len=10, split_on_silence=False)
+        results = transcribe_audio_segments(client, segments, cache_dir=cache_dir)
+        # Segments encode to the same bytes on every run, so the second run is fully cached
+        assert client.calls == n_calls
+        assert [r["cached"] for r in results] == [n_calls == 0] * 3
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_iter_chunk_text_matches_chunk_text(seed):
+    rng = random.Random(seed)
+    alphabet = ["word", "a", "bc", " ", "  ", "\n", "\t", "\n\n "]
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 200)))
+        cuts = sorted(rng.sample(range(len(text) + 1), k=min(len(text) + 1, 5)))
+        pieces = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        chunk_len = rng.randint(1, 15)
+        overlap = rng.choice([0, 0.1, 0.25, 0.5])
+        normalized = remove_multiple_whitespaces(text)
+        for prevent in [True, False]:
+            expected = chunk_text_by_num_words(normalized, chunk_len, overlap, prevent)
+            assert list(iter_chunk_text(pieces, "words", chunk_len, overlap, prevent)) == expected
+        expected = chunk_text_by_num_chars(normalized, chunk_len, overlap)
+        assert list(iter_chunk_text(pieces, "chars", chunk_len, overlap)) == expected
+
+
+def test_iter_chunk_text_is_lazy():
+    pages_read = list()
+
+    def pages():
+        for i in range(1000):
+            pages_read.append(i)
+            yield f"page {i} " * 50
+
+    chunks = iter_chunk_text(pages(), token_length=100)
+    assert next(chunks) == "page 0 " * 49 + "page 0"
+    assert next(chunks).endswith("page 1 page 1")
+    assert len(pages_read) <= 4
+
+
+@pytest.fixture
+def toy_encoding():
+    """Byte-level BPE encoding with a few merges, so no BPE files need to be downloaded"""
+    tiktoken = pytest.importorskip("tiktoken")
+    mergeable_ranks = {bytes([i]): i for i in range(256)}
+    for merge in [b"th", b"he", b"the", b" the"]:
+        mergeable_ranks[merge] = len(mergeable_ranks)
+    return tiktoken.Encoding(
+        name="toy",
+        pat_str=r""" ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=mergeable_ranks,
+        special_tokens={},
+    )
+
+
+def test_iter_chunks_by_num_tokens(toy_encoding):
+    source_text = "the other theme " * 40 + "你好"
+    chunks = list(
+        iter_chunks_by_num_tokens(
+            source_text, max_chunk_tokens=50, overlap_fraction=0.2, encoding=toy_encoding
+        )
+    )
+    assert len(chunks) > 1
+    # The overlap is prepended to each chunk after the first
+    assert len(toy_encoding.encode(chunks[0])) <= 50
+    for chunk in chunks[1:-2]:
+        assert len(toy_encoding.encode(chunk)) <= 50 + 10
+    assert source_text.startswith(chunks[0])
+    assert chunks[-1].endswith("你好")
+
+
+def test_chunk_text_by_tokens(toy_encoding, monkeypatch):
+    import distyll.utils
+
+    monkeypatch.setattr(distyll.utils, "get_tokenizer", lambda name: toy_encoding)
+    pages = ["the  other\n", "theme "] * 30
+    chunks = list(iter_chunk_text(pages, "tokens", 20))
+    assert chunks == list(
+        iter_chunks_by_num_tokens("the other theme " * 30, 20, encoding=toy_encoding)
+    )
+    assert len(chunks) > 1
+
+
+def test_import_chunk_text_is_light():
+    # A fresh interpreter, so modules imported by other tests do not count
+    code = (
+        "import sys; before = set(sys.modules); "
+        "from distyll.utils import chunk_text; "
+        "print('\\n'.join(sorted(set(sys.modules) - before)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    loaded = set(result.stdout.split())
+    for heavy in ["openai", "yt_dlp", "requests", "httpx", "numpy", "weaviate", "pypdf"]:
+        assert heavy not in loaded
+    assert not {"distyll.text", "distyll.transcripts", "distyll.llm"} & loaded
+    # About 50 modules today; eager imports of the dependencies above load over 1000
+    assert len(loaded) < 150